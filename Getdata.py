@@ -50,37 +50,49 @@
 #   - Add support for ofx import from ./import subfolder.  any file present in ./import will be inspected,
 #     and if it looks like a valid OFX file, will be processed the same as a downloaded statement (scrubbed, etc.)
 
+#18Oct2026*rlc
+#   - Download accounts concurrently via ofx.getOFXList().  Files are still sent to Money in account order.
+#   - Close pooled bank connections when downloads are complete
+#   - Support incremental downloads (sites.dat option).  Watermarks are saved for statements sent to Money.
+#   - Report download bandwidth saved for sites using compression
+#   - Save connection timing to xfrdir/metrics.jsonl and print a summary by site
+#   - Use the shared site configuration (site_cfg.getSiteCfg)
+#   - getSite() uses the site_cfg fid/bankid/brokerid indexes, rather than scanning every site
+#   - Save new clientUID keys (connect.key) when downloads are complete
+#   - Combined statements may be split into several files (combineMaxBytes/combineMaxTrans options)
+#   - Import folder:  validate each file as it's read (streaming validOFX), and only load valid files
+#   - getSite() reads the FID/BANKID/BROKERID values w/ the ofxdoc tokenizer
+#   - Import folder:  files are scrubbed in parallel (scrubber.pool), after all of them have been read.
+#     Scrubber messages are printed per file, in import order.  A file that can't be scrubbed is left 
+#     in the import folder
+#   - Import folder:  files that have already been scrubbed are recognized by content (scrubber.scrubCache),
+#     rather than by rewriting NEWFILEUID:PSIMPORT into each file.  The marker is still honored for files
+#     imported by earlier versions
+
 import os, sys, glob, time, re
-import ofx, quotes, site_cfg, scrubber
+import ofx, quotes, site_cfg, scrubber, ofxdoc
 from control2 import *
 from rlib1 import *
 
-userdat = site_cfg.site_cfg()
+userdat = site_cfg.getSiteCfg()
+
+_siteFields = [['FID', 'fidIndex'], ['BANKID', 'bankidIndex'], ['BROKERID', 'brokeridIndex']]
 
 def getSite(ofx):
     # find matching site entry for ofx
-    # matches on FID or BANKID value found in ofx and in sites list
-    
-    #get fid value from ofx
-    site = None
-    p = re.compile(r'<FID>(.*?)[<\s]',re.IGNORECASE | re.DOTALL)
-    r = p.search(ofx)
-    fid = r.groups()[0] if r else 'undefined'
-    p = re.compile(r'<BANKID>(.*?)[<\s]',re.IGNORECASE | re.DOTALL)
-    r = p.search(ofx)
-    bankid = r.groups()[0] if r else 'undefined'
-    sites = userdat.sites
-    if fid or bankid:  
-        for s in sites:
-            if not site: site=sites[s]   #defaults to first site found, if matching fid/bankid not found
-            thisFid    = FieldVal(sites[s], 'fid')
-            thisBankid = FieldVal(sites[s], 'bankid')
-            if thisFid == fid or thisBankid == bankid:
-                site = sites[s]
-                print 'Matched import file to site *%s*' % s
-                break
-
-    return site
+    # matches on FID, BANKID or BROKERID value found in ofx and in sites list
+    # defaults to the first site, if a matching site isn't found
+    values = ofxdoc.firstValues(ofx, [tag for tag, index in _siteFields])
+    for tag, index in _siteFields:
+        if tag in values:
+            name = getattr(userdat, index).get(values[tag])
+            if name:
+                print 'Matched import file to site *%s*' % name
+                return userdat.sites[name]
+
+    if userdat.siteNames: 
+        return userdat.sites[userdat.siteNames[0]]
+    return None
 
 if __name__=="__main__":
 
@@ -94,10 +106,13 @@ if __name__=="__main__":
     if doit in "YI":
         #get download interval, if promptInterval=Yes in sites.dat
         interval = userdat.defaultInterval
+        incremental = userdat.incremental
         if userdat.promptInterval:
             try:
                 p = int2(raw_input("Download interval (days) [" + str(interval) + "]: "))
-                if p>0: interval = p
+                if p>0: 
+                    interval = p
+                    incremental = False     #user asked for a specific interval
             except:
                 print "Invalid entry. Using defaultInterval=" + str(interval)
         
@@ -118,6 +133,7 @@ if __name__=="__main__":
             os.system("del "+ofxfiles)
             
         print "Download interval= {0} days".format(interval)
+        if incremental: print "Incremental downloads enabled: accounts start at their last statement date"
         
         #create process Queue in the right order
         Queue = ['Accts', 'importFiles']
@@ -133,16 +149,16 @@ if __name__=="__main__":
                   print "No accounts have been configured. Run SETUP.PY to add accounts"
 
                 #process accounts
-                badConnects = []   #track [sitename, username] for failed connections so we don't risk locking an account
-                for acct in AcctArray:
-                    if [acct[0], acct[3]] not in badConnects:
-                        status, ofxFile = ofx.getOFX(acct, interval)
-                        if not status and userdat.skipFailedLogon: 
-                            badConnects.append([acct[0], acct[3]])
-                        else:
+                #results are returned in AcctArray order, so that statements are sent to Money in the expected order
+                #accounts are skipped (result=None) after a failed connection for the same [sitename, username],
+                #so we don't risk locking an account
+                results = ofx.getOFXList(AcctArray, interval, incremental)
+                for acct, result in zip(AcctArray, results):
+                    if result:
+                        status, ofxFile = result
+                        if status or not userdat.skipFailedLogon:
                             ofxList.append([acct[0], acct[1], ofxFile])
                         stat1 = stat1 and status
-                        print ""
                 
             if QEntry == 'importFiles':
                 #process files from import folder [manual user downloaded files]
@@ -150,34 +166,42 @@ if __name__=="__main__":
                 #attempts to find site entry by FID found in the ofx file
                 
                 print 'Searching %s for statements to import' % importdir
+                imports = []    #valid ofx files
+                jobs = []       #[file, site] for files to scrub
                 for f in glob.glob(importdir+'*.*'):
                     fname     = os.path.basename(f)   #full base filename.extension
-                    bname = os.path.splitext(fname)[0]     #basename w/o extension
-                    bext  = os.path.splitext(fname)[1]     #file extension
+                    #only import if it looks like an ofx file
                     with open(f) as ifile:
-                        dat = ifile.read()
+                        valid = (validOFX(ifile) == '')
+                        if valid:
+                            ifile.seek(0)
+                            dat = ifile.read()
 
-                    #only import if it looks like an ofx file
-                    if validOFX(dat) == '':
+                    if valid:
                         print "Importing %s" % fname
                         if 'NEWFILEUID:PSIMPORT' not in dat[:200]:
-                            #only scrub if it hasn't already been imported (and hence, scrubbed)
-                            site = getSite(dat)
-                            scrubber.scrub(f, site)
-                        
-                        #set NEWFILEUID:PSIMPORT to flag the file as having already been imported/scrubbed
-                        #don't want to accidentally scrub twice
-                        with open(f) as ifile:
-                            ofx = ifile.read()
-                        p = re.compile(r'NEWFILEUID:.*')
-                        ofx2 = p.sub('NEWFILEUID:PSIMPORT', ofx)
-                        if ofx2: 
-                            with open(f, 'w') as ofile:
-                                ofile.write(ofx2)
-                        #preserve origina file type but save w/ ofx extension
-                        outname = xfrdir+fname + ('' if bext=='.ofx' else '.ofx')
-                        os.rename(f, outname)
-                        ofxList.append(['import file', '', outname])
+                            #PSIMPORT = imported (and hence, scrubbed) by an earlier version.  otherwise, the
+                            #scrub pool skips a file if its contents have already been scrubbed (scrubCache)
+                            jobs.append([f, getSite(dat)])
+                        imports.append(f)
+                
+                #scrub the files in the scrubber process pool.  results are returned in import order
+                failed = []
+                for f, msgs, error in scrubber.pool.scrubFiles(jobs):
+                    if msgs or error: print "Scrubbing %s" % os.path.basename(f)
+                    scrubber.printMsgs(msgs)
+                    if error:
+                        print "** Scrub failed: %s.  File left in %s" % (error, importdir)
+                        failed.append(f)
+                
+                for f in imports:
+                    if f in failed: continue
+                    fname = os.path.basename(f)
+                    bext  = os.path.splitext(fname)[1]     #file extension
+                    #preserve origina file type but save w/ ofx extension
+                    outname = xfrdir+fname + ('' if bext=='.ofx' else '.ofx')
+                    os.rename(f, outname)
+                    ofxList.append(['import file', '', outname])
                             
             #get stock/fund quotes
             if QEntry == 'Quotes' and getquotes:
@@ -191,12 +215,21 @@ if __name__=="__main__":
                 # display the HTML file after download if requested to always do so
                 if status and userdat.showquotehtm: os.startfile(htmFileName)                            
 
+        #done with the bank servers (and scrubber processes) for this session
+        ofx.connPool.closeAll()
+        scrubber.pool.close()
+        clientUIDs.flush()
+        ofx.transferStats.report()
+        ofx.metrics.write()
+        ofx.metrics.summary()
+
         if len(ofxList) > 0:
             print '\nFinished downloading data\n'
             verify = False
             gogo = 'Y'
             if userdat.combineofx and gogo <> 'V':
-                cfile=combineOfx(ofxList)       #create combined file
+                #create combined file(s)
+                cfiles=combineOfx(ofxList, userdat.combineMaxBytes, userdat.combineMaxTrans)
 
             if doit == 'I' or Debug:
                 gogo = raw_input('Upload online data to Money? (Y/N/V=Verify) [Y] ').upper()
@@ -210,8 +243,11 @@ if __name__=="__main__":
                     raw_input('ForceQuote statement loaded.  Accept in Money and press <Enter> to continue.')
 
                 print '\nSending statement(s) to Money...'
-                if userdat.combineofx and cfile and gogo <> 'V':
-                    runFile(cfile)
+                if userdat.combineofx and cfiles and gogo <> 'V':
+                    for cfile in cfiles:
+                        runFile(cfile)
+                        time.sleep(0.5)   #slight delay, to force load order in Money
+                    ofx.watermarks.commit([file[2] for file in ofxList])
                 else:
                     for file in ofxList:
                         upload = True
@@ -222,6 +258,7 @@ if __name__=="__main__":
                         if upload: 
                            if Debug: print "Importing " + file[2]
                            runFile(file[2])
+                           ofx.watermarks.commit([file[2]])
                         
                         time.sleep(0.5)   #slight delay, to force load order in Money
 
@@ -30,8 +30,15 @@
 #16Sep2019*rlc
 #   - create ./import folder during setup
 
+#18Oct2026*rlc
+#   - close pooled https connections (shared w/ ofx.py) on exit
+#   - use the shared site configuration (site_cfg.getSiteCfg)
+#   - use the sorted site name list from site_cfg
+#   - save clientUID key changes (rlib1.clientUIDs) after a reset/delete, and on exit
+#   - list the accounts returned by the site w/ the ofxdoc tokenizer
+
 import os, sys, glob, re, pickle, shutil, time, urllib2
-import pyDes, ofx, quotes, site_cfg, filecmp
+import pyDes, ofx, quotes, site_cfg, filecmp, ofxdoc
 import rlib1  #common control/utilities
 from control2 import *  #global settings
 
@@ -128,9 +135,8 @@ def config_account():
             print '\nEnter line #, *or* the actual account number\n'
             print '\nAccount List'
             print '------------'
-            alist = re.findall(r'<ACCTID>(.*?)<', response,         #get list of account entries
-                               flags=re.DOTALL | re.IGNORECASE)   
-            alist = [a.rstrip() for a in alist]                     #strip trailing whitespace/newlines/etc
+            alist = [value for tag, value, start, end, vstart, vend     #get list of account entries
+                     in ofxdoc.leaves(response, ['ACCTID'])]
             alist = sorted(alist)
             
             i=1
@@ -232,15 +238,10 @@ if __name__=="__main__":
         if backup: shutil.copy('sites.dat', 'sites.bak')
             
     #get the user parameters
-    userdat = site_cfg.site_cfg()
+    userdat = site_cfg.getSiteCfg()
     Sites = userdat.sites
 
-    #build a Sitenames list one time
-    Sitenames = []  #Sitenames array
-    for site in Sites:
-        Sitenames.append(site)
-
-    Sitenames.sort()
+    Sitenames = userdat.siteNames   #sorted Sitenames array
     
     #do we already have a configuration file?  if so, read it in.
     pwkey, c_getquotes, AcctArray = rlib1.get_cfg()
@@ -335,6 +336,7 @@ if __name__=="__main__":
                         if acct[0]==sitename and acct[3]==user: found=True
                     if not found:
                         rlib1.clientUID(url, user, delKey=True)
+                        rlib1.clientUIDs.flush()
                         if action=='R': print 'Connection settings reset for %s @ %s' % (user, urlHost)
                     
         elif menu_option == 4:
@@ -399,6 +401,9 @@ if __name__=="__main__":
         
     #end_while (main menu)
     
+    ofx.connPool.closeAll()    #close any open bank connections
+    rlib1.clientUIDs.flush()   #save new connection keys
+    
     pwkey_e = ''
     if pwkey <> '':
         #encrypt the data
@@ -0,0 +1,826 @@
+# benchmark.py
+# http://sites.google.com/site/pocketsense/
+# performance benchmarks for the download and statement processing code
+# Intial version: rlc: 18Oct2026
+
+# Usage: benchmark.py <command> [options]      (benchmark.py <command> -h for the options)
+#
+# Commands:
+#   download : download statements for N mock institutions (see mockofx.py) w/ the same account loop used
+#              by Getdata (ofx.getOFXList).  Reports wall time, throughput and peak memory.
+#   sitecfg  : load a generated sites.dat w/ a large site catalog, parsed vs from the sites.cache file
+#   combine  : combine mock statements (bank, card and large brokerage files) into one file (rlib1.combineOfx)
+#   parse    : ofxdoc tokenizer and element tree vs the regex searches they replaced, on a large statement
+#   stream   : check and scrub a very large statement in memory vs streaming (ofx._checkOFXFile).  Reports
+#              time and peak memory for each
+#   scrub    : scrub large bank, card and brokerage statements w/ the original scrub steps (a frozen copy,
+#              one pass per fix) vs the scrub rule engine, in memory (scrubber.scrubOFX) and in pieces 
+#              (scrubber.scrubStream).  Fails (exit status 1) if the outputs differ
+#   discover : Discover card FITID de-duplication on a large statement w/ many transactions per FITID base,
+#              vs the original list search.  Also reports the scrub time for the statement
+#   pathological : scrub single-line brokerage statements w/ incomplete buy/sell/reinvest transactions 
+#              (no TOTAL), at two sizes.  Fails (exit status 1) if the scrub time grows faster than linearly
+#   dates    : shift DTASOF values (scrubber timeOffset) w/ strptime/strftime vs the fixed-width parser and the
+#              saved results for a statement (scrubber._TimeShift)
+#   scrubpool : scrub mock statement files one at a time vs in the scrubber process pool (scrubber.ScrubPool)
+#   scrubcache : import files that have already been scrubbed:  NEWFILEUID:PSIMPORT rewrite vs the content
+#              hash check (scrubber.ScrubCache)
+#
+# Benchmarks run in a temporary directory w/ a generated sites.dat, so the user's sites.dat, connect.key
+# and xfr folder aren't touched.  Mock servers run in a separate process, so server time isn't
+# charged to the client (except for the wall time, which includes the server "think time").
+
+import os, sys, time, tempfile, shutil, timeit, multiprocessing
+from optparse import OptionParser
+import mockofx
+
+try:
+    import resource         #not available on Windows
+except ImportError:
+    resource = None
+
+pkgdir = os.path.dirname(os.path.abspath(__file__))
+
+class NullOutput:
+    #discard print output from the code being timed
+    def write(self, s): pass
+    def flush(self): pass
+
+def maxrss():
+    #peak memory use (MB) for this process, or None if unknown
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': rss = rss / 1024     #bytes on Mac, KB elsewhere
+    return rss / 1024.0
+
+def _serveMock(count, options, ports, stop):
+    #child process: start count mock servers, return their ports, and wait for stop
+    servers = [mockofx.start(seed=i, **options) for i in range(count)]
+    for server in servers:
+        ports.put(server.server_address[1])
+    stop.wait()
+    for server in servers:
+        server.shutdown()
+
+def plainHTTP(ofx):
+    #connect ofx.connPool to the mock servers, which only speak plain http.  ofx.py itself always uses
+    #https:  its connection factory is replaced here, for the benchmark process only
+    import httplib
+    class TimedHTTPConnection(httplib.HTTPConnection):
+        #plain http version of ofx.TimedHTTPSConnection
+        timer = None
+        
+        def connect(self):
+            ofx._timedConnect(self, self.timer or ofx.PhaseTimer())
+    
+    def connect(host):
+        h = TimedHTTPConnection(host, timeout=5)
+        if ofx.Debug: h.set_debuglevel(1)
+        return h
+    ofx.connPool.connect = connect
+
+def startMock(count, **options):
+    #start count mock institutions in a child process.  returns [process, stop event, urls]
+    ports = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    p = multiprocessing.Process(target=_serveMock, args=(count, options, ports, stop))
+    p.daemon = True
+    p.start()
+    urls = ['http://127.0.0.1:%d/ofx' % ports.get(timeout=30) for i in range(count)]
+    return [p, stop, urls]
+
+class Sandbox:
+    #temporary working directory w/ a generated sites.dat.  the current directory is restored by close()
+    def __init__(self, general, sites, stocks=[], funds=[]):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='pocketsense-bench-')
+        f = open(os.path.join(self.dir, 'sites.dat'), 'w')
+        for key in general:
+            f.write('%s: %s\n' % (key, general[key]))
+        for site in sites:
+            f.write('\n<site>\n')
+            for key in site:
+                f.write('    %-12s: %s\n' % (key, site[key]))
+            f.write('</site>\n')
+        for tag, tickers in [['stocks', stocks], ['funds', funds]]:
+            if tickers:
+                f.write('\n<%s>\n    %s\n</%s>\n' % (tag, '\n    '.join(tickers), tag))
+        f.close()
+        os.chdir(self.dir)
+        os.mkdir('xfr')
+
+    def clean(self):
+        #delete downloaded files
+        for fname in os.listdir('xfr'):
+            os.remove(os.path.join('xfr', fname))
+
+    def close(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, True)
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)/2]
+
+def download(args):
+    parser = OptionParser(usage='%prog download [options]')
+    parser.add_option('-s', '--sites', type='int', default=4, help='mock institutions [%default]')
+    parser.add_option('-a', '--accounts', type='int', default=3, help='accounts per institution [%default]')
+    parser.add_option('-t', '--type', default='mix', choices=['bank', 'cc', 'inv', 'mix'],
+                      help='account type: bank, cc, inv or mix [%default]')
+    parser.add_option('-n', '--ntrans', type='int', default=100, help='transactions per statement [%default]')
+    parser.add_option('-m', '--memo', type='int', default=20, dest='memoSize', help='memo length (bytes) [%default]')
+    parser.add_option('-l', '--latency', type='float', default=0.2, help='server delay (seconds) [%default]')
+    parser.add_option('-e', '--errors', type='float', default=0.0, dest='errorRate',
+                      help='fraction of requests that fail [%default]')
+    parser.add_option('-c', '--cookie', action='store_true', default=False, help='servers require a session cookie')
+    parser.add_option('-w', '--workers', type='int', default=4, help='downloadWorkers [%default]')
+    parser.add_option('--site-connections', type='int', default=1, dest='siteConnections',
+                      help='maxSiteConnections [%default]')
+    parser.add_option('--scrub-workers', type='int', default=1, dest='scrubWorkers',
+                      help='scrubWorkers (0 = one per cpu) [%default]')
+    parser.add_option('--batch', action='store_true', default=False, help='batch statement requests')
+    parser.add_option('--compress', action='store_true', default=False, help='request compressed responses')
+    parser.add_option('--ofxver', default='102', help='OFX version [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    parser.add_option('-v', '--verbose', action='store_true', default=False, help='show download output')
+    opts, args = parser.parse_args(args)
+
+    proc, stop, urls = startMock(opts.sites, ntrans=opts.ntrans, memoSize=opts.memoSize, latency=opts.latency,
+                                 errorRate=opts.errorRate, cookie=opts.cookie)
+
+    types = {'bank': 'BASTMT', 'cc': 'CCSTMT', 'inv': 'INVSTMT'}
+    general = {'downloadWorkers': opts.workers, 'maxSiteConnections': opts.siteConnections,
+               'skipFailedLogon': 'No', 'incremental': 'No', 'quietScrub': 'Yes', 'scrubWorkers': opts.scrubWorkers}
+    sites = []
+    AcctArray = []
+    for i in range(opts.sites):
+        accttype = types[opts.type] if opts.type <> 'mix' else ['BASTMT', 'CCSTMT', 'INVSTMT'][i % 3]
+        sitename = 'MOCK%d' % (i+1)
+        sites.append({'SiteName': sitename, 'AcctType': accttype, 'fiorg': 'MockOFX', 'fid': '99999',
+                      'url': urls[i], 'bankid': '999999999', 'brokerid': 'mockofx.local', 'ofxVer': opts.ofxver,
+                      'batch': 'Yes' if opts.batch else 'No', 'compress': 'Yes' if opts.compress else 'No'})
+        for j in range(opts.accounts):
+            AcctArray.append([sitename, '%d%06d' % (i+1, j+1), 'CHECKING', 'user%d' % i, 'password'])
+
+    box = Sandbox(general, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import ofx          #sites.dat is read when ofx is loaded, so import after changing directories
+        plainHTTP(ofx)
+
+        print 'Downloading %d accounts from %d mock institutions (%s, %d transactions, %.2fs latency), %d workers' % \
+              (len(AcctArray), opts.sites, opts.type, opts.ntrans, opts.latency, opts.workers)
+        print ''
+        print '  {0:>4} {1:>9} {2:>8} {3:>10} {4:>10} {5:>9}'.format('run', 'wall(s)', 'ok', 'accts/s', 'KB/s', 'rss(MB)')
+        times = []
+        for run in range(opts.repeat):
+            box.clean()
+            nrec = len(ofx.metrics.records)
+            stdout = sys.stdout
+            if not opts.verbose: sys.stdout = NullOutput()
+            try:
+                t0 = timeit.default_timer()
+                results = ofx.getOFXList(AcctArray, 30)
+                ofx.connPool.closeAll()
+                elapsed = timeit.default_timer() - t0
+            finally:
+                sys.stdout = stdout
+
+            ok = len([r for r in results if r and r[0]])
+            nbytes = sum(rec['bytes'] for rec in ofx.metrics.records[nrec:])
+            rss = maxrss()
+            times.append(elapsed)
+            print '  {0:>4} {1:9.3f} {2:>8} {3:10.1f} {4:10.1f} {5:>9}'.format(run+1, elapsed,
+                    '%d/%d' % (ok, len(AcctArray)), len(AcctArray)/elapsed, nbytes/1024.0/elapsed,
+                    '%.1f' % rss if rss else 'n/a')
+        print ''
+        print '  best %.3fs, median %.3fs' % (min(times), median(times))
+        ofx.scrubber.pool.close()
+    finally:
+        box.close()
+        stop.set()
+        proc.join(5)
+
+def bestTime(fn, repeat):
+    #best wall time for repeat calls of fn
+    times = []
+    for i in range(repeat):
+        t0 = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - t0)
+    return min(times)
+
+def sitecfg(args):
+    parser = OptionParser(usage='%prog sitecfg [options]')
+    parser.add_option('-s', '--sites', type='int', default=500, help='site entries [%default]')
+    parser.add_option('-t', '--tickers', type='int', default=200, help='stock and fund symbols [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=5, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = []
+    for i in range(opts.sites):
+        sites.append({'SiteName': 'SITE%d' % i, 'AcctType': ['BASTMT', 'CCSTMT', 'INVSTMT'][i % 3],
+                      'fiorg': 'Financial Institution %d' % i, 'fid': str(10000+i),
+                      'url': 'https://ofx%d.example.com/ofx/servlet   #comment' % i,
+                      'bankid': '%09d' % i, 'brokerid': 'broker%d.example.com' % i, 'ofxVer': '102',
+                      'mininterval': '', 'timeOffset': '', 'delay': ''})
+    stocks = ['STK%d m:1.0 s:S%d' % (i, i) for i in range(opts.tickers/2)]
+    funds  = ['FND%dX' % i for i in range(opts.tickers/2)]
+
+    box = Sandbox({'DefaultInterval': 30}, sites, stocks, funds)
+    try:
+        sys.path.insert(0, pkgdir)
+        import site_cfg
+
+        def parse():
+            if os.path.exists('sites.cache'): os.remove('sites.cache')
+            return site_cfg.site_cfg()
+        parsed = parse()
+        cached = site_cfg.site_cfg()
+        same = parsed._cached() == cached._cached()
+        
+        print 'sites.dat: %d sites, %d tickers, %d KB' % (len(parsed.sites), len(parsed.stocks)+len(parsed.funds),
+                                                         os.path.getsize('sites.dat')/1024)
+        print ''
+        tParse = bestTime(parse, opts.repeat)
+        parse()
+        tCache = bestTime(site_cfg.site_cfg, opts.repeat)
+        print '  parse sites.dat  : %8.2f ms' % (tParse*1000)
+        print '  load sites.cache : %8.2f ms  (%.1fx)' % (tCache*1000, tParse/tCache)
+        print '  identical        : %s' % same
+    finally:
+        box.close()
+
+def mockStatements(count, ntrans, invEvery=5):
+    #generate count mock statement files in xfr (every invEvery'th one is an investment statement)
+    #returns an ofxList (as built by Getdata):  [[sitename, account, filename], ...]
+    fi = mockofx.MockInstitution(ntrans=ntrans)
+    ofxList = []
+    for i in range(count):
+        if i % invEvery == invEvery-1:
+            rq = '<INVSTMTTRNRQ><TRNUID>%d<INVSTMTRQ><INVACCTFROM><BROKERID>mock<ACCTID>7%06d</INVACCTFROM>' \
+                 '</INVSTMTRQ></INVSTMTTRNRQ>' % (i, i)
+        elif i % 2:
+            rq = '<CCSTMTTRNRQ><TRNUID>%d<CCSTMTRQ><CCACCTFROM><ACCTID>4%06d</CCACCTFROM></CCSTMTRQ></CCSTMTTRNRQ>' % (i, i)
+        else:
+            rq = '<STMTTRNRQ><TRNUID>%d<STMTRQ><BANKACCTFROM><BANKID>9<ACCTID>1%06d<ACCTTYPE>CHECKING' \
+                 '</BANKACCTFROM></STMTRQ></STMTTRNRQ>' % (i, i)
+        fname = os.path.join('xfr', 'stmt%03d.ofx' % i)
+        f = open(fname, 'w')
+        f.write(fi.response(rq))
+        f.close()
+        ofxList.append(['MOCK', str(i), fname])
+    return ofxList
+
+def combine(args):
+    parser = OptionParser(usage='%prog combine [options]')
+    parser.add_option('-f', '--files', type='int', default=30, help='statement files [%default]')
+    parser.add_option('-n', '--ntrans', type='int', default=2000, help='transactions per statement [%default]')
+    parser.add_option('--max-bytes', type='int', default=0, dest='maxBytes', help='combineMaxBytes [%default]')
+    parser.add_option('--max-trans', type='int', default=0, dest='maxTrans', help='combineMaxTrans [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    box = Sandbox({}, [])
+    try:
+        sys.path.insert(0, pkgdir)
+        import rlib1
+        ofxList = mockStatements(opts.files, opts.ntrans)
+        size = sum(os.path.getsize(file[2]) for file in ofxList)
+        print 'Combining %d statements, %.1f MB' % (len(ofxList), size/1048576.0)
+        
+        def run():
+            stdout = sys.stdout
+            sys.stdout = NullOutput()
+            try:
+                cfiles = rlib1.combineOfx(ofxList, opts.maxBytes, opts.maxTrans)
+            finally:
+                sys.stdout = stdout
+            for cfile in cfiles: os.remove(cfile)
+        t = bestTime(run, opts.repeat)
+        rss = maxrss()
+        print '  best %.3fs, %.1f MB/s, peak rss %s MB' % (t, size/1048576.0/t, '%.1f' % rss if rss else 'n/a')
+    finally:
+        box.close()
+
+def parse(args):
+    parser = OptionParser(usage='%prog parse [options]')
+    parser.add_option('-n', '--ntrans', type='int', default=20000, help='transactions per statement [%default]')
+    parser.add_option('-x', '--xml', action='store_true', default=False, help='OFX 2.x (XML) statement')
+    parser.add_option('-r', '--repeat', type='int', default=5, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    sys.path.insert(0, pkgdir)
+    import re, ofxdoc
+    fi = mockofx.MockInstitution(ntrans=opts.ntrans)
+    rq = '<INVSTMTTRNRQ><TRNUID>1<INVSTMTRQ><INVACCTFROM><BROKERID>mock<ACCTID>7000001</INVACCTFROM>' \
+         '</INVSTMTRQ></INVSTMTTRNRQ>'
+    ofx = fi.response(rq, xml=opts.xml)
+    mb = len(ofx)/1048576.0
+    print 'Brokerage statement: %d transactions, %.1f MB, %s' % (opts.ntrans, mb, 'XML' if opts.xml else 'SGML')
+    print ''
+
+    #the regex versions are the ones that were used before ofxdoc
+    siteRes = [re.compile(r'<%s>(.*?)[<\s]' % tag, re.IGNORECASE | re.DOTALL) for tag in ['FID', 'BANKID', 'BROKERID']]
+    def siteRegex():
+        values = []
+        for p in siteRes:
+            r = p.search(ofx)
+            values.append(r and r.group(1))
+        return values
+    def siteDoc():
+        values = ofxdoc.firstValues(ofx, ['FID', 'BANKID', 'BROKERID'])
+        return [values.get(tag) for tag in ['FID', 'BANKID', 'BROKERID']]
+
+    def remapRegex():
+        p = re.compile(r'(<ACCTID>\s*)' + re.escape('7000001') + r'(?=[<\s])', re.IGNORECASE)
+        return p.sub(lambda r: r.group(1) + '1234', ofx)
+    def remapDoc():
+        return ofxdoc.splice(ofx, [(vstart, vend, '1234') for tag, value, start, end, vstart, vend
+                                   in ofxdoc.leaves(ofx, ['ACCTID']) if value.upper() == '7000001'])
+
+    def acctRegex():
+        return sorted(a.rstrip() for a in re.findall(r'<ACCTID>(.*?)<', ofx, flags=re.DOTALL | re.IGNORECASE))
+    def acctDoc():
+        return sorted(value for tag, value, start, end, vstart, vend in ofxdoc.leaves(ofx, ['ACCTID']))
+
+    def tagsRegex():
+        return len(re.findall(r'<(/?)([A-Za-z0-9_.]+)([^<>]*)>([^<]*)', ofx))
+    def tagsDoc():
+        return sum(1 for t in ofxdoc.tokens(ofx))
+    def tree():
+        return ofxdoc.Document(ofx)
+
+    print '  %-28s %10s %10s %s' % ('', 'regex ms', 'ofxdoc ms', 'same')
+    for name, old, new in [['site lookup (getSite)', siteRegex, siteDoc],
+                           ['ACCTID remap (_checkOFX)', remapRegex, remapDoc],
+                           ['ACCTID list (Setup)', acctRegex, acctDoc],
+                           ['all tags / token stream', tagsRegex, tagsDoc]]:
+        same = old() == new() if name[:3] <> 'all' else ''
+        print '  %-28s %10.2f %10.2f %s' % (name, bestTime(old, opts.repeat)*1000, bestTime(new, opts.repeat)*1000, same)
+
+    t = bestTime(tree, opts.repeat)
+    doc = tree()
+    count = sum(1 for e in doc.iter())
+    print ''
+    print '  element tree: %d elements, %.1f ms (%.1f MB/s), %d transactions' % (count, t*1000, mb/t,
+                            sum(len(doc.findall(tag)) for tag in ['INVBANKTRAN', 'BUYMF', 'BUYSTOCK', 'INCOME', 'REINVEST']))
+    rss = maxrss()
+    if rss: print '  peak rss %.1f MB' % rss
+
+def _checkStatement(mode, fname, results):
+    #child process for stream:  check and scrub statement fname w/ ofx._checkOFX (in memory) or 
+    #ofx._checkOFXFile (streaming).  returns [seconds, peak rss, output file] in results
+    sys.path.insert(0, pkgdir)
+    import ofx
+    site = ofx.userdat.sites['MOCK']
+    base = maxrss()
+    t0 = timeit.default_timer()
+    outname = fname + '.' + mode
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        f = open(fname, 'rb')
+        if mode == 'memory':
+            stmt, dtend = ofx._checkOFX(f.read(), site, '7000001', '7000001:X', None)
+            ofx._writeOFX(outname, stmt)
+        else:
+            ofx._checkOFXFile(f, site, '7000001', '7000001:X', outname, None)
+        f.close()
+    finally:
+        sys.stdout = stdout
+    results.put([timeit.default_timer() - t0, maxrss(), base, outname])
+
+def stream(args):
+    parser = OptionParser(usage='%prog stream [options]')
+    parser.add_option('-n', '--ntrans', type='int', default=100000, help='transactions in the statement [%default]')
+    parser.add_option('-m', '--memo', type='int', default=40, dest='memoSize', help='memo length (bytes) [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'MOCK', 'AcctType': 'INVSTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx', 'brokerid': 'mockofx.local', 'timeOffset': '1'}]
+    box = Sandbox({'quietScrub': 'Yes'}, sites)
+    try:
+        fi = mockofx.MockInstitution(ntrans=opts.ntrans, memoSize=opts.memoSize)
+        rq = '<INVSTMTTRNRQ><TRNUID>1<INVSTMTRQ><INVACCTFROM><BROKERID>mock<ACCTID>7000001</INVACCTFROM>' \
+             '</INVSTMTRQ></INVSTMTTRNRQ>'
+        fname = os.path.join('xfr', 'large.ofx')
+        f = open(fname, 'wb')
+        f.write(fi.response(rq))
+        f.close()
+        size = os.path.getsize(fname)/1048576.0
+        print 'Check and scrub a %d transaction brokerage statement (%.1f MB)' % (opts.ntrans, size)
+        print ''
+        print '  %-26s %9s %12s %12s' % ('', 'time(s)', 'rss(MB)', 'added(MB)')
+        
+        outputs = []
+        for mode, name in [['memory', 'in memory (_checkOFX)'], ['stream', 'streaming (_checkOFXFile)']]:
+            #each run is a separate process, so the peak memory use is its own
+            results = multiprocessing.Queue()
+            p = multiprocessing.Process(target=_checkStatement, args=(mode, fname, results))
+            p.start()
+            t, rss, base, outname = results.get()
+            p.join()
+            outputs.append(outname)
+            print '  %-26s %9.2f %12s %12s' % (name, t, '%.1f' % rss if rss else 'n/a', 
+                                               '%.1f' % (rss-base) if rss else 'n/a')
+        print ''
+        print '  identical output: %s' % (open(outputs[0], 'rb').read() == open(outputs[1], 'rb').read())
+    finally:
+        box.close()
+
+class _OldScrub:
+    #frozen copy of the scrub step sequence used before the scrub rule engine (scrubber.py, 27-Jul-2018),
+    #for comparison by the scrub command.  one regex pass over the statement per fix.  
+    #Discover Card/Bank isn't included (see the discover command).  scrubber messages aren't printed
+    def __init__(self, site, skipZeroTransactions):
+        self.site = site
+        self.skipZero = skipZeroTransactions
+    
+    def scrub(self, ofx):
+        import re
+        siteURL = self.site['URL'].upper()
+        dtHrs = float(self.site.get('TIMEOFFSET') or 0)
+        if 'TROWEPRICE.COM' in siteURL: ofx = self.tRowePrice(ofx)
+        ofx = re.compile(r'(<DT.+?>)([^<\s]+)', re.IGNORECASE).sub(self.time_r1, ofx)
+        if dtHrs <> 0: ofx = self.shiftTime(ofx, dtHrs)
+        ofx = self.dtstart(ofx)
+        if "<INVSTMTTRNRS>" in ofx.upper():
+            ofx = re.compile(r'(<INVBUY>|<INVSELL>)(.+?<UNITS>)(.+?)(<.+?<TOTAL>)([^<\r\n]+)', 
+                             re.IGNORECASE).sub(self.invSign_r1, ofx)
+            ofx = re.compile(r'(<REINVEST>)(.+?<TOTAL>)(.+?)(<.+?<UNITS>)([^<\r\n]+)', 
+                             re.IGNORECASE).sub(self.reinvestSign_r1, ofx)
+        if self.skipZero: 
+            ofx = re.compile(r'(<STMTTRN>.*?<TRNAMT>)(.+?)(<.*?</STMTTRN>)', 
+                             flags=re.DOTALL | re.IGNORECASE).sub(self.removeZero_r1, ofx)
+        for tag in ['CORRECTACTION', 'CORRECTFITID']:
+            ofx = re.compile(r'<'+tag+'>[^<]+', re.IGNORECASE).sub('', ofx)
+        return re.compile(r'&(?!#?\w+;)').sub('&amp;', ofx)
+    
+    def time_r1(self, r):
+        DT = r.group(2).strip(' ')
+        if DT[8:] == '' or DT[8:14] == '000000': DT = DT[:8] + '120000'
+        return r.group(1) + DT
+    
+    def shiftTime(self, ofx, h):
+        import re
+        return re.compile(r'(<DTASOF>)([^<\s]+)', re.IGNORECASE | re.DOTALL).sub(
+                          lambda r: r.group(1) + _strptimeShift(r.group(2).strip(' '), h), ofx)
+    
+    def dtstart(self, ofx):
+        import re
+        from datetime import datetime
+        if ofx.find('<DTSTART>') >= 0 and ofx.find('<DTEND>') < 0:
+            nowstr = datetime.now().strftime("%Y%m%d%H%M00")
+            ofx = re.compile(r'(<DTSTART>[^<\s]+)', re.IGNORECASE).sub(r'\1<DTEND>'+nowstr, ofx)
+        return ofx
+    
+    def invSign_r1(self, r):
+        buy = "INVBUY" in r.group(1)
+        qty, total = r.group(3), r.group(5)
+        qty_v, total_v = self.float2(qty), self.float2(total)
+        if (buy and qty_v<0) or (not buy and qty_v>0): qty = str(-1*qty_v)
+        if (buy and total_v>0) or (not buy and total_v<0): total = str(-1*total_v)
+        return r.group(1) + r.group(2) + qty + r.group(4) + total
+    
+    def reinvestSign_r1(self, r):
+        qty, total = r.group(5), r.group(3)
+        qty_v, total_v = self.float2(qty), self.float2(total)
+        if qty_v<0: qty = str(-1*qty_v)
+        if total_v>0: total = str(-1*total_v)
+        return r.group(1) + r.group(2) + total + r.group(4) + qty
+    
+    def removeZero_r1(self, r):
+        return '' if self.float2(r.group(2)) == 0 else r.group(0)
+    
+    def tRowePrice(self, ofx):
+        #note:  reinvestments w/ non-zero units were dropped (fixed since).  only matters for statements
+        #w/o line breaks
+        import re
+        p = re.compile(r'(<REINVEST>)(<.+?<MEMO>)(.+?[^<]*)(</INVTRAN>.+?<INCOMETYPE>)(.+?[^<]*)(<TOTAL>.+?[^<]*)'
+                       r'(<SUBACCTSEC>.+?[^<]*)(<UNITS>.+?[^<]*)(<UNITPRICE>.+?[^<]*)(</REINVEST>)', re.IGNORECASE)
+        def r1(r):
+            if '<UNITS>0.0<' not in r.group(0).upper(): return ''
+            m = p.match(r.group(0))
+            memo = {'DIV': 'DIVIDEND PAID', 'CGSHORT': 'SHORT TERM CAP GAIN PAID', 
+                    'CGLONG': 'LONG TERM CAPITAL GAIN PAID'}.get(m.group(5), m.group(3))
+            return '<INCOME>' + m.group(2) + memo + m.group(4) + m.group(5) + m.group(6).replace('-','') + \
+                   m.group(7) + '<SUBACCTFUND>CASH' + '</INCOME>'
+        return re.compile(r'<REINVEST>.+?</REINVEST>', re.IGNORECASE).sub(r1, ofx)
+    
+    def float2(self, s):
+        try:
+            return float(s)
+        except ValueError:
+            return 0.0
+
+def _scrubDefects(ofx):
+    #things for the scrubber to fix in a mock statement:  invalid '&', unsupported tags, $0.00 transactions
+    import re
+    ofx = re.sub(r'(<MEMO>[^<\r\n]*3)\r\n', r'\1 & co\r\n', ofx)
+    ofx = re.sub(r'(<FITID>[^<\r\n]*7)\r\n', r'\1\r\n<CORRECTACTION>REPLACE\r\n', ofx)
+    return re.sub(r'(<TRNAMT>)[^<\r\n]*(\r\n<FITID>[^<\r\n]*9\r\n)', r'\g<1>0.00\2', ofx)
+
+def scrub(args):
+    parser = OptionParser(usage='%prog scrub [options]')
+    parser.add_option('-n', '--ntrans', type='int', default=50000, help='transactions per statement [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'BANK', 'AcctType': 'BASTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx', 'bankid': '9', 'timeOffset': '1'},
+             {'SiteName': 'CARD', 'AcctType': 'CCSTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx'},
+             {'SiteName': 'TROWE', 'AcctType': 'INVSTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.troweprice.com/ofx', 'brokerid': 'troweprice.com', 'timeOffset': '1'}]
+    box = Sandbox({'quietScrub': 'Yes', 'skipZeroTransactions': 'Yes'}, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import StringIO, scrubber
+        fi = mockofx.MockInstitution(ntrans=opts.ntrans)
+        statements = [['bank', 'BANK', '<STMTTRNRQ><TRNUID>1<STMTRQ><BANKACCTFROM><BANKID>9<ACCTID>1000001'
+                                       '<ACCTTYPE>CHECKING</BANKACCTFROM></STMTRQ></STMTTRNRQ>'],
+                      ['card', 'CARD', '<CCSTMTTRNRQ><TRNUID>1<CCSTMTRQ><CCACCTFROM><ACCTID>4000001'
+                                       '</CCACCTFROM></CCSTMTRQ></CCSTMTTRNRQ>'],
+                      ['brokerage', 'TROWE', '<INVSTMTTRNRQ><TRNUID>1<INVSTMTRQ><INVACCTFROM><BROKERID>mock'
+                                             '<ACCTID>7000001</INVACCTFROM></INVSTMTRQ></INVSTMTTRNRQ>']]
+        print 'Scrub %d transaction statements:  original scrub steps vs the rule engine' % opts.ntrans
+        print ''
+        print '  %-12s %6s %10s %11s %11s %s' % ('', 'MB', 'steps(s)', 'memory(s)', 'stream(s)', 'same')
+        failed = False
+        for name, sitename, rq in statements:
+            ofx = _scrubDefects(fi.response(rq))
+            site = scrubber.userdat.sites[sitename]
+            old = _OldScrub(site, True)
+            def memory():
+                return scrubber.scrubOFX(ofx, site)
+            def stream():
+                out = StringIO.StringIO()
+                scrubber.scrubStream(StringIO.StringIO(ofx), out, site)
+                return out.getvalue()
+            same = old.scrub(ofx) == memory() == stream()
+            failed = failed or not same
+            tOld = bestTime(lambda: old.scrub(ofx), opts.repeat)
+            tMem = bestTime(memory, opts.repeat)
+            tStream = bestTime(stream, opts.repeat)
+            print '  %-12s %6.1f %10.3f %11.3f %11.3f %s  (%.1fx)' % (name, len(ofx)/1048576.0, tOld, tMem, tStream,
+                                                                   same, tOld/tMem)
+        print ''
+        print '  %s' % ('FAILED:  output differs from the original scrub steps' if failed else 'passed')
+    finally:
+        box.close()
+    if failed: sys.exit(1)
+
+def _listFITIDs(fitids, accType):
+    #Discover FITIDs assigned w/ the original search (a list of the values used, searched from serial# 0)
+    known = []
+    result = []
+    for fitid in fitids:
+        fitid_b = fitid
+        if accType == 'CCSTMT': fitid_b = fitid[:len(fitid)-5]
+        seq = 0
+        while seq < 9999:
+            fitid = fitid_b + str(seq)
+            if fitid in known: seq = seq+1
+            else: break
+        known.append(fitid)
+        result.append(fitid)
+    return result
+
+def discover(args):
+    parser = OptionParser(usage='%prog discover [options]')
+    parser.add_option('-n', '--ntrans', type='int', default=20000, help='transactions in the statement [%default]')
+    parser.add_option('-d', '--dup', type='int', default=3, help='transactions per FITID base [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'DISCOVER', 'AcctType': 'CCSTMT', 'fiorg': 'Discover Financial Services', 
+              'fid': '7101', 'url': 'https://ofx.discovercard.com'}]
+    box = Sandbox({'quietScrub': 'Yes'}, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import re, random, scrubber
+        #Discover card FITIDs:  FITID + date + amount + 5 digit serial#.  dup transactions share each date+amount
+        rnd = random.Random(1)
+        bases = ['FITID2026%04d%.2f' % (i % 1231, -rnd.randint(100, 99999)/100.0) for i in range(opts.ntrans/opts.dup+1)]
+        fitids = ['%s%05d' % (bases[i/opts.dup], rnd.randint(0, 99999)) for i in range(opts.ntrans)]
+        rnd.shuffle(fitids)
+        fi = mockofx.MockInstitution(ntrans=opts.ntrans)
+        rq = '<CCSTMTTRNRQ><TRNUID>1<CCSTMTRQ><CCACCTFROM><ACCTID>6011000000000001</CCACCTFROM></CCSTMTRQ></CCSTMTTRNRQ>'
+        serial = iter(fitids)
+        ofx = re.sub(r'<FITID>[^<\s]+', lambda r: '<FITID>' + serial.next(), fi.response(rq))
+        print 'Discover card statement: %d transactions, %d per FITID base, %.1f MB' % (opts.ntrans, opts.dup,
+                                                                                     len(ofx)/1048576.0)
+        print ''
+
+        t0 = timeit.default_timer()
+        old = _listFITIDs(fitids, 'CCSTMT')
+        tOld = timeit.default_timer() - t0
+        def assign():
+            fitids2 = scrubber._DiscoverFITIDs('CCSTMT')
+            return [fitids2.unique(fitid) for fitid in fitids]
+        tNew = bestTime(assign, 3)
+        print '  %-24s %8.3fs' % ('FITIDs, list search', tOld)
+        print '  %-24s %8.3fs  (%.0fx)' % ('FITIDs, _DiscoverFITIDs', tNew, tOld/tNew)
+        print '  %-24s %9s' % ('identical', assign() == old)
+        
+        site = scrubber.userdat.sites['DISCOVER']
+        def run():
+            return scrubber.scrubOFX(ofx, site)
+        t = bestTime(run, 3)
+        scrubbed = re.findall(r'<FITID>([^<\s]+)', run())
+        print '  %-24s %8.3fs  (FITIDs identical: %s)' % ('scrubOFX', t, scrubbed == old)
+    finally:
+        box.close()
+
+def scrubpool(args):
+    parser = OptionParser(usage='%prog scrubpool [options]')
+    parser.add_option('-f', '--files', type='int', default=24, help='statement files [%default]')
+    parser.add_option('-n', '--ntrans', type='int', default=5000, help='transactions per statement [%default]')
+    parser.add_option('-w', '--workers', type='int', default=0, help='scrub processes (0 = one per cpu) [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'MOCK', 'AcctType': 'BASTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx', 'bankid': '9', 'timeOffset': '1'}]
+    box = Sandbox({'skipZeroTransactions': 'Yes'}, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import scrubber
+        site = scrubber.userdat.sites['MOCK']
+        files = [file[2] for file in mockStatements(opts.files, opts.ntrans)]
+        originals = {}
+        for fname in files:
+            originals[fname] = open(fname, 'rb').read()
+        size = sum(len(dat) for dat in originals.values())
+        
+        def run(workers):
+            #scrub copies of the original files.  returns [messages, scrubbed files]
+            for fname in files:
+                f = open(fname, 'wb')
+                f.write(originals[fname])
+                f.close()
+            scrubber.userdat.scrubWorkers = workers
+            pool = scrubber.ScrubPool()
+            try:
+                msgs = [result for result in pool.scrubFiles([[fname, site] for fname in files])]
+            finally:
+                pool.close()
+            return [msgs, [open(fname, 'rb').read() for fname in files]]
+        
+        scrubber.userdat.scrubWorkers = opts.workers
+        workers = scrubber.ScrubPool().workers()
+        print 'Scrub %d statement files, %.1f MB, w/ %d worker processes' % (len(files), size/1048576.0, workers)
+        print ''
+        tOne = bestTime(lambda: run(1), opts.repeat)
+        tPool = bestTime(lambda: run(workers), opts.repeat)
+        print '  %-24s %8.3fs' % ('in process', tOne)
+        print '  %-24s %8.3fs  (%.1fx)' % ('scrub pool', tPool, tOne/tPool)
+        print '  %-24s %9s' % ('identical', run(1) == run(workers))
+    finally:
+        box.close()
+
+def scrubcache(args):
+    parser = OptionParser(usage='%prog scrubcache [options]')
+    parser.add_option('-f', '--files', type='int', default=24, help='statement files [%default]')
+    parser.add_option('-n', '--ntrans', type='int', default=5000, help='transactions per statement [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'MOCK', 'AcctType': 'BASTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx', 'bankid': '9'}]
+    box = Sandbox({'quietScrub': 'Yes'}, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import re, scrubber
+        site = scrubber.userdat.sites['MOCK']
+        files = [file[2] for file in mockStatements(opts.files, opts.ntrans)]
+        jobs = [[fname, site] for fname in files]
+        size = sum(os.path.getsize(fname) for fname in files)
+        print 'Import %d statement files, %.1f MB' % (len(files), size/1048576.0)
+        print ''
+        
+        tScrub = bestTime(lambda: list(scrubber.pool.scrubFiles(jobs)), 1)
+        before = [open(fname, 'rb').read() for fname in files]
+        def marker():
+            #NEWFILEUID:PSIMPORT rewrite (Getdata, before scrub.dat)
+            p = re.compile(r'NEWFILEUID:.*')
+            for fname in files:
+                with open(fname) as ifile:
+                    ofxdat = ifile.read()
+                with open(fname, 'w') as ofile:
+                    ofile.write(p.sub('NEWFILEUID:PSIMPORT', ofxdat))
+        def cached():
+            return list(scrubber.pool.scrubFiles(jobs))
+        tCached = bestTime(cached, opts.repeat)
+        same = before == [open(fname, 'rb').read() for fname in files]
+        tMarker = bestTime(marker, opts.repeat)
+        print '  %-24s %8.3fs' % ('first import (scrub)', tScrub)
+        print '  %-24s %8.3fs' % ('PSIMPORT rewrite', tMarker)
+        print '  %-24s %8.3fs  (%.1fx)' % ('scrub.dat hash check', tCached, tMarker/tCached)
+        print '  %-24s %9s' % ('files unchanged', same)
+    finally:
+        box.close()
+
+def _strptimeShift(DT, h):
+    #DTASOF shift w/ strptime/strftime for every value (as scrubber._shiftTime did originally)
+    from datetime import datetime, timedelta
+    tz = ''
+    if '[' in DT:
+        p = DT.index('[')
+        tz = DT[p:]
+        DT = DT[:p]
+    if '.' in DT: DT = DT[:DT.index('.')]
+    tval = datetime.strptime(DT, "%Y%m%d%H%M%S") + timedelta(hours=h)
+    return tval.strftime("%Y%m%d%H%M%S") + tz
+
+def dates(args):
+    parser = OptionParser(usage='%prog dates [options]')
+    parser.add_option('-n', '--nvalues', type='int', default=100000, help='date/time values [%default]')
+    parser.add_option('-d', '--distinct', type='int', default=500, help='distinct values [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3, help='number of runs [%default]')
+    opts, args = parser.parse_args(args)
+
+    box = Sandbox({}, [])      #scrubber loads (and caches) sites.dat from the working directory
+    try:
+        sys.path.insert(0, pkgdir)
+        import random, scrubber
+        #DTASOF values as they show up in statements:  plain, w/ fractional seconds, and w/ a timezone
+        rnd = random.Random(1)
+        formats = ['%s', '%s.000', '%s.000[-5:EST]', '%s[0:GMT]']
+        distinct = [rnd.choice(formats) % ('2026%02d%02d%02d%02d%02d' % (rnd.randint(1,12), rnd.randint(1,28), 
+                    rnd.randint(0,23), rnd.randint(0,59), rnd.randint(0,59))) for i in range(opts.distinct)]
+        values = [rnd.choice(distinct) for i in range(opts.nvalues)]
+        print 'Shift %d DTASOF values (%d distinct) by -5.5 hours' % (opts.nvalues, opts.distinct)
+        print ''
+
+        def old():
+            return [_strptimeShift(DT, -5.5) for DT in values]
+        def new():
+            shift = scrubber._TimeShift(-5.5)      #one per statement
+            return [shift.shift(DT) for DT in values]
+        def parsed():
+            deltaT = scrubber.timedelta(hours=-5.5)
+            return [scrubber._shiftTime(DT, deltaT) for DT in values]
+        tOld = bestTime(old, opts.repeat)
+        tParsed = bestTime(parsed, opts.repeat)
+        tNew = bestTime(new, opts.repeat)
+        print '  %-24s %8.3fs' % ('strptime/strftime', tOld)
+        print '  %-24s %8.3fs  (%.1fx)' % ('fixed-width parse', tParsed, tOld/tParsed)
+        print '  %-24s %8.3fs  (%.1fx)' % ('_TimeShift (saved)', tNew, tOld/tNew)
+        print '  %-24s %9s' % ('identical', old() == new() == parsed())
+    finally:
+        box.close()
+
+def pathological(args):
+    parser = OptionParser(usage='%prog pathological [options]')
+    parser.add_option('-n', '--ntrans', type='int', default=2000, help='transactions in the smaller statement [%default]')
+    parser.add_option('-x', '--max-exponent', type='float', default=1.4, dest='maxExponent', 
+                      help='fail if time grows faster than size**x [%default]')
+    opts, args = parser.parse_args(args)
+
+    sites = [{'SiteName': 'BROKER', 'AcctType': 'INVSTMT', 'fiorg': 'MockOFX', 'fid': '99999', 
+              'url': 'https://ofx.mockofx.local/ofx', 'brokerid': 'mockofx.local'}]
+    box = Sandbox({'quietScrub': 'Yes'}, sites)
+    try:
+        sys.path.insert(0, pkgdir)
+        import re, math, scrubber
+        site = scrubber.userdat.sites['BROKER']
+        rq = '<INVSTMTTRNRQ><TRNUID>1<INVSTMTRQ><INVACCTFROM><BROKERID>mock<ACCTID>7000001</INVACCTFROM>' \
+             '</INVSTMTRQ></INVSTMTTRNRQ>'
+        def statement(ntrans):
+            #no line breaks, no <TOTAL>s, and wrong <UNITS> signs.  the original regexes backtracked through
+            #the rest of the statement for every transaction
+            ofx = mockofx.MockInstitution(ntrans=ntrans).response(rq).replace('\r', '').replace('\n', '')
+            return re.sub(r'<TOTAL>[^<]*', '', ofx).replace('<UNITS>', '<UNITS>-')
+
+        tests = [['scrubOFX (rules)', lambda ofx: scrubber.scrubOFX(ofx, site)]]
+        sizes = [opts.ntrans, opts.ntrans*4]
+        statements = [statement(n) for n in sizes]
+        print 'Single-line brokerage statements w/o <TOTAL>s: %d and %d transactions' % tuple(sizes)
+        print ''
+        print '  %-18s %10s %10s %9s' % ('', 'small(s)', 'large(s)', 'exponent')
+        failed = False
+        for name, fn in tests:
+            times = [bestTime(lambda: fn(ofx), 3) for ofx in statements]
+            size = [len(ofx) for ofx in statements]
+            exponent = math.log(times[1]/times[0]) / math.log(float(size[1])/size[0])
+            ok = exponent <= opts.maxExponent
+            failed = failed or not ok
+            print '  %-18s %10.3f %10.3f %9.2f %s' % (name, times[0], times[1], exponent, '' if ok else 'FAIL')
+        print ''
+        print '  %s' % ('FAILED:  scrub time grows faster than size**%.1f' % opts.maxExponent if failed else 'passed')
+    finally:
+        box.close()
+    if failed: sys.exit(1)
+
+COMMANDS = {'download': download, 'sitecfg': sitecfg, 'combine': combine, 'parse': parse, 'stream': stream,
+            'scrub': scrub, 'discover': discover, 'pathological': pathological, 'dates': dates,
+            'scrubpool': scrubpool, 'scrubcache': scrubcache}
+
+if __name__=="__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print 'Usage: benchmark.py <command> [options]'
+        print 'Commands:', ', '.join(sorted(COMMANDS))
+        sys.exit(1)
+    COMMANDS[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,329 @@
+# mockofx.py
+# http://sites.google.com/site/pocketsense/
+# local OFX server stand-in, for testing and benchmarking the download code w/o connecting to a bank
+# Intial version: rlc: 18Oct2026
+
+# Answers ACCTINFORQ, STMTRQ, CCSTMTRQ and INVSTMTRQ requests (several per message set is ok)
+# w/ synthetic statements.  Any user/password and account number is accepted.  Options:
+#   ntrans    : transactions per statement
+#   memoSize  : length of the <MEMO> field for each transaction (statement size)
+#   latency   : server "think time" (seconds) before each response
+#   errorRate : fraction of requests that fail (HTTP 500 or an OFX <SEVERITY>ERROR response)
+#   cookie    : require a session cookie, like Discover.  the first request gets a cookie and a
+#               non-OFX response.  the request has to be repeated w/ the cookie (see ofx.OFXClient.doQuery)
+#   compress  : gzip/deflate the response if the client asks for it (Accept-Encoding)
+#
+# Plain http only.  benchmark.py connects to a mock server w/ its own http connection (benchmark.plainHTTP).
+#
+# Usage: mockofx.py [options]      (mockofx.py -h for the list)
+#        or see benchmark.py for use as a module
+
+import BaseHTTPServer, SocketServer, threading, random, time, re, zlib
+from optparse import OptionParser
+
+#securities used for investment statements:  [ticker, cusip, name, price, mutual fund?]
+SECURITIES = [['MOCKX', '999999101', 'Mock Total Market Index Fund', 101.25, True],
+              ['MOCKB', '999999102', 'Mock Bond Index Fund', 10.50, True],
+              ['MCKA',  '999999103', 'Mock Industries Inc', 45.10, False],
+              ['MCKB',  '999999104', 'Mock Widgets Corp', 12.75, False],
+              ['MCKC',  '999999105', 'Mock Holdings Ltd', 230.00, False]]
+
+class MockInstitution:
+    #synthetic statement generator for one mock financial institution
+    def __init__(self, ntrans=50, memoSize=20, latency=0.0, errorRate=0.0, cookie=False, compress=True, seed=0):
+        self.ntrans = ntrans
+        self.memoSize = memoSize
+        self.latency = latency
+        self.errorRate = errorRate
+        self.cookie = cookie
+        self.compress = compress
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def respond(self, query, headers):
+        #returns [http status, {header: value}, body] for POSTed query
+        with self.lock:
+            self.requests += 1
+            fail = self.rand.random() < self.errorRate
+            if fail: self.errors += 1
+            failType = self.rand.randint(0,1)
+
+        if self.latency: time.sleep(self.latency)
+
+        if self.cookie and headers.get('cookie', '').find('MOCKSESSION=') < 0:
+            #no session yet:  send a cookie, but no statement
+            session = 'MOCKSESSION=%08x; Path=/' % random.getrandbits(32)
+            return [200, {'Content-Type': 'text/html', 'Set-Cookie': session},
+                    '<html><body>Session required</body></html>']
+
+        if fail and failType == 0:
+            return [500, {'Content-Type': 'text/html'}, '<html><body>Internal Server Error</body></html>']
+
+        xml = query.lstrip()[:5] == '<?xml'
+        body = self.response(query, xml, fail)
+        return [200, {'Content-Type': 'application/x-ofx'}, body]
+
+    def response(self, query, xml=False, fail=False):
+        #OFX response for query.  fail=True returns an error status for every request
+        queryU = query.upper()
+        now = time.strftime("%Y%m%d%H%M%S", time.localtime())
+
+        msgsets = {'SIGNUP': [], 'BANK': [], 'CREDITCARD': [], 'INVSTMT': []}
+        seclist = False
+        for trnType, rq in re.findall(r'<(ACCTINFO|STMT|CCSTMT|INVSTMT)TRNRQ>(.*?)</\1TRNRQ>', queryU, re.DOTALL):
+            trnuid = _value(rq, 'TRNUID') or '0'
+            if fail:
+                rs = self._status(2000, 'ERROR', xml)
+            elif trnType == 'ACCTINFO':
+                rs = self._status(0, 'INFO', xml) + self._acctinfors(now, xml)
+            elif trnType == 'STMT':
+                rs = self._status(0, 'INFO', xml) + self._stmtrs(rq, now, xml)
+            elif trnType == 'CCSTMT':
+                rs = self._status(0, 'INFO', xml) + self._ccstmtrs(rq, now, xml)
+            else:
+                rs = self._status(0, 'INFO', xml) + self._invstmtrs(rq, now, xml)
+                seclist = True
+            trnrs = _tag(trnType + 'TRNRS', _field('TRNUID', trnuid, xml), rs)
+
+            msgType = {'ACCTINFO': 'SIGNUP', 'STMT': 'BANK', 'CCSTMT': 'CREDITCARD', 'INVSTMT': 'INVSTMT'}[trnType]
+            msgsets[msgType].append(trnrs)
+
+        sonrs = _tag('SIGNONMSGSRSV1', _tag('SONRS',
+                    _tag('STATUS', _field('CODE', '0', xml), _field('SEVERITY', 'INFO', xml)),
+                    _field('DTSERVER', now, xml),
+                    _field('LANGUAGE', 'ENG', xml),
+                    _tag('FI', _field('ORG', 'MockOFX', xml), _field('FID', '99999', xml))))
+        ofx = [sonrs]
+        for msgType in ['SIGNUP', 'BANK', 'CREDITCARD', 'INVSTMT']:
+            if msgsets[msgType]:
+                ofx.append(_tag(msgType + 'MSGSRSV1', *msgsets[msgType]))
+        if seclist and not fail:
+            ofx.append(self._seclist(xml))
+
+        return _header(xml) + _tag('OFX', *ofx)
+
+    def _status(self, code, severity, xml):
+        return _tag('STATUS', _field('CODE', str(code), xml), _field('SEVERITY', severity, xml))
+
+    def _acctinfors(self, now, xml):
+        #one account of each type
+        bank = _tag('BANKACCTINFO',
+                    _tag('BANKACCTFROM', _field('BANKID', '999999999', xml), _field('ACCTID', '1000001', xml),
+                         _field('ACCTTYPE', 'CHECKING', xml)),
+                    _field('SUPTXDL', 'Y', xml), _field('XFERSRC', 'N', xml), _field('XFERDEST', 'N', xml),
+                    _field('SVCSTATUS', 'ACTIVE', xml))
+        cc = _tag('CCACCTINFO', _tag('CCACCTFROM', _field('ACCTID', '4000000000000002', xml)),
+                    _field('SUPTXDL', 'Y', xml), _field('XFERSRC', 'N', xml), _field('XFERDEST', 'N', xml),
+                    _field('SVCSTATUS', 'ACTIVE', xml))
+        inv = _tag('INVACCTINFO',
+                    _tag('INVACCTFROM', _field('BROKERID', 'mockofx.local', xml), _field('ACCTID', '7000001', xml)),
+                    _field('USPRODUCTTYPE', '401K', xml), _field('CHECKING', 'N', xml),
+                    _field('SVCSTATUS', 'ACTIVE', xml), _field('INVACCTTYPE', 'INDIVIDUAL', xml))
+        accts = [_tag('ACCTINFO', _field('DESC', desc, xml), info)
+                    for desc, info in [['Mock Checking', bank], ['Mock Card', cc], ['Mock 401k', inv]]]
+        return _tag('ACCTINFORS', _field('DTACCTUP', now, xml), *accts)
+
+    def _dates(self, rq, now):
+        #[dtstart, dtend, posting dates for ntrans transactions] for request rq
+        dtstart = _value(rq, 'DTSTART')[:8] or time.strftime("%Y%m%d", time.localtime(time.time()-30*86400))
+        t0 = time.mktime((int(dtstart[:4]), int(dtstart[4:6]), int(dtstart[6:8]), 0, 0, 0, 0, 0, -1))
+        t1 = max(time.time(), t0)
+        step = (t1 - t0) / max(self.ntrans, 1)
+        dates = [time.strftime("%Y%m%d%H%M%S", time.localtime(t0 + step*i)) for i in range(self.ntrans)]
+        return [dtstart, now, dates]
+
+    def _memo(self, i):
+        memo = 'Mock transaction %d ' % i
+        return (memo * (self.memoSize/len(memo)+1))[:self.memoSize]
+
+    def _stmttrns(self, acctid, dates, xml):
+        rand = random.Random(acctid)
+        trns = []
+        for i in range(len(dates)):
+            amt = rand.uniform(-500, 250)
+            trns.append(_tag('STMTTRN',
+                    _field('TRNTYPE', 'DEBIT' if amt < 0 else 'CREDIT', xml),
+                    _field('DTPOSTED', dates[i], xml),
+                    _field('TRNAMT', '%.2f' % amt, xml),
+                    _field('FITID', '%s%08d' % (acctid[-4:], i), xml),
+                    _field('NAME', 'MOCK PAYEE %d' % rand.randint(1, 50), xml),
+                    _field('MEMO', self._memo(i), xml)))
+        return trns
+
+    def _balances(self, now, xml):
+        return _tag('LEDGERBAL', _field('BALAMT', '1234.56', xml), _field('DTASOF', now, xml)) + \
+               _tag('AVAILBAL', _field('BALAMT', '1234.56', xml), _field('DTASOF', now, xml))
+
+    def _stmtrs(self, rq, now, xml):
+        acctid = _value(rq, 'ACCTID')
+        dtstart, dtend, dates = self._dates(rq, now)
+        return _tag('STMTRS', _field('CURDEF', 'USD', xml),
+                    _tag('BANKACCTFROM', _field('BANKID', _value(rq, 'BANKID'), xml),
+                         _field('ACCTID', acctid, xml), _field('ACCTTYPE', _value(rq, 'ACCTTYPE') or 'CHECKING', xml)),
+                    _tag('BANKTRANLIST', _field('DTSTART', dtstart, xml), _field('DTEND', dtend, xml),
+                         *self._stmttrns(acctid, dates, xml)),
+                    self._balances(now, xml))
+
+    def _ccstmtrs(self, rq, now, xml):
+        acctid = _value(rq, 'ACCTID')
+        dtstart, dtend, dates = self._dates(rq, now)
+        return _tag('CCSTMTRS', _field('CURDEF', 'USD', xml),
+                    _tag('CCACCTFROM', _field('ACCTID', acctid, xml)),
+                    _tag('BANKTRANLIST', _field('DTSTART', dtstart, xml), _field('DTEND', dtend, xml),
+                         *self._stmttrns(acctid, dates, xml)),
+                    self._balances(now, xml))
+
+    def _invstmtrs(self, rq, now, xml):
+        acctid = _value(rq, 'ACCTID')
+        dtstart, dtend, dates = self._dates(rq, now)
+        rand = random.Random(acctid)
+
+        trns = []
+        for i in range(len(dates)):
+            ticker, cusip, name, price, isFund = SECURITIES[rand.randint(0, len(SECURITIES)-1)]
+            units = round(rand.uniform(0.5, 20), 3)
+            total = round(units*price, 2)
+            invtran = _tag('INVTRAN', _field('FITID', '%s%08d' % (acctid[-4:], i), xml),
+                           _field('DTTRADE', dates[i], xml), _field('MEMO', self._memo(i), xml))
+            secid = _secid(cusip, xml)
+            kind = i % 3
+            if kind == 0:
+                buy = 'BUYMF' if isFund else 'BUYSTOCK'
+                trns.append(_tag(buy,
+                    _tag('INVBUY', invtran, secid, _field('UNITS', '%.3f' % units, xml),
+                         _field('UNITPRICE', '%.2f' % price, xml), _field('TOTAL', '%.2f' % -total, xml),
+                         _field('SUBACCTSEC', 'CASH', xml), _field('SUBACCTFUND', 'CASH', xml)),
+                    _field('BUYTYPE', 'BUY', xml)))
+            elif kind == 1:
+                trns.append(_tag('INCOME', invtran, secid, _field('INCOMETYPE', 'DIV', xml),
+                    _field('TOTAL', '%.2f' % (total/50), xml),
+                    _field('SUBACCTSEC', 'CASH', xml), _field('SUBACCTFUND', 'CASH', xml)))
+            else:
+                trns.append(_tag('REINVEST', invtran, secid, _field('INCOMETYPE', 'DIV', xml),
+                    _field('TOTAL', '%.2f' % -(total/50), xml), _field('SUBACCTSEC', 'CASH', xml),
+                    _field('UNITS', '%.3f' % (units/50), xml), _field('UNITPRICE', '%.2f' % price, xml)))
+
+        positions = []
+        for ticker, cusip, name, price, isFund in SECURITIES:
+            units = round(rand.uniform(10, 1000), 3)
+            pos = _tag('POSMF' if isFund else 'POSSTOCK',
+                    _tag('INVPOS', _secid(cusip, xml), _field('HELDINACCT', 'CASH', xml),
+                         _field('POSTYPE', 'LONG', xml), _field('UNITS', '%.3f' % units, xml),
+                         _field('UNITPRICE', '%.2f' % price, xml), _field('MKTVAL', '%.2f' % (units*price), xml),
+                         _field('DTPRICEASOF', now, xml)))
+            positions.append(pos)
+
+        return _tag('INVSTMTRS', _field('DTASOF', now, xml), _field('CURDEF', 'USD', xml),
+                    _tag('INVACCTFROM', _field('BROKERID', _value(rq, 'BROKERID'), xml), _field('ACCTID', acctid, xml)),
+                    _tag('INVTRANLIST', _field('DTSTART', dtstart, xml), _field('DTEND', dtend, xml), *trns),
+                    _tag('INVPOSLIST', *positions),
+                    _tag('INVBAL', _field('AVAILCASH', '100.00', xml), _field('MARGINBALANCE', '0.00', xml),
+                         _field('SHORTBALANCE', '0.00', xml)))
+
+    def _seclist(self, xml):
+        secs = []
+        for ticker, cusip, name, price, isFund in SECURITIES:
+            secinfo = _tag('SECINFO', _secid(cusip, xml), _field('SECNAME', name, xml), _field('TICKER', ticker, xml))
+            if isFund:
+                secs.append(_tag('MFINFO', secinfo, _field('MFTYPE', 'OPENEND', xml)))
+            else:
+                secs.append(_tag('STOCKINFO', secinfo))
+        return _tag('SECLISTMSGSRSV1', _tag('SECLIST', *secs))
+
+def _header(xml):
+    if xml:
+        return '<?xml version="1.0" encoding="utf-8" ?>\r\n' + \
+               '<?OFX OFXHEADER="200" VERSION="200" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\r\n'
+    return '\r\n'.join(['OFXHEADER:100', 'DATA:OFXSGML', 'VERSION:102', 'SECURITY:NONE', 'ENCODING:USASCII',
+                        'CHARSET:1252', 'COMPRESSION:NONE', 'OLDFILEUID:NONE', 'NEWFILEUID:NONE', '', ''])
+
+def _tag(tag, *contents):
+    return '<' + tag + '>\r\n' + ''.join(contents) + '</' + tag + '>\r\n'
+
+def _field(tag, value, xml):
+    #SGML (v1) leaf elements don't have end tags
+    if xml: return '<' + tag + '>' + value + '</' + tag + '>\r\n'
+    return '<' + tag + '>' + value + '\r\n'
+
+def _secid(cusip, xml):
+    return _tag('SECID', _field('UNIQUEID', cusip, xml), _field('UNIQUEIDTYPE', 'CUSIP', xml))
+
+def _value(rq, tag):
+    #value of the first tag field in (uppercase) request rq
+    r = re.search('<' + tag + r'>([^<\r\n]*)', rq)
+    return r.group(1).strip() if r else ''
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       #keep-alive
+
+    def do_POST(self):
+        query = self.rfile.read(int(self.headers.get('content-length', 0)))
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+        status, respHeaders, body = self.server.fi.respond(query, headers)
+
+        encoding = headers.get('accept-encoding', '')
+        if self.server.fi.compress and body:
+            if 'gzip' in encoding:
+                z = zlib.compressobj(6, zlib.DEFLATED, 31)
+                body = z.compress(body) + z.flush()
+                respHeaders['Content-Encoding'] = 'gzip'
+            elif 'deflate' in encoding:
+                body = zlib.compress(body)
+                respHeaders['Content-Encoding'] = 'deflate'
+
+        self.send_response(status)
+        for key in respHeaders:
+            self.send_header(key, respHeaders[key])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    #threaded http server for one mock institution (fi = MockInstitution)
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fi, port=0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), MockHandler)
+        self.fi = fi
+        self.verbose = verbose
+
+    def url(self):
+        return 'http://127.0.0.1:%d/ofx' % self.server_address[1]
+
+def start(port=0, verbose=False, **options):
+    #start a mock server in a background thread.  options = MockInstitution parameters
+    #returns the server.  call server.shutdown() when done
+    server = MockServer(MockInstitution(**options), port, verbose)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+if __name__=="__main__":
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-p', '--port', type='int', default=8089, help='server port [%default]')
+    parser.add_option('-n', '--ntrans', type='int', default=50, help='transactions per statement [%default]')
+    parser.add_option('-m', '--memo', type='int', default=20, dest='memoSize', help='memo length (bytes) [%default]')
+    parser.add_option('-l', '--latency', type='float', default=0.0, help='response delay (seconds) [%default]')
+    parser.add_option('-e', '--errors', type='float', default=0.0, dest='errorRate',
+                      help='fraction of requests that fail [%default]')
+    parser.add_option('-c', '--cookie', action='store_true', default=False, help='require a session cookie')
+    parser.add_option('--no-compress', action='store_false', default=True, dest='compress',
+                      help='ignore Accept-Encoding')
+    opts, args = parser.parse_args()
+
+    server = start(port=opts.port, verbose=True, ntrans=opts.ntrans, memoSize=opts.memoSize, latency=opts.latency,
+                   errorRate=opts.errorRate, cookie=opts.cookie, compress=opts.compress)
+    print 'Mock OFX server listening at', server.url()
+    print 'Press Ctrl-C to stop'
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
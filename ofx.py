@@ -66,8 +66,35 @@
 # 19Nov2019*rlc
 #   - Add site delay option
 
+# 18Oct2026*rlc
+#   - Added getOFXList() to download accounts concurrently using a pool of worker threads.
+#     Number of workers and the max connections per site are defined in sites.dat.  Errors are reported
+#     per account, and each account's console output is printed together, in account order
+#   - Keep https connections open between requests (HTTPSPool), so accounts at the same host share a
+#     connection.  Dropped connections are retried once on a fresh connection.
+#   - Add batch site option.  When enabled, all accounts for a site+username are requested after a single 
+#     sign-on (getOFXBatch), and the response is split into a statement file per account.
+#   - Add incremental downloads.  The last statement date for each account is saved in watermark.dat
+#     after the statement is sent to Money, and the next request starts from that date (less an overlap).
+#     Watermarks older than 90 days are ignored (the normal download interval is used).
+#   - Process downloads in memory (validate, account# remap, scrub) and write the statement file once.
+#     Account# remap no longer upper-cases the statement.
+#   - Add compress site option: request gzip/deflate responses, and decompress them as they're read.
+#     Bytes received vs uncompressed are counted per host (transferStats) and reported by Getdata.
+#   - Remember which POST request variant last worked for each host (variants.dat), and try it first.
+#   - Time each phase of a bank connection (dns, connect, tls, send, wait, read, validate, scrub).
+#     Results are appended to xfrdir/metrics.jsonl, and summarized by Getdata.
+#   - Use the shared site configuration (site_cfg.getSiteCfg)
+#   - _checkOFX() validates the statement w/o building a stripped, upper-case copy (validOFX strip option)
+#   - Account number remap (ACCTID) uses the ofxdoc tokenizer:  only the ACCTID values are rewritten
+#   - getOFX() spools the response to a temp file.  Statements larger than STREAM_SIZE are checked and scrubbed
+#     in pieces (_checkOFXFile, scrubber.scrubStream), so the whole statement isn't loaded into memory
+#   - Concurrent downloads scrub statements in the scrubber process pool (scrubber.pool), so they aren't 
+#     limited to one core.  Scrubber messages for a statement are printed together
+
 import time, os, sys, httplib, urllib2, glob, random, re
-import getpass, scrubber, site_cfg, uuid
+import getpass, scrubber, site_cfg, uuid, threading, Queue, socket, select, md5, pickle, zlib, ofxdoc
+import json, timeit, tempfile, shutil
 from control2 import *
 from rlib1 import *
 
@@ -79,7 +106,11 @@ join = str.join
 argv = sys.argv
 
 #define some globals
-userdat = site_cfg.site_cfg()
+userdat = site_cfg.getSiteCfg()
+
+#statements larger than this are spooled to disk as they're received, and checked/scrubbed in pieces 
+#(see _checkOFXFile), so memory use is bounded by the largest transaction rather than the statement size
+STREAM_SIZE = scrubber.STREAM_SIZE
                                                
 class OFXClient:
     #Encapsulate an ofx client, site is a dict containg site configuration
@@ -95,6 +126,8 @@ class OFXClient:
         prefix, path = urllib2.splittype(self.url)
         #path='//test.ofx.com/my/script';  Host= 'test.ofx.com' ; Selector= '/my/script'
         self.urlHost, self.urlSelector = urllib2.splithost(path)
+        self.compress = FieldVal(site, "COMPRESS")      #ask for a gzip/deflate response?
+        self.timer = PhaseTimer()                        #connection timing for the last query
         if Debug: 
             print 'urlHost    :', self.urlHost
             print 'urlSelector:', self.urlSelector, '\n'
@@ -134,6 +167,9 @@ class OFXClient:
         return self._message("SIGNUP","ACCTINFO",req)
 
     def _bareq(self, bankid, acctid, dtstart, acct_type):
+        return self._message("BANK","STMT",self._stmtrq(bankid, acctid, dtstart, acct_type))
+    
+    def _stmtrq(self, bankid, acctid, dtstart, acct_type):
         site=self.site
         ver=self.ofxver
         req = OfxTag("STMTRQ",
@@ -145,9 +181,12 @@ class OFXClient:
                 OfxField("DTSTART",dtstart, ver),
                 OfxField("INCLUDE","Y", ver))
                 )
-        return self._message("BANK","STMT",req)
+        return req
     
     def _ccreq(self, acctid, dtstart):
+        return self._message("CREDITCARD","CCSTMT",self._ccstmtrq(acctid, dtstart))
+
+    def _ccstmtrq(self, acctid, dtstart):
         site=self.site
         ver  = self.ofxver
         req = OfxTag("CCSTMTRQ",
@@ -155,9 +194,12 @@ class OFXClient:
               OfxTag("INCTRAN",
               OfxField("DTSTART",dtstart, ver),
               OfxField("INCLUDE","Y", ver)))
-        return self._message("CREDITCARD","CCSTMT",req)
+        return req
 
     def _invstreq(self, brokerid, acctid, dtstart):
+        return self._message("INVSTMT","INVSTMT",self._invstmtrq(brokerid, acctid, dtstart))
+
+    def _invstmtrq(self, brokerid, acctid, dtstart):
         dtnow = time.strftime("%Y%m%d%H%M%S",time.localtime())
         ver  = self.ofxver
         req = OfxTag("INVSTMTRQ",
@@ -172,15 +214,16 @@ class OFXClient:
                     OfxField("DTASOF", dtnow, ver),
                     OfxField("INCLUDE","Y", ver)),
                 OfxField("INCBAL","Y", ver))
-        return self._message("INVSTMT","INVSTMT",req)
+        return req
 
-    def _message(self,msgType,trnType,request):
+    def _message(self,msgType,trnType,*requests):
+        #message set w/ one transaction (TRNRQ) per request.  OFX allows several per message set
         site = self.site
         ver  = self.ofxver
-        return OfxTag(msgType+"MSGSRQV1",
-               OfxTag(trnType+"TRNRQ",
-               OfxField("TRNUID",ofxUUID(), ver),
-               request))
+        trnrq = [OfxTag(trnType+"TRNRQ",
+                 OfxField("TRNUID",ofxUUID(), ver),
+                 request) for request in requests]
+        return OfxTag(msgType+"MSGSRQV1", *trnrq)
     
     def _header(self):
         site = self.site
@@ -233,71 +276,182 @@ class OFXClient:
                     self._signOn(),
                     self._invstreq(brokerid, acctid, dtstart))])
 
-    def doQuery(self,query,name):
+    def batchQuery(self, msgType, trnType, requests):
+        #several statement requests of the same type (e.g., all CCSTMTRQ for a user) following a single sign-on
+        return join("\r\n",[self._header(),
+                    OfxTag("OFX",
+                    self._signOn(),
+                    self._message(msgType, trnType, *requests))])
+
+    def _sendRequest(self, h, i, query, response):
+        #send POST request variant i on connection h.  response = server response to the previous variant
+        #returns True if session cookies from the previous response were sent
+        cookieSent = False
+        if i in [0,1]:
+            #V2 request supports latest Discover
+            h.putrequest('POST', self.urlSelector, skip_host=1, skip_accept_encoding=1)
+            
+            h.putheader('Content-Type', 'application/x-ofx')
+            h.putheader('Host', self.urlHost)
+            h.putheader('Content-Length', str(len(query)))
+            h.putheader('Connection', 'Keep-Alive')
+            if self.compress: h.putheader('Accept-Encoding', 'gzip, deflate')
+            
+            #optional parameters are appended only when failure on first pass
+            #   + cookies are added if provided by server on first pass
+            #   + user-agent is always added on second pass
+            if i==1:
+                h.putheader('User-Agent', 'PocketSense')
+                #this is our second pass, so add session cookies if found in first response
+                #(no previous response when this variant is tried first... see RequestVariants)
+                cookie = response.getheader('set-cookie') if response else None   #server cookie(s) provided in last response
+                if cookie <> None: 
+                    if Debug: print '<Response Cookies>', cookie
+                    h.putheader('cookie', cookie)
+                    cookieSent = True
+            h.endheaders(query)
+
+        else:
+           #i=2: try V1 request (deprecated).  Shouldn't get here... keeping "just in case"
+           headers = {"Content-type": "application/x-ofx",
+                      "Accept": "application/x-ofx"}
+           if self.compress: headers["Accept-Encoding"] = "gzip, deflate"
+           h.request('POST', self.urlSelector, query, headers)
+        
+        return cookieSent
+
+    def _readResponse(self, response, out=None):
+        #read the response body.  gzip/deflate content is decompressed as it arrives
+        #returns the body, or writes it to file out (a chunk at a time) if given
+        encoding = (response.getheader('content-encoding') or '').strip().lower()
+        if encoding not in ['gzip', 'deflate', 'x-gzip']:
+            if out:
+                shutil.copyfileobj(response, out, 65536)
+                n = out.tell()
+                out.seek(0)
+                respDat = out
+            else:
+                respDat = response.read()
+                n = len(respDat)
+            transferStats.add(self.urlHost, n, n)
+            self.timer.count(n, n)
+            return respDat
+        
+        dc = None
+        wireBytes = 0
+        dataBytes = 0
+        respDat = []
+        while True:
+            chunk = response.read(65536)
+            if not chunk: break
+            if dc is None:
+                if encoding == 'deflate' and not _zlibHeader(chunk):
+                    dc = zlib.decompressobj(-zlib.MAX_WBITS)    #some servers send raw deflate (no zlib header)
+                elif encoding == 'deflate':
+                    dc = zlib.decompressobj()
+                else:
+                    dc = zlib.decompressobj(16 + zlib.MAX_WBITS)  #gzip header+trailer
+            wireBytes += len(chunk)
+            data = dc.decompress(chunk)
+            dataBytes += len(data)
+            if out: out.write(data)
+            else: respDat.append(data)
+        if dc: 
+            data = dc.flush()
+            dataBytes += len(data)
+            if out: out.write(data)
+            else: respDat.append(data)
+        if out:
+            out.seek(0)
+            respDat = out
+        else:
+            respDat = ''.join(respDat)
+        
+        if Debug: print 'Response content-encoding=%s: %i bytes received, %i bytes decompressed' % (encoding, wireBytes, dataBytes)
+        transferStats.add(self.urlHost, wireBytes, dataBytes)
+        self.timer.count(wireBytes, dataBytes)
+        return respDat
+
+    def doQuery(self,query,name=None,spool=False):
         # urllib doesn't honor user Content-type, use urllib2
+        # returns the response, and writes it to file <name> if given.  self.status=False if the request fails
+        # spool=True:  the response is returned as a temp file (kept in memory unless it's larger than 
+        #   STREAM_SIZE), positioned at the start.  for statements that may be too large to load at once
 
+        respDat = tempfile.SpooledTemporaryFile(max_size=STREAM_SIZE) if spool else ''
         response=False
+        h = None
+        timer = self.timer = PhaseTimer()
         try:
             errmsg= "** An ERROR occurred attempting HTTPS connection to"
-            h = httplib.HTTPSConnection(self.urlHost, timeout=5)
-            if Debug: h.set_debuglevel(1)
-            
-            #proxy config for fiddler tests
-            #h = httplib.HTTPSConnection('localhost:8888', timeout=5)
-            #h.set_tunnel(self.urlHost)
-            
-            errmsg= "** An ERROR occurred sending POST request to"
+            #connections are kept open (keep-alive) and shared by all accounts at the same host
+            h, reused = connPool.get(self.urlHost)
+            h.timer = timer
+            timer.reused = reused
             
             #try without a user-agent or cookie, and retry if the first one fails
             #if both fail, revert to V1 request method
+            #the variant that worked last time for this host is tried first
             
             response = None
+            worked = None
             
-            for i in [0,1,2]:
-                if i in [0,1]:
-                    #V2 request supports latest Discover
-                    h.putrequest('POST', self.urlSelector, skip_host=1, skip_accept_encoding=1)
-                    
-                    h.putheader('Content-Type', 'application/x-ofx')
-                    h.putheader('Host', self.urlHost)
-                    h.putheader('Content-Length', str(len(query)))
-                    h.putheader('Connection', 'Keep-Alive')
-                    
-                    #optional parameters are appended only when failure on first pass
-                    #   + cookies are added if provided by server on first pass
-                    #   + user-agent is always added on second pass
-                    if i==1:
-                        h.putheader('User-Agent', 'PocketSense')
-                        #this is our second pass, so add session cookies if found in first response
-                        cookie = response.getheader('set-cookie')   #server cookie(s) provided in last response
-                        if cookie <> None: 
-                            if Debug: print '<Response Cookies>', cookie
-                            h.putheader('cookie', cookie)
-                    h.endheaders(query)
-
-                else:
-                   #i=2: try V1 request (deprecated).  Shouldn't get here... keeping "just in case"
-                   h.request('POST', self.urlSelector, query, 
-                             {"Content-type": "application/x-ofx",
-                              "Accept": "application/x-ofx"})
-                    
-                errmsg= "** An ERROR occurred retrieving POST response from"
-                #allow up to 30 secs for the server response (if it takes longer, something's wrong)
-                h.sock.settimeout(30) 
-                response = h.getresponse()
-                respDat  = response.read()
+            for i in requestVariants.order(self.urlHost):
+                while True:
+                    try:
+                        errmsg= "** An ERROR occurred sending POST request to"
+                        timer.variant = i
+                        t = timer.start()
+                        cookieSent = self._sendRequest(h, i, query, response)
+                        t = timer.stop('send', t)    #excludes connect phases (timed by the connection)
+                            
+                        errmsg= "** An ERROR occurred retrieving POST response from"
+                        #allow up to 30 secs for the server response (if it takes longer, something's wrong)
+                        h.sock.settimeout(30) 
+                        resp = h.getresponse()
+                        t = timer.stop('wait', t)    #time to first byte (response headers)
+                        if spool: respDat = tempfile.SpooledTemporaryFile(max_size=STREAM_SIZE)
+                        respDat  = self._readResponse(resp, respDat if spool else None)
+                        timer.stop('read', t)
+                        break
+                    except connPool.dropped as e:
+                        if not reused or isinstance(e, socket.timeout): raise
+                        #the server closed our pooled connection.  try once more on a fresh one
+                        if Debug: print 'Pooled connection to', self.urlHost, 'was dropped.  Reconnecting.'
+                        h.close()
+                        h, reused = connPool.connect(self.urlHost), False
+                        h.timer = timer
+                        
+                response = resp
             
                 #if this is a OFX 2.x response, replace the header w/ OFX 1.x
                 if self.ofxver[0] == '2':
-                    respDat = re.sub(r'<\?.*\?>', '', respDat)      #remove xml header lines like <? content...content ?>
-                    respDat = OfxSGMLHeader() + respDat.lstrip()
+                    if spool:
+                        respDat = _sgmlHeaderFile(respDat)
+                    else:
+                        respDat = re.sub(r'<\?.*\?>', '', respDat)      #remove xml header lines like <? content...content ?>
+                        respDat = OfxSGMLHeader() + respDat.lstrip()
             
+ 
                 #did we get a valid response?  if not, try again w/ different request header
-                if validOFX(respDat)=='': break
+                t = timer.start()
+                msg = validOFX(respDat)
+                if spool: respDat.seek(0)
+                timer.stop('validate', t)
+                if msg=='': 
+                    #a variant 1 success that depended on cookies from a variant 0 response can't go first
+                    worked = 0 if cookieSent else i
+                    break
             
-            f = file(name,"w")
-            f.write(respDat)
-            f.close()
+            requestVariants.learn(self.urlHost, worked)
+            
+            if name: _writeOFX(name, respDat)
+            
+            #keep the connection for the next request, unless the server wants it closed
+            if not response.will_close:
+                h.timer = None
+                connPool.put(self.urlHost, h)
+                h = None
             
         except Exception as e:
             self.status = False
@@ -310,10 +464,325 @@ class OFXClient:
                 print "   HTTPS ResponseReason:", response.reason
 
         if h: h.close()   
+        return respDat
+        
+class HTTPSPool:
+    #Persistent https connections, keyed by host, shared by all OFXClient instances for the session.
+    #Idle connections expire after idleTimeout seconds, and are checked before they're reused.
+    
+    #exceptions that indicate the server closed a (reused) keep-alive connection
+    dropped = (httplib.BadStatusLine, httplib.CannotSendRequest, httplib.ResponseNotReady, 
+               socket.error)
+    
+    def __init__(self, idleTimeout=60):
+        self.idleTimeout = idleTimeout
+        self.idle = {}          #host: [[connection, lastUsed], ...]
+        self.lock = threading.Lock()
+
+    def connect(self, host):
+        #new (unopened) connection to host.  connects on first request
+        h = TimedHTTPSConnection(host, timeout=5)
+        if Debug: h.set_debuglevel(1)
+        
+        #proxy config for fiddler tests
+        #h = TimedHTTPSConnection('localhost:8888', timeout=5)
+        #h.set_tunnel(host)
+        return h
+        
+    def get(self, host):
+        #return (connection, reused) for host.  reuse an idle connection if we have a healthy one
+        now = time.time()
+        with self.lock:
+            conns = self.idle.get(host, [])
+            while conns:
+                h, lastUsed = conns.pop()
+                if now - lastUsed < self.idleTimeout and self._alive(h):
+                    return h, True
+                h.close()
+        return self.connect(host), False
+        
+    def put(self, host, h):
+        #return connection h to the pool after a completed request
+        with self.lock:
+            self.idle.setdefault(host, []).append([h, time.time()])
+    
+    def closeAll(self):
+        with self.lock:
+            for host in self.idle:
+                for h, lastUsed in self.idle[host]:
+                    h.close()
+            self.idle = {}
         
+    def _alive(self, h):
+        #an idle keep-alive socket should have nothing to read.  if it's readable, the server
+        #has closed it (EOF) or sent something unexpected... either way, don't reuse it
+        if h.sock is None: return False
+        try:
+            r, w, x = select.select([h.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not r
+
+connPool = HTTPSPool()      #session connection pool, shared by Getdata and Setup
+
+class RequestVariants:
+    #POST request variant (see OFXClient._sendRequest) that last worked for each host, saved in datfile.
+    #The learned variant is tried first, followed by the normal order, so an expired or wrong entry
+    #only costs the request that's tried first.  Entries expire after maxAge days.
+    
+    def __init__(self, datfile='variants.dat', maxAge=30):
+        self.datfile = datfile
+        self.maxAge = maxAge
+        self.hosts = None       #host: [variant, time learned].  loaded on first use
+        self.lock = threading.Lock()
+    
+    def _load(self):
+        if self.hosts is None:
+            self.hosts = {}
+            if glob.glob(self.datfile) <> []:
+                f = open(self.datfile, 'rb')
+                try:
+                    self.hosts = pickle.load(f)
+                except:
+                    pass    #start over
+                f.close()
+    
+    def _save(self):
+        f = open(self.datfile, 'wb')
+        pickle.dump(self.hosts, f)
+        f.close()
+    
+    def order(self, host):
+        #variants to try for host, in order
+        with self.lock:
+            self._load()
+            variant, learned = self.hosts.get(host, [0, 0])
+        if time.time() - learned > self.maxAge*86400: variant = 0
+        if Debug and variant: print 'Trying request variant', variant, 'first for', host
+        if variant == 1: return [1, 0, 1, 2]      #retry w/ cookies from a variant 0 response, if it fails
+        if variant == 2: return [2, 0, 1]
+        return [0, 1, 2]
+    
+    def learn(self, host, variant):
+        #variant worked for host (variant=None if none did).  a total failure (server down, bad login, ...)
+        #doesn't say anything about the variants, so the learned entry is kept
+        if variant is None: return
+        with self.lock:
+            self._load()
+            if variant:
+                self.hosts[host] = [variant, time.time()]
+                self._save()
+            elif host in self.hosts:
+                del self.hosts[host]    #default order works
+                self._save()
+
+requestVariants = RequestVariants()
+
+class PhaseTimer:
+    #elapsed time for each phase of a bank request.  phases are added up if they occur more than once
+    def __init__(self):
+        self.phases = {}
+        self.variant = None     #last request variant sent
+        self.reused = False     #pooled connection reused?
+        self.wireBytes = 0
+        self.dataBytes = 0
+        self.excluded = 0.0     #time spent in nested phases (connect), excluded from the enclosing phase
+        
+    def start(self):
+        self.excluded = 0.0
+        return timeit.default_timer()
+    
+    def stop(self, phase, t0, nested=False):
+        #add time since t0 to phase.  returns the current time, for starting the next phase
+        now = timeit.default_timer()
+        elapsed = now - t0
+        if nested:
+            self.excluded += elapsed
+        else:
+            elapsed -= self.excluded
+            self.excluded = 0.0
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        return now
+    
+    def count(self, wireBytes, dataBytes):
+        self.wireBytes += wireBytes
+        self.dataBytes += dataBytes
+        
+def _timedConnect(h, timer):
+    #open the socket for connection h, timing the dns and connect phases.  returns the current time
+    t = timeit.default_timer()
+    addrs = socket.getaddrinfo(h.host, h.port, 0, socket.SOCK_STREAM)
+    t = timer.stop('dns', t, True)
+    
+    #connect to the first address that answers (same as socket.create_connection)
+    for i in range(len(addrs)):
+        try:
+            h.sock = h._create_connection(addrs[i][4][:2], h.timeout, h.source_address)
+            break
+        except socket.error:
+            if i == len(addrs)-1: raise
+    if h._tunnel_host:
+        h._tunnel()
+    return timer.stop('connect', t, True)
+
+class TimedHTTPSConnection(httplib.HTTPSConnection):
+    #HTTPSConnection that times its connect phases (dns, connect, tls) into self.timer, if set
+    timer = None
+    
+    def connect(self):
+        timer = self.timer or PhaseTimer()
+        t = _timedConnect(self, timer)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname)
+        timer.stop('tls', t, True)
+
+class Metrics:
+    #connection timing records for the session (see PhaseTimer).  
+    #write() appends them to a JSON-lines file, one record per request
+    phases = ['dns', 'connect', 'tls', 'send', 'wait', 'read', 'validate', 'scrub']
+    
+    def __init__(self, fname=xfrdir+'metrics.jsonl'):
+        self.fname = fname
+        self.records = []
+        self.lock = threading.Lock()
+        self.run = time.strftime("%Y-%m-%dT%H:%M:%S",time.localtime())
+    
+    def record(self, sitename, client, accounts, status):
+        timer = client.timer
+        rec = {'run': self.run, 'site': sitename, 'host': client.urlHost, 'accounts': accounts, 
+               'status': status, 'variant': timer.variant, 'reused': timer.reused, 
+               'bytes': timer.dataBytes, 'wireBytes': timer.wireBytes,
+               'phases': dict((p, round(timer.phases.get(p, 0.0), 4)) for p in self.phases)}
+        rec['total'] = round(sum(rec['phases'].values()), 4)
+        with self.lock:
+            self.records.append(rec)
+    
+    def write(self):
+        if not self.records: return
+        try:
+            f = open(self.fname, 'a')
+            for rec in self.records:
+                f.write(json.dumps(rec, sort_keys=True) + '\n')
+            f.close()
+        except IOError as e:
+            print '** Could not write', self.fname, ':', e
+    
+    def summary(self):
+        #print seconds per phase, by site
+        if not self.records: return
+        sites = {}
+        for rec in self.records:
+            s = sites.setdefault(rec['site'], dict((p, 0.0) for p in self.phases + ['total']))
+            for p in self.phases: s[p] += rec['phases'][p]
+            s['total'] += rec['total']
+        
+        print 'Connection timing (seconds):'
+        print '  {0:20}'.format('Site') + ''.join('{0:>9}'.format(p) for p in self.phases + ['total'])
+        for site in sorted(sites, key=lambda x: -sites[x]['total']):
+            print '  {0:20}'.format(site[:20]) + ''.join('{0:9.3f}'.format(sites[site][p]) for p in self.phases + ['total'])
+        print ''
+
+metrics = Metrics()
+
+def _zlibHeader(dat):
+    #does dat begin w/ a valid zlib (RFC 1950) header?
+    if len(dat) < 2: return False
+    cmf, flg = ord(dat[0]), ord(dat[1])
+    return (cmf & 0x0f) == 8 and ((cmf << 8) + flg) % 31 == 0
+    
+class TransferStats:
+    #bytes received (on the wire) and after decompression, per host, for the session
+    def __init__(self):
+        self.hosts = {}         #host: [wireBytes, dataBytes]
+        self.lock = threading.Lock()
+    
+    def add(self, host, wireBytes, dataBytes):
+        with self.lock:
+            stat = self.hosts.setdefault(host, [0, 0])
+            stat[0] += wireBytes
+            stat[1] += dataBytes
+    
+    def report(self):
+        #print bandwidth summary, if compression was used for any host
+        if not [h for h in self.hosts if self.hosts[h][0] <> self.hosts[h][1]]: return
+        print 'Download bandwidth (received / uncompressed):'
+        for host in sorted(self.hosts):
+            wire, data = self.hosts[host]
+            saved = 100.0 * (data - wire) / data if data else 0.0
+            print '  {0:40} {1:9.1f} KB / {2:9.1f} KB  ({3:.0f}% saved)'.format(host, wire/1024.0, data/1024.0, saved)
+        print ''
+
+transferStats = TransferStats()
+
+class Watermarks:
+    #Statement end date (YYYYMMDD) of the last download sent to Money for each account, saved in datfile.
+    #Keys are md5(sitename+account#), so account numbers aren't stored in the clear.
+    #New dates are held as "pending" (by statement file) until commit() is called for the file, so that
+    #a statement that never makes it to Money doesn't move the watermark.
+    
+    maxAge = 90     #days.  an older watermark (account not downloaded in a while) isn't used
+    
+    def __init__(self, datfile='watermark.dat'):
+        self.datfile = datfile
+        self.marks = None       #loaded on first use
+        self.pending = {}       #ofxFileName: [key, dtend]
+        self.lock = threading.Lock()
+        
+    def _key(self, sitename, acct):
+        return md5.md5(sitename + acct).digest()
+        
+    def _load(self):
+        if self.marks is None:
+            self.marks = {}
+            if glob.glob(self.datfile) <> []:
+                f = open(self.datfile, 'rb')
+                try:
+                    self.marks = pickle.load(f)
+                except:
+                    print '** Error reading', self.datfile, '... incremental start dates are reset'
+                f.close()
+    
+    def startDate(self, sitename, acct, dtstart):
+        #start date (YYYYMMDD) for the next request for acct = watermark - overlap.
+        #dtstart (normal start date for the site) is returned if there's no watermark yet, or if
+        #it's older than maxAge days.  the start date is never later than the site's minInterval allows
+        with self.lock:
+            self._load()
+            mark = self.marks.get(self._key(sitename, acct), None)
+        if mark is None: return dtstart
+        
+        site = userdat.sites[sitename]
+        t = time.mktime(time.strptime(mark, "%Y%m%d")) - userdat.incrementalOverlap*86400
+        if t < time.time() - self.maxAge*86400: return dtstart
+        latest = time.time() - int2(FieldVal(site, 'mininterval'))*86400
+        return time.strftime("%Y%m%d", time.localtime(min(t, latest)))
+    
+    def add(self, ofxFileName, sitename, acct, dtend):
+        #hold new watermark for the statement in ofxFileName
+        if dtend:
+            with self.lock:
+                self.pending[ofxFileName] = [self._key(sitename, acct), dtend]
+    
+    def commit(self, ofxFiles):
+        #statements in ofxFiles were sent to Money.  save their watermarks
+        with self.lock:
+            self._load()
+            found = False
+            for fname in ofxFiles:
+                if fname in self.pending:
+                    key, dtend = self.pending.pop(fname)
+                    self.marks[key] = max(dtend, self.marks.get(key, ''))
+                    found = True
+            if found:
+                f = open(self.datfile, 'wb')
+                pickle.dump(self.marks, f)
+                f.close()
+
+watermarks = Watermarks()
+
 #------------------------------------------------------------------------------
 
-def getOFX(account, interval):
+def getOFX(account, interval, incremental=False):
 
     sitename   = account[0]
     _acct_num  = account[1]             #account value defined in sites.dat
@@ -325,56 +794,26 @@ def getOFX(account, interval):
     #get site and other user-defined data
     site = userdat.sites[sitename]
     
-    #set the interval (days)
-    minInterval = FieldVal(site,'mininterval')    #minimum interval (days) defined for this site (optional)
-    if minInterval:
-         interval = max(minInterval, interval)    #use the longer of the two
-    
     #set the start date/time
-    dtstart = time.strftime("%Y%m%d",time.localtime(time.time()-interval*86400))
-    dtnow = time.strftime("%Y%m%d%H%M%S",time.localtime())
+    dtstart = _startDate(site, interval)
+    if incremental: dtstart = watermarks.startDate(sitename, _acct_num, dtstart)
 
     #add delay prior to connect if defined for site
-    delay = FieldVal(site, "DELAY")
-    if delay > 0.0: 
-        print "Delaying %.1f seconds..." % delay
-        time.sleep(delay)
+    _siteDelay(site)
 
     client = OFXClient(site, user, password)
     print sitename,':',acct_num,": Getting records since: ",dtstart
     
     status = True
-    
-    #remove illegal WinFile characters from the file name (in case someone included them in the sitename)
-    #Also, the os.system() call doesn't allow the '&' char, so we'll replace it too
-    sitename = ''.join(a for a in sitename if a not in ' &\/:*?"<>|()')  #first char is a space
-    
-    ofxFileSuffix = str(random.randrange(1e5,1e6)) + ".ofx"
-    ofxFileName = xfrdir + sitename + dtnow + ofxFileSuffix
+    ofxFileName = _ofxFileName(sitename)
+    respDat = ''
     
     try:
         if acct_num == '':
             query = client.acctQuery()
         else:
-            caps = FieldVal(site, "CAPS")
-            
-            if "CCSTMT" in caps:
-                query = client.ccQuery(acct_num, dtstart)
-            elif "INVSTMT" in caps:
-                #if we have a brokerid, use it.  Otherwise, try the fiorg value.
-                orgID = FieldVal(site, 'BROKERID')
-                if orgID == '': orgID = FieldVal(site, 'FIORG')
-                if orgID == '':
-                    msg = '** Error: Site', sitename, 'does not have a (REQUIRED) BrokerID or FIORG value defined.'
-                    raise Exception(msg)
-                query = client.invstQuery(orgID, acct_num, dtstart)
-
-            elif "BASTMT" in caps:
-                bankid = FieldVal(site, "BANKID")
-                if bankid == '':
-                    msg='** Error: Site', sitename, 'does not have a (REQUIRED) BANKID value defined.'
-                    raise Exception(msg)
-                query = client.baQuery(bankid, acct_num, dtstart, acct_type)
+            msgType, trnType, request = _stmtRequest(client, site, sitename, acct_num, dtstart, acct_type)
+            query = client.batchQuery(msgType, trnType, [request])
 
         SendRequest = True
         if Debug: 
@@ -383,49 +822,441 @@ def getOFX(account, interval):
             ask = raw_input('DEBUG:  Send request to bank server (y/n)?').upper()
             if ask=='N': return True, ''
         
-        #do the deed
-        client.doQuery(query, ofxFileName)
-        if not client.status: return False, ''
+        #do the deed.  the response is spooled to a temp file, in case it's a very large statement
+        respDat = client.doQuery(query, spool=True)
+        if not client.status: 
+            metrics.record(sitename, client, 1, False)
+            return False, ''
         
-        #check the ofx file and make sure it looks valid (contains header and <ofx>...</ofx> blocks)
-        if glob.glob(ofxFileName) == []:
-            status = False  #no ofx file?
-        else: 
-            f = open(ofxFileName,'r')
-            content = f.read().upper()
-            f.close
-
-            if acct_num <> _acct_num:
-                #replace bank account number w/ value defined in sites.dat
-                content = content.replace('<ACCTID>'+acct_num, '<ACCTID>'+ _acct_num)
-                f = open(ofxFileName,'w')
-                f.write(content)
-                f.close()
-                
-            content = ''.join(a for a in content if a not in '\r\n ')  #strip newlines & spaces
-            msg = validOFX(content)  #checks for valid format and error messages
-            
-            if msg<>'':
-                #throw exception and exit
-                raise Exception(msg)
-                
-            #attempted debug of a Vanguard issue... rlc*2010
-            if content.find('<INVPOS>') > -1 and content.find('<SECLIST>') < 0:
-                #An investment statement must contain a <SECLIST> section when a <INVPOSLIST> section exists
-                #Some Vanguard statements have been missing this when there are no transactions, causing Money to crash
-                #It may be necessary to match every investment position with a security entry, but we'll try to just
-                #verify the existence of these section pairs. rlc*9/2010
-                raise Exception("OFX statement is missing required <SECLIST> section.")
-                
-            #cleanup the file if needed
-            scrubber.scrub(ofxFileName, site)
+        #check the response and make sure it looks valid (contains header and <ofx>...</ofx> blocks)
+        #and clean it up.  the file is written once, after processing
+        if _fileSize(respDat) > STREAM_SIZE:
+            dtend = _checkOFXFile(respDat, site, acct_num, _acct_num, ofxFileName, client.timer)
+        else:
+            ofx, dtend = _checkOFX(respDat.read(), site, acct_num, _acct_num, client.timer)
+            _writeOFX(ofxFileName, ofx)
+        watermarks.add(ofxFileName, sitename, _acct_num, dtend)
         
     except Exception as inst:
         status = False
         print inst
-        if glob.glob(ofxFileName) <> []:
+        if _received(respDat):
+           #save the raw response for review
+           _writeOFX(ofxFileName, respDat)
            print '**  Review', ofxFileName, 'for possible clues...'
         if Debug:
             traceback.print_exc()
-        
+    
+    if _received(respDat): metrics.record(sitename, client, 1, status)
+    if hasattr(respDat, 'close'): respDat.close()
     return status, ofxFileName
+
+def getOFXBatch(accounts, interval, incremental=False):
+    #download statements for several accounts w/ a single request (one sign-on, one TRNRQ per account)
+    #all accounts must have the same sitename and username (see getOFXList).
+    #the response is split into a separate statement file per account, so that each is handled 
+    #the same as a getOFX() download.  
+    #returns a list of [status, ofxFileName] entries in the same order as accounts
+    
+    sitename = accounts[0][0]
+    user     = accounts[0][3]
+    password = accounts[0][4]
+    site = userdat.sites[sitename]
+    _siteDelay(site)
+    
+    client = OFXClient(site, user, password)
+    batchFileName = _ofxFileName(sitename)
+    respDat = ''
+    
+    try:
+        requests = []
+        for acct in accounts:
+            acct_num = acct[1].split(':')[0]
+            dtstart = _startDate(site, interval)
+            if incremental: dtstart = watermarks.startDate(sitename, acct[1], dtstart)
+            print sitename,':',acct_num,": Getting records since: ",dtstart
+            msgType, trnType, request = _stmtRequest(client, site, sitename, acct_num, dtstart, acct[2])
+            requests.append(request)
+        query = client.batchQuery(msgType, trnType, requests)
+        
+        if Debug: 
+            print query
+            print
+            ask = raw_input('DEBUG:  Send request to bank server (y/n)?').upper()
+            if ask=='N': return [[True, '']] * len(accounts)
+        
+        print sitename,": Sending", len(accounts), "account requests in one batch"
+        respDat = client.doQuery(query)
+        if not client.status: 
+            metrics.record(sitename, client, len(accounts), False)
+            return [[False, '']] * len(accounts)
+        
+        stmts = _splitBatch(respDat, msgType, trnType)
+        if not stmts:
+            #sign-on failed, or the server doesn't support multiple statements per request
+            msg = validOFX(respDat)
+            if msg == '': msg = 'No statements found in batched response.  Try setting batch=No for ' + sitename
+            raise Exception(msg)
+            
+    except Exception as inst:
+        print inst
+        if respDat:
+           _writeOFX(batchFileName, respDat)
+           print '**  Review', batchFileName, 'for possible clues...'
+        if Debug:
+            traceback.print_exc()
+        if not respDat: return [[False, ''] for acct in accounts]
+        metrics.record(sitename, client, len(accounts), False)
+        #the response file is reported once (first account), so it's not sent to Money for every account
+        return [[False, batchFileName]] + [[False, ''] for acct in accounts[1:]]
+    
+    results = []
+    for acct in accounts:
+        _acct_num = acct[1]
+        acct_num = _acct_num.split(':')[0]
+        ofxFileName = _ofxFileName(sitename)
+        status = True
+        stmt = ''
+        try:
+            stmt = stmts.get(acct_num.upper(), '')
+            if stmt == '':
+                raise Exception('Statement for account ' + acct_num + ' not found in batched response')
+            ofx, dtend = _checkOFX(stmt, site, acct_num, _acct_num, client.timer)
+            _writeOFX(ofxFileName, ofx)
+            watermarks.add(ofxFileName, sitename, _acct_num, dtend)
+            
+        except Exception as inst:
+            status = False
+            print sitename,':',acct_num,':',inst
+            if stmt:
+               _writeOFX(ofxFileName, stmt)
+               print '**  Review', ofxFileName, 'for possible clues...'
+            if Debug:
+                traceback.print_exc()
+        
+        results.append([status, ofxFileName])
+    
+    metrics.record(sitename, client, len(accounts), not False in [r[0] for r in results])
+    return results
+    
+def _startDate(site, interval):
+    #start date for statement requests = now - interval (days)
+    minInterval = FieldVal(site,'mininterval')    #minimum interval (days) defined for this site (optional)
+    if minInterval:
+         interval = max(minInterval, interval)    #use the longer of the two
+    return time.strftime("%Y%m%d",time.localtime(time.time()-interval*86400))
+
+def _siteDelay(site):
+    #add delay prior to connect if defined for site
+    delay = FieldVal(site, "DELAY")
+    if delay > 0.0: 
+        print "Delaying %.1f seconds..." % delay
+        time.sleep(delay)
+
+def _ofxFileName(sitename):
+    #unique statement file name in xfrdir for sitename
+    
+    #remove illegal WinFile characters from the file name (in case someone included them in the sitename)
+    #Also, the os.system() call doesn't allow the '&' char, so we'll replace it too
+    sitename = ''.join(a for a in sitename if a not in ' &\/:*?"<>|()')  #first char is a space
+    dtnow = time.strftime("%Y%m%d%H%M%S",time.localtime())
+    ofxFileSuffix = str(random.randrange(1e5,1e6)) + ".ofx"
+    return xfrdir + sitename + dtnow + ofxFileSuffix
+
+def _stmtRequest(client, site, sitename, acct_num, dtstart, acct_type):
+    #statement request for acct_num, based on the account type (caps) defined for site
+    #returns [msgType, trnType, request]
+    caps = FieldVal(site, "CAPS")
+    
+    if "CCSTMT" in caps:
+        return ["CREDITCARD", "CCSTMT", client._ccstmtrq(acct_num, dtstart)]
+        
+    elif "INVSTMT" in caps:
+        #if we have a brokerid, use it.  Otherwise, try the fiorg value.
+        orgID = FieldVal(site, 'BROKERID')
+        if orgID == '': orgID = FieldVal(site, 'FIORG')
+        if orgID == '':
+            msg = '** Error: Site', sitename, 'does not have a (REQUIRED) BrokerID or FIORG value defined.'
+            raise Exception(msg)
+        return ["INVSTMT", "INVSTMT", client._invstmtrq(orgID, acct_num, dtstart)]
+
+    elif "BASTMT" in caps:
+        bankid = FieldVal(site, "BANKID")
+        if bankid == '':
+            msg='** Error: Site', sitename, 'does not have a (REQUIRED) BANKID value defined.'
+            raise Exception(msg)
+        return ["BANK", "STMT", client._stmtrq(bankid, acct_num, dtstart, acct_type)]
+    
+    raise Exception('** Error: Site ' + sitename + ' does not have a valid AcctType defined.')
+
+def _splitBatch(respDat, msgType, trnType):
+    #split a batched statement response into one stand-alone statement per account.
+    #each statement keeps the original header and sign-on response (and seclist for investment accounts)
+    #returns {ACCTID: ofx}
+    stmts = {}
+    r = re.search(r'<OFX>', respDat, re.IGNORECASE)
+    if not r: return stmts
+    header = respDat[:r.end()]
+    r = re.search(r'<SIGNONMSGSRSV1>.*?</SIGNONMSGSRSV1>', respDat, re.IGNORECASE | re.DOTALL)
+    signon = r.group(0) if r else ''
+    r = re.search(r'<SECLISTMSGSRSV1>.*?</SECLISTMSGSRSV1>', respDat, re.IGNORECASE | re.DOTALL)
+    seclist = r.group(0) if r else ''
+    
+    pTrn  = re.compile(r'<'+trnType+'TRNRS>.*?</'+trnType+'TRNRS>', re.IGNORECASE | re.DOTALL)
+    pAcct = re.compile(r'<ACCTID>\s*([^<\s]+)', re.IGNORECASE)
+    for trn in pTrn.finditer(respDat):
+        r = pAcct.search(trn.group(0))
+        if r:
+            stmts[r.group(1).upper()] = join("\r\n", [header, signon, 
+                                               OfxTag(msgType+'MSGSRSV1', trn.group(0)),
+                                               seclist, '</OFX>'])
+    return stmts
+    
+def _checkOFX(ofx, site, acct_num, _acct_num, timer=None):
+    #check the ofx response and make sure it looks valid, then clean it up for Money
+    #raises an exception if the statement isn't valid
+    #returns [ofx, dtend] = scrubbed statement, and the statement end date as YYYYMMDD 
+    #   (DTEND, or DTSERVER if there isn't one)
+    #validate and scrub times are added to timer (PhaseTimer), if given
+    if timer is None: timer = PhaseTimer()
+    t = timer.start()
+
+    if acct_num <> _acct_num:
+        #replace bank account number w/ value defined in sites.dat
+        acct = acct_num.upper()
+        ofx = ofxdoc.splice(ofx, [(vstart, vend, _acct_num) for tag, value, start, end, vstart, vend
+                                  in ofxdoc.leaves(ofx, ['ACCTID']) if value.upper() == acct])
+        
+    msg = validOFX(ofx, strip=True)  #checks for valid format and error messages, ignoring newlines & spaces
+    
+    if msg<>'':
+        #throw exception and exit
+        raise Exception(msg)
+        
+    #attempted debug of a Vanguard issue... rlc*2010
+    invpos, seclist = scanOFX(ofx, ['<INVPOS>', '<SECLIST>'], strip=True)[0]
+    if invpos > -1 and seclist < 0:
+        #An investment statement must contain a <SECLIST> section when a <INVPOSLIST> section exists
+        #Some Vanguard statements have been missing this when there are no transactions, causing Money to crash
+        #It may be necessary to match every investment position with a security entry, but we'll try to just
+        #verify the existence of these section pairs. rlc*9/2010
+        raise Exception("OFX statement is missing required <SECLIST> section.")
+    
+    #statement end date, before the scrubber has a chance to add one
+    r = re.search(r'<DTEND>\s*([0-9]{8})', ofx, re.IGNORECASE)
+    if not r: r = re.search(r'<DTSERVER>\s*([0-9]{8})', ofx, re.IGNORECASE)
+    dtend = r.group(1) if r else ''
+    t = timer.stop('validate', t)
+    
+    #cleanup the statement if needed
+    ofx, msgs = scrubber.pool.scrubOFX(ofx, site)
+    scrubber.printMsgs(msgs)
+    timer.stop('scrub', t)
+    
+    return ofx, dtend
+
+def _checkOFXFile(f, site, acct_num, _acct_num, ofxFileName, timer=None):
+    #_checkOFX() for a large statement in open file f, w/o loading it.  raises an exception if the statement 
+    #isn't valid.  the scrubbed statement is written to ofxFileName (scrubber.scrubStream)
+    #returns dtend = statement end date as YYYYMMDD (DTEND, or DTSERVER if there isn't one)
+    if timer is None: timer = PhaseTimer()
+    t = timer.start()
+
+    f.seek(0)
+    msg = validOFX(f, strip=True)
+    if msg<>'': raise Exception(msg)
+    
+    f.seek(0)
+    invpos, seclist = scanOFX(f, ['<INVPOS>', '<SECLIST>'], strip=True)[0]
+    if invpos > -1 and seclist < 0:
+        #see _checkOFX
+        raise Exception("OFX statement is missing required <SECLIST> section.")
+    t = timer.stop('validate', t)
+    
+    #the account number is replaced, and the dates found, as the statement is parsed for the scrubber
+    dates = {}
+    acct = acct_num.upper()
+    def leafFilter(tag, value, raw):
+        if tag in ['DTEND', 'DTSERVER'] and tag not in dates:
+            r = re.match('[0-9]{8}', value)
+            if r: dates[tag] = r.group(0)
+        elif tag == 'ACCTID' and acct_num <> _acct_num and value.upper() == acct:
+            i = raw.index('>') + 1
+            raw = raw[:i] + raw[i:].replace(value, _acct_num, 1)
+        return raw
+    
+    f.seek(0)
+    out = open(ofxFileName, 'w')
+    try:
+        scrubber.scrubStream(f, out, site, leafFilter)
+    finally:
+        out.close()
+    timer.stop('scrub', t)
+    
+    return dates.get('DTEND') or dates.get('DTSERVER', '')
+
+def _sgmlHeaderFile(f):
+    #replace the header of an OFX 2.x response in file f w/ an OFX 1.x header (see doQuery).
+    #only the xml header lines (before the first element tag) are rewritten.  the rest is copied in chunks
+    #returns a new temp file, positioned at the start
+    f.seek(0)
+    head = ''
+    while True:
+        chunk = f.read(65536)
+        head += chunk
+        r = re.search(r'<[^?]', head)
+        if r or not chunk: break
+    k = r.start() if r else len(head)
+    out = tempfile.SpooledTemporaryFile(max_size=STREAM_SIZE)
+    out.write(OfxSGMLHeader() + (re.sub(r'<\?.*\?>', '', head[:k]) + head[k:]).lstrip())
+    shutil.copyfileobj(f, out, 65536)
+    f.close()
+    out.seek(0)
+    return out
+
+def _fileSize(f):
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+def _received(respDat):
+    #did doQuery return a response?  respDat = string, or a spooled response file
+    return _fileSize(respDat) > 0 if hasattr(respDat, 'read') else respDat <> ''
+
+def _writeOFX(ofxFileName, ofx):
+    #ofx = statement string, or an open file (copied from the start)
+    f = open(ofxFileName,'w')
+    if hasattr(ofx, 'read'):
+        ofx.seek(0)
+        shutil.copyfileobj(ofx, f, 65536)
+    else:
+        f.write(ofx)
+    f.close()
+
+class _ThreadOutput:
+    #sys.stdout while getOFXList() runs worker threads.  console output from a thread that's collecting 
+    #(buf set) is saved, so that each account's output can be printed together, in account order
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+        
+    def write(self, text):
+        buf = getattr(self.local, 'buf', None)
+        if buf is None: 
+            self.stdout.write(text)
+        else:
+            buf.append(text)
+    
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+def getOFXList(AcctArray, interval, incremental=False):
+    #download statements for every account in AcctArray, using a pool of worker threads
+    #incremental=True: start each account at its watermark (last statement sent to Money), if we have one
+    #returns a list of [status, ofxFileName] entries in the same order as AcctArray
+    #   entry = None if the account was skipped (see skipFailedLogon option)
+
+    #accounts sharing a site+username are downloaded one after another by the same worker, so that
+    #a failed logon isn't retried for the other accounts (prevents accounts getting locked)
+    groups = []
+    groupIndex = {}
+    siteLimit = {}
+    for i in range(len(AcctArray)):
+        acct = AcctArray[i]
+        key = (acct[0], acct[3])
+        if key not in groupIndex:
+            groupIndex[key] = len(groups)
+            groups.append([])
+        groups[groupIndex[key]].append(i)
+        if acct[0] not in siteLimit:
+            siteLimit[acct[0]] = threading.BoundedSemaphore(userdat.maxSiteConnections)
+
+    results = [None] * len(AcctArray)
+    output = [None] * len(AcctArray)    #console output for each account (worker threads), '' once done
+    jobs = Queue.Queue()
+    for group in groups:
+        jobs.put(group)
+    out = None
+
+    def download(group):
+        #download the accounts in group.  an error is reported for the account, and doesn't stop the worker
+        site = userdat.sites.get(AcctArray[group[0]][0], {})
+        if len(group) > 1 and FieldVal(site, 'BATCH') and '' not in [AcctArray[i][1] for i in group]:
+            #site supports multiple statements per request.  get all accounts for this user at once
+            try:
+                with siteLimit[AcctArray[group[0]][0]]:
+                    batch = getOFXBatch([AcctArray[i] for i in group], interval, incremental)
+            except Exception as inst:
+                print AcctArray[group[0]][0], ':', inst
+                if Debug: traceback.print_exc()
+                batch = [[False, ''] for i in group]
+            for i, result in zip(group, batch):
+                results[i] = result
+            print ""
+            return
+            
+        for i in group:
+            acct = AcctArray[i]
+            if out: out.local.buf = []
+            try:
+                #per-site delay (if any) is applied inside getOFX, while holding the site connection slot
+                with siteLimit[acct[0]]:
+                    status, ofxFile = getOFX(acct, interval, incremental)
+            except Exception as inst:
+                print acct[0], ':', acct[1].split(':')[0], ':', inst
+                if Debug: traceback.print_exc()
+                status, ofxFile = False, ''
+            results[i] = [status, ofxFile]
+            print ""
+            if out: 
+                output[i] = ''.join(out.local.buf)
+                out.local.buf = []
+            if not status and userdat.skipFailedLogon: break
+    
+    def worker():
+        while True:
+            try:
+                group = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            if out: out.local.buf = []
+            try:
+                download(group)
+            finally:
+                if out:
+                    #batch output goes w/ the first account.  accounts skipped after a failed logon have none
+                    output[group[0]] = (output[group[0]] or '') + ''.join(out.local.buf)
+                    out.local.buf = None
+                    for i in group:
+                        if output[i] is None: output[i] = ''
+
+    workers = min(userdat.downloadWorkers, len(groups))
+    if Debug: workers = min(workers, 1)     #debug mode prompts before each request... one at a time
+    
+    if workers <= 1:
+        worker()
+    else:
+        scrubber.pool.start()   #statements are scrubbed in worker processes while the threads wait
+        out = _ThreadOutput(sys.stdout)
+        sys.stdout = out
+        try:
+            threads = [threading.Thread(target=worker) for i in range(workers)]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            printed = 0
+            for t in threads:
+                #join w/ timeout so that Ctrl-C still works on Windows
+                while t.isAlive(): 
+                    t.join(1)
+                    #print the output of the accounts that are done, in account order
+                    while printed < len(output) and output[printed] is not None:
+                        out.stdout.write(output[printed])
+                        printed += 1
+            for text in output[printed:]:
+                if text: out.stdout.write(text)
+        finally:
+            sys.stdout = out.stdout
+        
+    return results
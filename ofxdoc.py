@@ -0,0 +1,352 @@
+# ofxdoc.py
+# http://sites.google.com/site/pocketsense/
+# OFX tokenizer and document model, shared by the statement processing code
+# Intial version: rlc: 18Oct2026
+
+# Works w/ both OFX 1.x (SGML: leaf elements aren't closed) and 2.x (XML) statements.
+# Every token and element keeps its offsets in the original string, so callers can read or rewrite
+# specific elements without rescanning the document.
+#
+#   tokens(ofx)             : event stream of (kind, tag, start, end, vstart, vend) tuples
+#                               kind = START (aggregate start tag), END (end tag) or LEAF (element w/ a value)
+#                               start:end = token span.  vstart:vend = value span of a LEAF (whitespace stripped)
+#   leaves(ofx, tags)       : (tag, value, start, end, vstart, vend) for each leaf element named in tags.
+#                             only looks at those tags, so it's about as fast as a regex search
+#   firstValues(ofx, tags)  : {tag: value} for the first leaf w/ each tag.  stops when they've all been found
+#   splice(ofx, edits)      : apply a list of (start, end, text) edits to ofx
+#   Document(ofx)           : element tree (see Element), w/ find/findall/iter, and edits that are
+#                             applied by render()
+#   OFXEventParser(handler) : incremental (SAX style) parser for statements too large to load.  feed() it
+#                             chunks from a file or socket, and it calls handler.start/leaf/end/text.
+#                             Only the unparsed tail of the last chunk is kept.  parseFile(f, handler)
+#
+# Tag names are returned in upper case.  An SGML element w/ no value and no end tag (e.g., "<MEMO>" followed
+# by the next tag) looks like an aggregate start tag in the token stream.  The Document tree fixes these up
+# when the enclosing aggregate is closed:  the element becomes an empty leaf and anything that was
+# collected under it is moved up to its parent.
+
+import re
+
+START = 'START'
+END   = 'END'
+LEAF  = 'LEAF'
+
+_tagRe = re.compile(r'<(/?)([A-Za-z0-9_.]+)([^<>]*)>')
+
+def _valueSpan(ofx, i, j):
+    #span of ofx[i:j] w/o leading and trailing whitespace.  returns None if it's all whitespace
+    text = ofx[i:j]
+    value = text.strip()
+    if not value: return None
+    vstart = i + text.find(value[0])
+    return vstart, vstart + len(value)
+
+def tokens(ofx):
+    #generate (kind, tag, start, end, vstart, vend) tokens for ofx (see the module notes)
+    pending = None      #start tag that may be a leaf:  [tag, start, end]
+    for m in _tagRe.finditer(ofx):
+        close, tag = m.group(1), m.group(2).upper()
+        if pending:
+            ptag, pstart, pend = pending
+            pending = None
+            j = ofx.find('<', pend, m.start())     #a value ends at the first '<' (skips <?PI?>, comments, etc.)
+            if j < 0: j = m.start()
+            span = _valueSpan(ofx, pend, j)
+            if close and tag == ptag and j == m.start():
+                #XML leaf (or an empty XML element)
+                vstart, vend = span or (pend, pend)
+                yield LEAF, ptag, pstart, m.end(), vstart, vend
+                continue
+            if span:
+                yield LEAF, ptag, pstart, span[1], span[0], span[1]
+            else:
+                yield START, ptag, pstart, pend, pend, pend
+        if close:
+            yield END, tag, m.start(), m.end(), m.end(), m.end()
+        elif m.group(3).endswith('/'):
+            #XML empty element, <TAG/>
+            yield LEAF, tag, m.start(), m.end(), m.end(), m.end()
+        else:
+            pending = [tag, m.start(), m.end()]
+    if pending:
+        ptag, pstart, pend = pending
+        j = ofx.find('<', pend)
+        span = _valueSpan(ofx, pend, j if j >= 0 else len(ofx))
+        if span:
+            yield LEAF, ptag, pstart, span[1], span[0], span[1]
+        else:
+            yield START, ptag, pstart, pend, pend, pend
+
+_leafRes = {}
+
+def _leafRe(tags):
+    key = tuple(tags)
+    p = _leafRes.get(key)
+    if p is None:
+        #start tag for one of the tags, and its value (up to the next tag)
+        p = re.compile(r'<(' + '|'.join(re.escape(t) for t in tags) + r')(?=[\s/>])[^<>]*>([^<]*)', re.IGNORECASE)
+        _leafRes[key] = p
+    return p
+
+def leaves(ofx, tags):
+    #generate (tag, value, start, end, vstart, vend) for each leaf element in ofx w/ one of the listed tags
+    #same results as filtering tokens(ofx) for LEAF tokens, w/o tokenizing the rest of the document
+    for m in _leafRe(tags).finditer(ofx):
+        tag = m.group(1).upper()
+        start, pend = m.start(), m.start(2)
+        if ofx[pend-2] == '/':
+            yield tag, '', start, pend, pend, pend
+            continue
+        span = _valueSpan(ofx, pend, m.end(2))
+        r = _tagRe.match(ofx, m.end(2))
+        if r and r.group(1) and r.group(2).upper() == tag:
+            #XML end tag
+            end = r.end()
+            vstart, vend = span or (pend, pend)
+            yield tag, ofx[vstart:vend], start, end, vstart, vend
+        elif span:
+            yield tag, ofx[span[0]:span[1]], start, span[1], span[0], span[1]
+
+def firstValues(ofx, tags):
+    #returns {tag: value} for the first leaf element w/ each of the tags (tags not found are left out)
+    #each tag is a separate search:  a regex w/ a literal prefix is much faster than one w/ alternatives
+    values = {}
+    for tag in tags:
+        for leaf in leaves(ofx, [tag]):
+            values[leaf[0]] = leaf[1]
+            break
+    return values
+
+def splice(ofx, edits):
+    #apply edits [(start, end, text), ...] to ofx and return the new string.
+    #offsets refer to the original string, and edits can't overlap
+    if not edits: return ofx
+    out = []
+    pos = 0
+    for start, end, text in sorted(edits, key=lambda e: (e[0], e[1])):
+        if start < pos: raise ValueError('Overlapping OFX edits at offset %d' % start)
+        out.append(ofx[pos:start])
+        out.append(text)
+        pos = end
+    out.append(ofx[pos:])
+    return ''.join(out)
+
+class Element(object):
+    #an OFX element.  children = None for a leaf, else a list of sub-elements
+    #start:end = element span in the document (incl. the end tag, if there is one)
+    #vstart:vend = value span for a leaf
+    __slots__ = ('tag', 'start', 'end', 'vstart', 'vend', 'children', 'parent')
+
+    def __init__(self, tag, start, end, vstart, vend, children, parent):
+        self.tag = tag
+        self.start = start
+        self.end = end
+        self.vstart = vstart
+        self.vend = vend
+        self.children = children
+        self.parent = parent
+
+    def isLeaf(self):
+        return self.children is None
+
+    def iter(self, tag=None):
+        #generate the sub-elements (depth first, in document order) w/ the tag, or all of them
+        stack = [iter(self.children or [])]
+        while stack:
+            for e in stack[-1]:
+                if tag is None or e.tag == tag: yield e
+                if e.children: stack.append(iter(e.children))
+                break
+            else:
+                stack.pop()
+
+    def find(self, tag):
+        #first sub-element w/ the tag, or None
+        for e in self.iter(tag.upper()):
+            return e
+        return None
+
+    def findall(self, tag):
+        return list(self.iter(tag.upper()))
+
+    def __repr__(self):
+        return '<Element %s %d:%d>' % (self.tag, self.start, self.end)
+
+class Document:
+    #element tree for an ofx string.  the root is a nameless element w/ the top level elements (normally just
+    #<OFX>).  the header (anything before the first tag) isn't part of the tree
+    def __init__(self, ofx):
+        self.ofx = ofx
+        self.edits = []
+        self.root = root = Element('', 0, len(ofx), 0, 0, [], None)
+        stack = [root]
+        for kind, tag, start, end, vstart, vend in tokens(ofx):
+            parent = stack[-1]
+            if kind == LEAF:
+                parent.children.append(Element(tag, start, end, vstart, vend, None, parent))
+            elif kind == START:
+                e = Element(tag, start, end, end, end, [], parent)
+                parent.children.append(e)
+                stack.append(e)
+            else:
+                for i in range(len(stack)-1, 0, -1):
+                    if stack[i].tag == tag: break
+                else:
+                    continue        #stray end tag
+                while len(stack) > i+1:
+                    self._toLeaf(stack.pop())
+                stack.pop().end = end
+        while len(stack) > 1:
+            self._toLeaf(stack.pop())
+
+    def _toLeaf(self, e):
+        #an unclosed "aggregate" is really an SGML leaf w/o a value.  its children belong to its parent
+        parent = e.parent
+        for c in e.children:
+            c.parent = parent
+        parent.children.extend(e.children)
+        e.children = None
+
+    def iter(self, tag=None):
+        return self.root.iter(tag and tag.upper())
+
+    def find(self, tag):
+        return self.root.find(tag)
+
+    def findall(self, tag):
+        return self.root.findall(tag)
+
+    def text(self, e):
+        #value of a leaf element ('' for an aggregate)
+        return self.ofx[e.vstart:e.vend]
+
+    def findtext(self, tag, default=None):
+        e = self.find(tag)
+        return default if e is None else self.text(e)
+
+    def source(self, e):
+        #original text of an element
+        return self.ofx[e.start:e.end]
+
+    def setText(self, e, value):
+        #replace the value of a leaf element
+        self.edits.append((e.vstart, e.vend, value))
+
+    def replace(self, e, text):
+        #replace an element (incl. any sub-elements)
+        self.edits.append((e.start, e.end, text))
+
+    def remove(self, e):
+        self.replace(e, '')
+
+    def render(self):
+        #the document w/ all edits applied.  the tree still refers to the original string
+        return splice(self.ofx, self.edits)
+
+class OFXHandler:
+    #event handler for OFXEventParser.  override the events you need.
+    #raw = original text for the event.  the raw text of all events, in order, is the complete input
+    def start(self, tag, raw):
+        #aggregate start tag (or an SGML element w/o a value... see end())
+        pass
+
+    def leaf(self, tag, value, raw):
+        #leaf element.  value = whitespace stripped value.  raw includes the start tag, the value text up 
+        #to the next tag, and an XML end tag, if there is one
+        pass
+
+    def end(self, tag, raw):
+        #aggregate end tag.  raw='' for an element that's closed implicitly (an SGML element w/o a value, 
+        #or an aggregate that's missing its end tag) when an enclosing aggregate ends, or at the end of the input
+        pass
+
+    def text(self, raw):
+        #anything else:  whitespace between tags, the header, <?xml ...?> and comments, stray end tags, etc.
+        pass
+
+class OFXEventParser:
+    #incremental parser:  call feed() w/ each chunk of the statement, then close()
+    #same tokens as tokens(), but leaves are reported as soon as the next tag arrives, so only the 
+    #text of the current element is buffered
+    def __init__(self, handler):
+        self.handler = handler
+        self.buf = ''           #unparsed text
+        self.pending = None     #start tag that may be a leaf:  [tag, raw]
+        self.stack = []         #open aggregates
+
+    def feed(self, data):
+        buf = self.buf + data
+        pos = 0
+        handler = self.handler
+        for m in _tagRe.finditer(buf):
+            text = buf[pos:m.start()]
+            junk = ''
+            if '<' in text:
+                #<?xml ...?>, a comment or a stray '<'.  a value ends at the first '<'
+                k = text.index('<')
+                text, junk = text[:k], text[k:]
+            close, tag = m.group(1), m.group(2).upper()
+            if self.pending:
+                ptag, raw = self.pending
+                self.pending = None
+                value = text.strip()
+                if close and tag == ptag and not junk:
+                    #XML leaf (or an empty XML element)
+                    handler.leaf(ptag, value, raw + text + m.group(0))
+                    pos = m.end()
+                    continue
+                if value:
+                    handler.leaf(ptag, value, raw + text)
+                else:
+                    self.stack.append(ptag)
+                    handler.start(ptag, raw)
+                    if text: handler.text(text)
+            elif text:
+                handler.text(text)
+            if junk: handler.text(junk)
+            
+            pos = m.end()
+            if close:
+                self._end(tag, m.group(0))
+            elif m.group(3).endswith('/'):
+                handler.leaf(tag, '', m.group(0))
+            else:
+                self.pending = [tag, m.group(0)]
+        self.buf = buf[pos:]
+
+    def _end(self, tag, raw):
+        if tag not in self.stack:
+            self.handler.text(raw)      #stray end tag
+            return
+        while self.stack[-1] <> tag:
+            self.handler.end(self.stack.pop(), '')
+        self.stack.pop()
+        self.handler.end(tag, raw)
+
+    def close(self):
+        handler = self.handler
+        buf = self.buf
+        if self.pending:
+            ptag, raw = self.pending
+            i = buf.find('<')
+            text = buf if i < 0 else buf[:i]
+            if text.strip():
+                handler.leaf(ptag, text.strip(), raw + text)
+                buf = buf[len(text):]
+            else:
+                self.stack.append(ptag)
+                handler.start(ptag, raw)
+        if buf: handler.text(buf)
+        while self.stack:
+            handler.end(self.stack.pop(), '')
+        self.buf = ''
+        self.pending = None
+
+def parseFile(f, handler, chunkSize=65536):
+    #parse open file (or socket file object) f w/ OFXEventParser, a chunk at a time
+    parser = OFXEventParser(handler)
+    while True:
+        data = f.read(chunkSize)
+        if not data: break
+        parser.feed(data)
+    parser.close()
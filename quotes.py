@@ -72,6 +72,8 @@
 #   -Removed yahooScrape option
 # 24Mar2018*rlc
 #   -Use longName when available for Yahoo quotes.  Mutual fund *family* name is sometimes given as shortName (see vhcox as example)
+# 18Oct2026*rlc
+#   -Use the shared site configuration (site_cfg.getSiteCfg), rather than re-reading sites.dat
 
 import os, sys, time, urllib2, socket, shlex, re, csv, uuid, json
 import site_cfg
@@ -449,7 +451,7 @@ def getQuotes():
     status = True    #overall status flag across all operations (true == no errors getting data)
     
     #get site and other user-defined data
-    userdat = site_cfg.site_cfg()
+    userdat = site_cfg.getSiteCfg()
     stocks = userdat.stocks
     funds = userdat.funds
     eYahoo = userdat.enableYahooFinance
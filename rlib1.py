@@ -14,51 +14,114 @@
 #   - Add support for user-specific clientUID pairs (by url+username)
 # 09Nov2017*rlc
 #   - prefix positive change w/ '+' symbol
+# 18Oct2026*rlc
+#   - Serialize clientUID() lookups/updates, since accounts may now be downloaded concurrently
+#   - QuoteHTMwriter uses the shared site configuration (site_cfg.getSiteCfg)
+#   - clientUID keys are kept in memory (ClientUID keystore).  connect.key is read once, and changes are
+#     written by flush() w/ an atomic file replace, as soon as a key is added or deleted
+#     A damaged connect.key is reported, and the backup (connect.key.bak) or an empty keystore is used
+#   - combineOfx() streams each file once through per-section scanners (_SectionScanner), collecting
+#     sections in spooled temp files.  The combined file is unchanged, but memory use and run time no
+#     longer grow w/ the square of the combined size.
+#   - combineOfx() merges the security lists.  Each security (UNIQUEID+UNIQUEIDTYPE) is written once, 
+#     using the entry w/ the latest DTASOF, and the number of duplicates removed is reported.
+#   - combineOfx() can split its output into several files, limited by size and/or transaction count
+#     (combineMaxBytes, combineMaxTrans options).  Returns a list of files.
+#   - validOFX() scans the statement in chunks (scanOFX), rather than making upper-case copies of the
+#     whole statement.  Accepts a string or an open file.  strip=True ignores CR, LF and spaces.
 
 import os, glob, site_cfg, time, uuid, re, random
-import sys, pyDes, md5, pickle, locale, urllib2
+import sys, pyDes, md5, pickle, locale, urllib2, threading, atexit, tempfile
 from datetime import datetime
 from control2 import *
 
 if Debug:
     import traceback
 
+class ClientUID:
+    #clientUID keystore:  {md5(urlHost+username): clientUID}, saved in dfile
+    #dfile is read on first use.  lookups are served from memory.  a new or deleted key is saved right away
+    #(flush), since the bank may have registered the new clientUID
+    #shared by concurrent download threads
+    def __init__(self, dfile='connect.key'):
+        self.dfile = dfile
+        self.table = None       #loaded on first use
+        self.dirty = False      #unsaved changes?
+        self.lock = threading.RLock()
+    
+    def _load(self):
+        #dfile.bak is left by a save (flush) that was interrupted on Windows.  it's used if dfile is 
+        #missing or damaged
+        if self.table is None:
+            self.table = {}
+            for dfile in [self.dfile, self.dfile + '.bak']:
+                if glob.glob(dfile) == []: continue
+                try:
+                    f = open(dfile,'rb')
+                    try:
+                        self.table = pickle.load(f)
+                    finally:
+                        f.close()
+                    if dfile <> self.dfile: print '** Using', dfile, '(backup copy of', self.dfile + ')'
+                    return
+                except Exception:
+                    print '** Error reading', dfile
+            if glob.glob(self.dfile) + glob.glob(self.dfile + '.bak'): print '** New client UIDs will be assigned'
+    
+    def get(self, url, username, delKey=False):
+        #get clientUID for urlHost+username.  if not exists, create
+        #delete key if delKey=True
+        
+        #get urlHost:  example: url='https://test.ofx.com/my/script'
+        prefix, path = urllib2.splittype(url)
+        #path='//test.ofx.com/my/script';  Host= 'test.ofx.com' ; Selector= '/my/script'
+        urlHost, urlSelector = urllib2.splithost(path)
+        key = md5.md5(urlHost+username).digest()
+        
+        with self.lock:
+            self._load()
+            uuid = self.table.get(key, None)
+            if delKey:
+                #remove existing key
+                if uuid <> None:
+                    del self.table[key]
+                    self.dirty = True
+            elif uuid == None:
+                #add new key
+                uuid = str(ofxUUID())
+                self.table[key] = uuid
+                self.dirty = True
+            self.flush()
+        return uuid
+    
+    def flush(self):
+        #save changes to dfile.  the table is written to a temp file, which then replaces dfile, so
+        #an interrupted write can't leave a damaged connect.key
+        with self.lock:
+            if not self.dirty: return
+            tmpfile = self.dfile + '.tmp'
+            f = open(tmpfile, 'wb')
+            pickle.dump(self.table, f)
+            f.close()
+            try:
+                os.rename(tmpfile, self.dfile)
+            except OSError:
+                #Windows won't rename over an existing file.  the old file is kept as dfile.bak until
+                #the new one is in place
+                bakfile = self.dfile + '.bak'
+                if os.path.exists(bakfile): os.remove(bakfile)
+                os.rename(self.dfile, bakfile)
+                os.rename(tmpfile, self.dfile)
+                os.remove(bakfile)
+            self.dirty = False
+
+clientUIDs = ClientUID()
+atexit.register(clientUIDs.flush)
+
 def clientUID(url, username, delKey=False):
     #get clientUID for urlHost+username.  if not exists, create
     #delete key if delKey=True
-
-    dTable = {}
-    found=False
-    dfile = 'connect.key'
-    uuid = None
-
-    #get urlHost:  example: url='https://test.ofx.com/my/script'
-    prefix, path = urllib2.splittype(url)
-    #path='//test.ofx.com/my/script';  Host= 'test.ofx.com' ; Selector= '/my/script'
-    urlHost, urlSelector = urllib2.splithost(path)
-    key = md5.md5(urlHost+username).digest()
-
-    if glob.glob(dfile) <> []:
-        #lookup
-        f = open(dfile,'rb')
-        dTable = pickle.load(f) 
-        uuid = dTable.get(key, None)
-        f.close()
-        
-    if uuid==None or (delKey and uuid<>None):
-        f = open(dfile,'wb')
-        if delKey:
-            #remove existing key
-            dTable.pop(key, None)
-        else:
-            #add new key
-            uuid=str(ofxUUID())
-            dTable[key] = uuid
-
-        pickle.dump(dTable, f)
-        f.close()
-        
-    return uuid
+    return clientUIDs.get(url, username, delKey)
     
 def get_int(prompt):
     #get number entry
@@ -142,7 +205,7 @@ def QuoteHTMwriter(qList):
     # See quotes.py for qList structure
     global userdat
     
-    userdat = site_cfg.site_cfg()
+    userdat = site_cfg.getSiteCfg()
     
     # CREATE FILE
     filename = xfrdir + "quotes.htm"
@@ -325,21 +388,59 @@ def OfxDate():
 def ofxUUID():
     return str(uuid.uuid4())
 
-def validOFX(content):
+def scanOFX(content, patterns, strip=False, chunkSize=65536):
+    #find the first occurrence of each pattern (upper case) in content, ignoring case
+    #content = string or open file.  it's scanned in chunks, so only a chunk at a time is copied/upper-cased
+    #strip=True: ignore CR, LF and spaces (positions are counted as if they'd been removed)
+    #returns [positions, nonblank]: positions = first position of each pattern (-1 if not found),
+    #   nonblank = True if content has any non-whitespace chars
+    #stops reading once every pattern has been found
+    found = [-1] * len(patterns)
+    nonblank = False
+    overlap = max(len(p) for p in patterns) - 1
+    carry = ''
+    pos = 0             #position of the current chunk in the (stripped) stream
+    i = 0
+    while True:
+        if hasattr(content, 'read'):
+            chunk = content.read(chunkSize)
+        else:
+            chunk = content[i:i+chunkSize]
+            i += chunkSize
+        if not chunk: break
+        if strip: chunk = chunk.translate(None, '\r\n ')
+        if not nonblank and chunk.strip(): nonblank = True
+        
+        #search the chunk, plus the end of the previous one (for patterns that span chunks)
+        text = carry + chunk.upper()
+        base = pos - len(carry)
+        for k in range(len(patterns)):
+            if found[k] < 0:
+                j = text.find(patterns[k])
+                if j >= 0: found[k] = base + j
+        if nonblank and min(found) >= 0: break
+        
+        pos += len(chunk)
+        carry = text[max(0, len(text)-overlap):]
+    
+    return [found, nonblank]
+
+def validOFX(content, strip=False):
     #does content appear to be a valid ofx statement?  returns message indicating reason (null if valid)
+    #content = string or open file.  strip=True to ignore CR, LF and spaces
     msg=''
-    content = content.upper().rstrip()
+    found, nonblank = scanOFX(content, ['OFXHEADER:', '<OFX>', '</OFX>', '<SEVERITY>ERROR', 'ACCESSDENIED'], strip)
     
-    if content == '': msg = 'Null statement received'
+    if not nonblank: msg = 'Null statement received'
     
-    elif content.find('OFXHEADER:') < 0 and content.find('<OFX>') < 0 and content.find('</OFX>') < 0:
+    elif max(found[:3]) < 0:
         msg = 'Invalid OFX statement detected'
         
-    elif content.find('<SEVERITY>ERROR') > 0:
+    elif found[3] > 0:
         msg = 'OFX message contains ERROR condition'
     
-    #note:  spaces get stripped before this function is called
-    elif content.find('ACCESSDENIED') > 0:
+    #note:  usually called w/ strip=True (or w/ spaces already stripped)
+    elif found[4] > 0:
         msg = 'Access denied'
     
     return msg
@@ -373,68 +474,254 @@ def copy_txt_file(infile, outfile):
     out.write(inp.read())
     return
    
-def combineOfx(ofxList):
+class _SectionScanner:
+    #collects the contents of every <tag>...</tag> section in a stream of text (w/o CR/LF), into buf.
+    #same matching rules as re.findall('<tag>(.*?)</tag>', text, re.IGNORECASE):  each section ends at the
+    #first end tag, and an unterminated section at the end of a file is dropped.
+    #units = [offset, length] for each non-empty section in buf
+    def __init__(self, tag, buf):
+        self.start = '<' + tag.upper() + '>'
+        self.end = '</' + tag.upper() + '>'
+        self.buf = buf
+        self.units = []
+        self.present = False    #section will be written to the combined file?
+        self.newFile()
+
+    def newFile(self):
+        self.inside = False     #inside a section?
+        self.carry = ''         #unprocessed tail of the last chunk (may contain part of a tag)
+        self.count = 0          #sections found in the current file
+        self.nonEmpty = False
+
+    def feed(self, data):
+        text = self.carry + data
+        textU = text.upper()
+        pos = 0
+        while True:
+            if not self.inside:
+                i = textU.find(self.start, pos)
+                if i < 0:
+                    #keep enough to match a start tag split across chunks
+                    self.carry = text[max(pos, len(text)-len(self.start)+1):]
+                    return
+                self.inside = True
+                self.unitStart = self.buf.tell()
+                pos = i + len(self.start)
+
+            j = textU.find(self.end, pos)
+            if j < 0:
+                #section continues in the next chunk.  save all but a possible partial end tag
+                keep = max(pos, len(text)-len(self.end)+1)
+                self.buf.write(text[pos:keep])
+                self.carry = text[keep:]
+                return
+            self.buf.write(text[pos:j])
+            self._endUnit()
+            pos = j + len(self.end)
+
+    def _endUnit(self):
+        self.inside = False
+        self.count += 1
+        length = self.buf.tell() - self.unitStart
+        if length:
+            self.units.append([self.unitStart, length])
+            self.nonEmpty = True
+
+    def endFile(self):
+        if self.inside:
+            #unterminated section:  roll it back
+            self.buf.seek(self.unitStart)
+            self.buf.truncate()
+        #an empty section only shows up in the combined file if there's more than one in the same file
+        if self.nonEmpty or self.count > 1: self.present = True
+        self.newFile()
+
+    def readUnits(self):
+        #return each unit (string)
+        for offset, length in self.units:
+            self.buf.seek(offset)
+            yield self.buf.read(length)
+        self.buf.seek(0, 2)
+    
+    def countTag(self, unit, tag):
+        #number of times tag occurs in unit
+        offset, length = unit
+        self.buf.seek(offset)
+        n = 0
+        carry = ''
+        while length > 0:
+            data = self.buf.read(min(length, 65536))
+            length -= len(data)
+            data = carry + data.upper()
+            n += data.count(tag)
+            carry = data[-len(tag)+1:]
+        self.buf.seek(0, 2)
+        return n
+    
+    def write(self, out, units=None):
+        #write each unit (default = all) to out on a separate line (CR terminated)
+        if units is None: units = self.units
+        for offset, length in units:
+            self.buf.seek(offset)
+            while length > 0:
+                data = self.buf.read(min(length, 65536))
+                out.write(data)
+                length -= len(data)
+            out.write('\r')
+        self.buf.seek(0, 2)
+
+#security list entries, and the fields used to merge them
+_secRe     = re.compile(r'<(STOCKINFO|MFINFO|OPTINFO|DEBTINFO|OTHERINFO)>.*?</\1>', re.IGNORECASE)
+_uidRe     = re.compile(r'<UNIQUEID>([^<]*)', re.IGNORECASE)
+_uidTypeRe = re.compile(r'<UNIQUEIDTYPE>([^<]*)', re.IGNORECASE)
+_dtAsOfRe  = re.compile(r'<DTASOF>\s*(\d*)', re.IGNORECASE)
+
+def _secKey(sec):
+    #[UNIQUEID, UNIQUEIDTYPE] for security list entry sec, or None if it doesn't have one
+    r = _uidRe.search(sec)
+    if not r: return None
+    t = _uidTypeRe.search(sec)
+    return (r.group(1).strip().upper(), t.group(1).strip().upper() if t else '')
+
+def _secDate(sec):
+    #DTASOF for security list entry sec, as a sortable YYYYMMDDHHMMSS string ('' if missing)
+    r = _dtAsOfRe.search(sec)
+    return (r.group(1) + '0'*14)[:14] if r and r.group(1) else ''
+
+def _mergeSeclist(scanner):
+    #latest entry for each security in the SECLIST units in scanner:  {key: [date, entry]}
+    #when a security is listed more than once, the entry w/ the latest DTASOF is used (the last one, for a tie)
+    latest = {}
+    for text in scanner.readUnits():
+        for m in _secRe.finditer(text):
+            key = _secKey(m.group(0))
+            if key:
+                dt = _secDate(m.group(0))
+                if key not in latest or dt >= latest[key][0]: latest[key] = [dt, m.group(0)]
+    return latest
+
+def _writeSeclist(scanner, latest, out):
+    #write the SECLIST units in scanner to out, w/ each security only listed once (where it first appears),
+    #using the entries in latest (see _mergeSeclist).  returns the number of duplicate entries removed
+    written = set()
+    removed = 0
+    for text in scanner.readUnits():
+        parts = []
+        pos = 0
+        for m in _secRe.finditer(text):
+            parts.append(text[pos:m.start()])
+            pos = m.end()
+            key = _secKey(m.group(0))
+            if key is None:
+                parts.append(m.group(0))
+            elif key in written:
+                removed += 1
+            else:
+                written.add(key)
+                parts.append(latest[key][1])
+        parts.append(text[pos:])
+        line = ''.join(parts)
+        if line: out.write(line + '\r')
+    return removed
+
+def _shardUnits(scanners, seclistBytes, maxBytes, maxTrans):
+    #split the units of scanners (bank, card, inv) into shards, in order, so that each shard stays under
+    #maxBytes and maxTrans (0 = no limit), if possible.  a unit that's over the limit by itself gets its own shard.
+    #seclistBytes is added to the size of each shard w/ investment statements (the seclist is written there)
+    #returns [shard, ...], where shard = [[units for scanners[0]], [units for scanners[1]], ...]
+    shards = []
+    shard = None
+    for i in range(len(scanners)):
+        scanner = scanners[i]
+        inv = scanner.start == '<INVSTMTMSGSRSV1>'
+        for unit in scanner.units:
+            n = scanner.countTag(unit, '<FITID>') if maxTrans else 0
+            if shard is not None:
+                size = unit[1] + 1 + (seclistBytes if inv and not hasInv else 0)
+                if (maxBytes and shardBytes + size > maxBytes) or (maxTrans and shardTrans + n > maxTrans):
+                    shard = None
+            if shard is None:
+                shard = [[] for x in scanners]
+                shards.append(shard)
+                shardBytes = shardTrans = 0
+                hasInv = False
+            shard[i].append(unit)
+            shardBytes += unit[1] + 1 + (seclistBytes if inv and not hasInv else 0)
+            shardTrans += n
+            hasInv = hasInv or inv
+    
+    if not shards: shards = [[[] for x in scanners]]
+    return shards
+
+def combineOfx(ofxList, maxBytes=0, maxTrans=0):
     #combine ofx statements into a single file in a manner that Money seems to accept
-    
+    #each file is read once, in chunks.  sections are collected in temp buffers (spooled to disk if large)
+    #and copied to the combined file, so memory use doesn't grow w/ statement size
+    #duplicate securities are removed from the security list (see _mergeSeclist)
+    #maxBytes, maxTrans:  split the output into several files, limited by size and/or number of transactions.
+    #   a section from one statement file (w/ one or more account statements) is never split.  files keep the
+    #   bank, credit card, investment order, and the security list is included w/ each investment section
+    #returns a list of combined files, in the order they should be sent to Money
+
     dtnow = time.strftime("%Y%m%d%H%M%S",time.localtime())
-    signon =  "\r".join([
+    signon =  [
               "<SIGNONMSGSRSV1><SONRS>",
               "<STATUS><CODE>0<SEVERITY>INFO<MESSAGE>Successful Sign On</STATUS>",
               "<DTSERVER>" + dtnow,
               "<LANGUAGE>ENG<DTPROFUP>20010101010000",
-              "<FI><ORG>PocketSense</FI></SONRS></SIGNONMSGSRSV1>"])
-    
-    #these regexes capture everything between the tags, but not the tags
-    bRe = re.compile('(?:<BANKMSGSRSV1>)(.*?)(?:</BANKMSGSRSV1>)', re.IGNORECASE)
-    cRe = re.compile('(?:<CREDITCARDMSGSRSV1>)(.*?)(?:</CREDITCARDMSGSRSV1>)', re.IGNORECASE)
-    iRe = re.compile('(?:<INVSTMTMSGSRSV1>)(.*?)(?:</INVSTMTMSGSRSV1>)', re.IGNORECASE)
-    sRe = re.compile('(?:<SECLIST>)(.*?)(?:</SECLIST>)', re.IGNORECASE)
-    
-    bantrn=''
-    crdtrn=''
-    invtrn=''
-    sectrn=''
-
-    for file in ofxList:
-        if glob.glob(file[2]):
-            f=open(file[2])
-            ofx = f.read()
+              "<FI><ORG>PocketSense</FI></SONRS></SIGNONMSGSRSV1>"]
+
+    #bank, credit card, investment and security list sections
+    scanners = [_SectionScanner(tag, tempfile.SpooledTemporaryFile(max_size=1024*1024))
+                for tag in ['BANKMSGSRSV1', 'CREDITCARDMSGSRSV1', 'INVSTMTMSGSRSV1', 'SECLIST']]
+
+    try:
+        for file in ofxList:
+            if glob.glob(file[2]):
+                f=open(file[2])
+                while True:
+                    data = f.read(65536)
+                    if not data: break
+                    data = data.replace(chr(13),'').replace(chr(10),'')    #remove CRs and LFs
+                    for scanner in scanners: scanner.feed(data)
+                f.close()
+                for scanner in scanners: scanner.endFile()
+
+        stmts = scanners[:3]
+        seclist = scanners[3]
+        latest = _mergeSeclist(seclist)
+        seclistBytes = sum(unit[1]+1 for unit in seclist.units)
+        shards = _shardUnits(stmts, seclistBytes, maxBytes, maxTrans)
+        invShards = [shard for shard in shards if shard[2]]
+        
+        #there should never be two combined*.ofx files here, but we'll use a unique name just in case
+        cname = xfrdir + 'combined' + str(random.randrange(1e5,1e6))
+        cfiles = []
+        removed = 0
+        for k in range(len(shards)):
+            shard = shards[k]
+            cfile = cname + ('-%d' % (k+1) if len(shards) > 1 else '') + '.ofx'
+            f=open(cfile,'w')
+            f.write(OfxSGMLHeader())
+            f.write('<OFX>\r' + '\r'.join(signon) + '\r')
+            for i in range(len(stmts)):
+                #sections w/o any units (empty <TAG></TAG> pairs) are written to the first file
+                if shard[i] or (k == 0 and stmts[i].present and not stmts[i].units):
+                    f.write(stmts[i].start + '\r')
+                    stmts[i].write(f, shard[i])
+                    f.write(stmts[i].end + '\r')
+            #security list goes w/ the investment statements, or the last file if there aren't any
+            if seclist.present and (shard[2] or (not invShards and k == len(shards)-1)):
+                f.write('<SECLISTMSGSRSV1>\r<SECLIST>\r')
+                removed = _writeSeclist(seclist, latest, f)
+                f.write('</SECLIST>\r</SECLISTMSGSRSV1>\r')
+            f.write('</OFX>\r')
             f.close()
-            
-            ofx = ofx.replace(chr(13),'')   #remove CRs
-            ofx = ofx.replace(chr(10),'')   #remove LFs
-            
-            #create a string for each section found in the file
-            #re.findall() returns a list of all matching sections
-            b = '\r'.join(bRe.findall(ofx))
-            c = '\r'.join(cRe.findall(ofx))
-            i = '\r'.join(iRe.findall(ofx))
-            s = '\r'.join(sRe.findall(ofx))
-            
-            #add statements to each section
-            if b: bantrn = bantrn + '\r' + b
-            if c: crdtrn = crdtrn + '\r' + c
-            if i: invtrn = invtrn + '\r' + i
-            if s: sectrn = sectrn + '\r' + s
-
-    if bantrn: bantrn = OfxTag('BANKMSGSRSV1', bantrn)
-    if crdtrn: crdtrn = OfxTag('CREDITCARDMSGSRSV1', crdtrn)
-    if invtrn: invtrn = OfxTag('INVSTMTMSGSRSV1', invtrn)
-    if sectrn: sectrn = OfxTag('SECLISTMSGSRSV1', OfxTag('SECLIST', sectrn))
-    
-    combOfx = '\r'.join(['<OFX>', signon, bantrn, crdtrn, invtrn, sectrn, '</OFX>'])
-    
-    #remove blank lines (not required... just to clean it up)
-    combOfx2=''
-    for line in combOfx.splitlines():
-        if line: combOfx2 = combOfx2 + line + '\r'
-    
-    combOfx = OfxSGMLHeader() + combOfx2
-    
-    #there should never be two combined*.ofx files here, but we'll use a unique name just in case
-    cfile = xfrdir + 'combined' + str(random.randrange(1e5,1e6)) + '.ofx'
-    f=open(cfile,'w')
-    f.write(combOfx)
-    f.close()
-    print "Combined OFX created: " + cfile
-    return cfile
\ No newline at end of file
+            cfiles.append(cfile)
+    finally:
+        for scanner in scanners: scanner.buf.close()
+    
+    for cfile in cfiles:
+        print "Combined OFX created: " + cfile
+    if removed: print "Combined OFX: removed %d duplicate securities from the security list" % removed
+    return cfiles
\ No newline at end of file
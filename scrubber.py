@@ -55,59 +55,590 @@
 #27-Jul-2018*dbc
 #   - Add TRowePrice scrub function to fix paid-out dividends/cap gains that are marked as reinvested
 
-import os, sys, re
-import site_cfg
+#18-Oct-2026*rlc
+#   - Added scrubOFX() to scrub a statement in memory.  scrub() is now a file wrapper for it.
+#   - Use the shared site configuration (site_cfg.getSiteCfg)
+#   - Site-specific scrubs are looked up by server host/domain (_siteRuleTable), rather than url substrings
+#   - Added scrubStream() to scrub large statements in pieces (parsed w/ ofxdoc.OFXEventParser), so the whole
+#     file isn't loaded.  scrub() uses it for files larger than STREAM_SIZE.  scrubOFX() and scrubStream()
+#     share the same list of scrub rules.
+#   - Bug fix in _scrubShiftTime() when a statement has no DTASOF values
+#   - Scrub rule engine:  each scrub fix is defined as a set of ScrubRules (per tag or per transaction
+#     aggregate), and all of them are applied in one pass over the statement (_applyRules).  The _scrubXXX()
+#     step routines were removed
+#   - Site scrub table (_siteRuleTable) returns the site's scrub rules
+#   - Bug fix in T. Rowe Price scrub:  reinvestments w/ non-zero units were removed when a statement
+#     has no line breaks
+#   - Discover FITIDs are tracked per statement (_DiscoverFITIDs), w/ a set and the next serial# to try for
+#     each base fitid, rather than a module-level list that was searched from serial# 0 for every transaction.
+#     Same FITID values
+#   - Investment buy/sell/reinvest sign fixes work on each <INVBUY>, <INVSELL> and <REINVEST> aggregate
+#     (_fixSigns), and never look past its end tag.  The regexes used before could backtrack across the
+#     rest of a single-line statement for each transaction.  Multi-line transactions are left alone, as before
+#   - DTASOF time shift parses 14 digit values w/o strptime (_parseTime) and saves the shifted values for
+#     the statement (_TimeShift).  Fractional seconds are dropped and the timezone is kept, as before
+#   - Null time rule skips the common case (a 14 digit value w/ a time) w/o splitting the value
+#   - Added ScrubPool (scrubber.pool):  statements are scrubbed in worker processes (scrubWorkers option),
+#     and the scrubber messages for each statement are returned w/ it, to be printed in submission order
+#   - Added ScrubCache (scrub.dat):  content hashes of scrubbed files, so scrub() and the scrub pool skip a 
+#     file that's already been scrubbed, under any name.  Entries include RULESET_VERSION
+
+import os, sys, re, threading, multiprocessing, glob, time, md5, pickle
+import site_cfg, ofxdoc
 from datetime import datetime, timedelta
 from control2 import *
 from rlib1 import *
 
-userdat = site_cfg.site_cfg()
-stat = False    #global used between re lambda subs to track status
+userdat = site_cfg.getSiteCfg()
+
+#files larger than this are scrubbed in pieces (scrubStream), so memory use is bounded by the largest
+#transaction rather than the statement size.  smaller files are read and scrubbed in memory (scrubOFX)
+STREAM_SIZE = 4*1024*1024
+
+RULESET_VERSION = 3     #increment when a change to the scrub rules changes the output (see ScrubCache)
+
+_local = threading.local()      #per-thread message collectors for scrubStream() and the scrub pool
+
+#transaction, position and security aggregates.  scrubStream() only splits a statement between these,
+#so each scrub rule always sees complete transactions
+_unitTags = set(['STMTTRN', 'INVBANKTRAN', 'BUYDEBT', 'BUYMF', 'BUYOPT', 'BUYOTHER', 'BUYSTOCK', 'CLOSUREOPT',
+                 'INCOME', 'INVEXPENSE', 'JRNLFUND', 'JRNLSEC', 'MARGININTEREST', 'REINVEST', 'RETOFCAP',
+                 'SELLDEBT', 'SELLMF', 'SELLOPT', 'SELLOTHER', 'SELLSTOCK', 'SPLIT', 'TRANSFER',
+                 'POSDEBT', 'POSMF', 'POSOPT', 'POSOTHER', 'POSSTOCK',
+                 'DEBTINFO', 'MFINFO', 'OPTINFO', 'OTHERINFO', 'STOCKINFO'])
 
 def scrubPrint(line):
     if not userdat.quietScrub:
+        msgs = getattr(_local, 'msgs', None)
+        if msgs is None:
+            _output(line)
+        elif line not in msgs:
+            msgs[line] = (_local.step, len(msgs))     #scrubStream() prints these in scrub order
+
+def _output(line):
+    #print a scrubber message, or save it for the caller if the statement is being scrubbed for the pool
+    out = getattr(_local, 'out', None)
+    if out is None:
+        print "  +" + line
+    else:
+        out.append(line)
+
+def printMsgs(msgs):
+    #print the scrubber messages returned by the scrub pool for one statement
+    for line in msgs:
         print "  +" + line
     
 def scrub(filename, site):
     #filename = string
     #site = DICT structure containing full site info from sites.dat
- 
-    siteURL = FieldVal(site, 'url').upper()
-    dtHrs = FieldVal(site, 'timeOffset')
-    accType = FieldVal(site, 'CAPS')[1]
-    f = open(filename,'r')
-    ofx = f.read()  #as-found ofx message
-    #print ofx
+    #the file isn't touched if it's already been scrubbed (scrubCache)
+    raw = _fileHash(filename)
+    if scrubCache.skip(raw, site): return
+    scrubCache.add(raw, site, _scrubFile(filename, site))
+    scrubCache.save()
+
+def _scrubFile(filename, site):
+    #the file is scrubbed to a temp file, which then replaces the original.  files larger than STREAM_SIZE
+    #are scrubbed in chunks (scrubStream)
+    #returns the md5 hash of the scrubbed file
+    tmpname = filename + '.tmp'
+    with open(filename, 'rb') as f:
+        with open(tmpname, 'wb') as out:
+            out = _HashWriter(out)
+            if os.path.getsize(filename) > STREAM_SIZE:
+                scrubStream(f, out, site)
+            else:
+                out.write(scrubOFX(f.read(), site))
+    
+    #write the new version to the same file
+    try:
+        os.rename(tmpname, filename)
+    except OSError:
+        os.remove(filename)     #rename won't replace a file on Windows
+        os.rename(tmpname, filename)
+    return out.md5.digest()
+
+class _HashWriter:
+    #file wrapper that keeps an md5 hash of everything written
+    def __init__(self, f):
+        self.f = f
+        self.md5 = md5.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        self.f.write(data)
+
+def _fileHash(filename):
+    #md5 hash of the file contents (read in chunks)
+    h = md5.md5()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(1024*1024)
+            if not chunk: break
+            h.update(chunk)
+    return h.digest()
+
+class ScrubCache:
+    #content hashes of the statements scrubbed by scrub() and the scrub pool, saved in datfile, so that a
+    #file is never scrubbed twice, whatever its name (replaces the NEWFILEUID:PSIMPORT marker)
+    #entries = {md5(statement + scrub settings): [md5(scrubbed statement), time last used]}
+    #   scrub settings = RULESET_VERSION, the site entry and the options used by the scrub rules, so an
+    #   entry can only match a statement that would be scrubbed the same way
+    #a file that matches the scrubbed output of any entry has already been scrubbed, and is skipped.
+    #entries not used for maxAge days are dropped, and the oldest are dropped past maxEntries
     
-    #NOTE:  Discover Card and Bank use the same server @ discovercard.com
-    if 'DISCOVERCARD' in siteURL: ofx= _scrubDiscover(ofx, accType)
+    def __init__(self, datfile='scrub.dat', maxAge=180, maxEntries=5000):
+        self.datfile = datfile
+        self.maxAge = maxAge
+        self.maxEntries = maxEntries
+        self.entries = None     #loaded on first use
+        self.outputs = None     #md5(scrubbed statement): entry key
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _key(self, raw, site):
+        settings = [RULESET_VERSION, sorted(site.items()), userdat.skipZeroTransactions]
+        return md5.md5(raw + repr(settings)).digest()
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            if glob.glob(self.datfile) <> []:
+                f = open(self.datfile, 'rb')
+                try:
+                    self.entries = pickle.load(f)
+                except:
+                    pass    #start over
+                f.close()
+            self.outputs = dict((out, key) for key, [out, used] in self.entries.items())
+
+    def skip(self, raw, site):
+        #True if the statement w/ hash raw doesn't need to be scrubbed:  it's the output of an earlier
+        #scrub, or scrubbing it w/ the same settings didn't change it
+        with self.lock:
+            self._load()
+            key = self.outputs.get(raw)
+            if key is None:
+                key = self._key(raw, site)
+                if self.entries.get(key, [None])[0] <> raw: return False
+            self.entries[key][1] = time.time()
+            self.dirty = True
+            return True
+
+    def add(self, raw, site, out):
+        #the statement w/ hash raw was scrubbed for site.  out = hash of the scrubbed statement
+        with self.lock:
+            self._load()
+            key = self._key(raw, site)
+            if key in self.entries: self.outputs.pop(self.entries[key][0], None)
+            self.entries[key] = [out, time.time()]
+            self.outputs[out] = key
+            self.dirty = True
+
+    def save(self):
+        #drop old entries, and save changes to datfile (written to a temp file, which then replaces it)
+        with self.lock:
+            if not self.dirty: return
+            oldest = time.time() - self.maxAge*86400
+            keep = sorted([used, key] for key, [out, used] in self.entries.items() if used >= oldest)
+            self.entries = dict((key, self.entries[key]) for used, key in keep[-self.maxEntries:])
+            self.outputs = dict((out, key) for key, [out, used] in self.entries.items())
+            
+            tmpfile = self.datfile + '.tmp'
+            f = open(tmpfile, 'wb')
+            pickle.dump(self.entries, f)
+            f.close()
+            try:
+                os.rename(tmpfile, self.datfile)
+            except OSError:
+                #Windows won't rename over an existing file
+                os.remove(self.datfile)
+                os.rename(tmpfile, self.datfile)
+            self.dirty = False
+
+scrubCache = ScrubCache()
+
+def scrubOFX(ofx, site):
+    #ofx = statement (string).  returns the scrubbed statement
+    #site = DICT structure containing full site info from sites.dat
+    return _scrub(ofx, _scrubRules(site, _scrubFlags(ofx)))
+
+def scrubStream(f, out, site, leafFilter=None, chunkSize=1024*1024):
+    #scrub the statement in open file f, and write it to out.  for statements too large to load at once
+    #the statement is parsed w/ ofxdoc.OFXEventParser, and scrubbed in pieces of about chunkSize bytes that
+    #are split between transactions (_unitTags), so memory use is bounded by the chunk size and the 
+    #largest transaction.  f must be seekable (the statement is read twice).
+    #leafFilter(tag, value, raw) is called for each leaf element before it's scrubbed, and returns its raw
+    #text (possibly modified)
+    #output is the same as scrubOFX(), and messages are printed once, in the same order
+    flags = _scrubFlags(f)
+    f.seek(0)
+    handler = _StreamScrub(out, _scrubRules(site, flags), leafFilter, chunkSize)
+    _local.msgs = {}
+    try:
+        ofxdoc.parseFile(f, handler)
+        handler.flush()
+        msgs = _local.msgs
+    finally:
+        _local.msgs = None
+    for line in sorted(msgs, key=msgs.get):
+        _output(line)
+
+class _StreamScrub(ofxdoc.OFXHandler):
+    #collects events into pieces for scrubStream, and scrubs/writes each piece
+    def __init__(self, out, rules, leafFilter, chunkSize):
+        self.out = out
+        self.rules = rules
+        self.leafFilter = leafFilter
+        self.chunkSize = chunkSize
+        self.buf = []
+        self.size = 0
+        self.unit = None        #current transaction (etc.) aggregate
+
+    def _add(self, raw):
+        self.buf.append(raw)
+        self.size += len(raw)
+
+    def _cut(self):
+        #ok to split here (not inside a transaction)
+        if self.unit is None and self.size >= self.chunkSize: self.flush()
+
+    def start(self, tag, raw):
+        self._cut()
+        if self.unit is None and tag in _unitTags: self.unit = tag
+        self._add(raw)
+
+    def end(self, tag, raw):
+        self._add(raw)
+        if tag == self.unit: self.unit = None
+        self._cut()
+
+    def leaf(self, tag, value, raw):
+        if self.leafFilter: raw = self.leafFilter(tag, value, raw)
+        self._add(raw)
+        self._cut()
+
+    def text(self, raw):
+        self._add(raw)
+
+    def flush(self):
+        self.out.write(_scrub(''.join(self.buf), self.rules))
+        self.buf = []
+        self.size = 0
+
+class ScrubPool:
+    #worker processes for scrubbing statements.  scrubbing is cpu-bound, so statements are scrubbed
+    #on separate cores (scrubWorkers option in sites.dat), rather than one at a time in this process.
+    #scrubber messages are collected in the worker for each statement, and returned w/ the result so
+    #they can be printed together, in the order the statements were submitted.
+    #the processes are started on first use (or by start()).  w/ 1 worker, everything runs in this process
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def workers(self):
+        n = userdat.scrubWorkers
+        if n == 0:
+            try:
+                n = multiprocessing.cpu_count()
+            except NotImplementedError:
+                n = 1
+        return n
+
+    def start(self):
+        #start the worker processes, if there's more than one.  call from the main thread, before starting 
+        #other threads that use the pool (ofx.getOFXList)
+        with self.lock:
+            if self.pool is None and self.workers() > 1:
+                self.pool = multiprocessing.Pool(self.workers())
+        return self.pool
+
+    def scrubFiles(self, jobs):
+        #jobs = [[filename, site], ...].  scrub each file in place, like scrub().  files that have already
+        #been scrubbed are skipped (scrubCache)
+        #generator:  yields [filename, msgs, error] for each job, in jobs order, as soon as it's done
+        #   msgs = scrubber messages, error = '' or the reason the file couldn't be scrubbed
+        hashes = [_fileHash(filename) for filename, site in jobs]
+        skipped = [scrubCache.skip(raw, job[1]) for job, raw in zip(jobs, hashes)]
+        todo = [job for job, skip in zip(jobs, skipped) if not skip]
+        pool = self.start() if len(todo) > 1 else None
+        if pool:
+            results = pool.imap(_scrubFileJob, todo)
+        else:
+            results = (_scrubFileJob(job) for job in todo)
+        
+        try:
+            for job, raw, skip in zip(jobs, hashes, skipped):
+                if skip:
+                    yield [job[0], [], '']      #already scrubbed
+                    continue
+                msgs, error, out = results.next()
+                if not error: scrubCache.add(raw, job[1], out)
+                yield [job[0], msgs, error]
+        finally:
+            scrubCache.save()
+
+    def scrubOFX(self, ofx, site):
+        #scrubOFX() in a worker process, if the pool has been started.  returns [ofx, msgs]
+        #used by the download threads (ofx.getOFXList), which wait here while the statement is scrubbed
+        if self.pool:
+            return self.pool.apply(_scrubOFXJob, (ofx, site))
+        return _scrubOFXJob(ofx, site)
+
+    def close(self):
+        with self.lock:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+            self.pool = None
+
+pool = ScrubPool()          #session scrub pool, shared by Getdata and ofx.getOFXList
+
+#scrub pool jobs.  scrubber messages are saved in _local.out (see _output) and returned w/ the result
+
+def _scrubFileJob(job):
+    #job = [filename, site].  returns [msgs, error, md5 hash of the scrubbed file]
+    filename, site = job
+    _local.out = []
+    try:
+        try:
+            out = _scrubFile(filename, site)
+            return [_local.out, '', out]
+        except Exception as inst:
+            if os.path.exists(filename + '.tmp'): os.remove(filename + '.tmp')
+            return [_local.out, str(inst) or repr(inst), None]
+    finally:
+        _local.out = None
+
+def _scrubOFXJob(ofx, site):
+    #returns [scrubOFX(ofx, site), msgs]
+    _local.out = []
+    try:
+        return [scrubOFX(ofx, site), _local.out]
+    finally:
+        _local.out = None
+
+def _scrubFlags(ofx):
+    #statement-wide conditions for the scrub rules:  [DTSTART w/o a DTEND, investment statement]
+    #ofx = string or open file (read in chunks)
+    dtstart = dtend = inv = False
+    carry = ''
+    i = 0
+    while True:
+        if hasattr(ofx, 'read'):
+            chunk = ofx.read(65536)
+        else:
+            chunk = ofx[i:i+65536]
+            i += 65536
+        if not chunk: break
+        text = carry + chunk
+        dtstart = dtstart or '<DTSTART>' in text
+        dtend = dtend or '<DTEND>' in text
+        inv = inv or '<INVSTMTTRNRS>' in text.upper()
+        carry = text[-13:]
+    return [dtstart and not dtend, inv]
+
+def _scrubRules(site, flags):
+    #the scrub rules for a statement, in order (see the rule engine below)
+    #flags = statement-wide conditions (see _scrubFlags), so that the rules can be applied to a whole
+    #   statement, or to pieces of one
+    missingDTEND, invStmt = flags
+    dtHrs = FieldVal(site, 'timeOffset')
+    rules = []
     
-    if 'TROWEPRICE.COM' in siteURL: ofx = _scrubTRowePrice(ofx)
+    #site-specific fixes (Discover, T. Rowe Price, ...)
+    siteRules = _siteRules(site)
+    if siteRules: rules += siteRules(site)
     
-    ofx= _scrubTime(ofx)     #fix 000000 and NULL datetime stamps 
+    rules += _timeRules()       #fix 000000 and NULL datetime stamps 
 
-    if dtHrs <> 0: ofx = _scrubShiftTime(ofx, dtHrs)   #note: always call *after* _scrubTime()
+    if dtHrs <> 0:      #note: always *after* the null time fix
+        rules += _shiftTimeRules(dtHrs)
     
-    ofx= _scrubDTSTART(ofx)  #fix missing <DTEND> fields
+    #fix missing <DTEND> fields
+    if missingDTEND: rules += _dtstartRules()
       
     #fix malformed investment buy/sell/reinvest signs (neg vs pos), if they exist
-    if "<INVSTMTTRNRS>" in ofx.upper(): 
-        ofx= _scrubINVsign(ofx)  
-        ofx= _scrubREINVESTsign(ofx)  
+    if invStmt: rules += _invSignRules() + _reinvestSignRules()
 	
     #remove $0.00 transactions
-    if userdat.skipZeroTransactions: ofx = _scrubRemoveZeroTrans(ofx)
+    if userdat.skipZeroTransactions: rules += _removeZeroRules()
     
     #perform general ofx cleanup
-    ofx = _scrubGeneral(ofx)
-  
-    #close the input file
-    f.close()
+    for tag in _unsupportedTags:
+        rules += _unsupportedRules(tag)
+    rules += _ampersandRules()
     
-    #write the new version to the same file
-    f = open(filename, 'w')
-    f.write(ofx)
-    f.close    
+    for i in range(len(rules)): rules[i].step = i
+    return rules
+
+#-----------------------------------------------------------------------------
+# scrub rule engine
+#   Each fix is defined as a set of rules, which are applied together in a single pass over the statement
+#   (_applyRules).  A rule applies to the elements w/ one of its tags:
+#       START     = fn(raw) for the start tag.  returns the new tag text
+#       LEAF      = fn(raw, text) for the value (the text following the start tag, up to the next tag).
+#                   returns the new value text
+#       AGGREGATE = fn(text) for each complete aggregate (from its start tag to its end tag), after the rules
+#                   for the elements inside it.  returns the new text
+#       LATE      = fn(text) for the start tag + value text, or for the complete text of the enclosing
+#                   AGGREGATE (after the AGGREGATE rules).  returns the new text
+#       TEXT      = fn(text) for the scrubbed statement.  returns the new text
+#       NOTE      = no fn.  the message is always printed
+#   A rule "fires" when fn returns something other than None, and its message (if any) is printed once.
+#   START, LEAF and LATE rules only apply to an exact start tag (e.g. <FITID>, not <FITID x=1>), unless the 
+#   tag ends w/ '*' (a prefix:  'DT*' = all tags starting w/ DT).  A tag w/o its closing '>' is left alone.
+#   Aggregates don't nest:  one that's still open at the next aggregate start tag (or the end of the
+#   statement) ends there, and a stray end tag is ignored
+
+START, LEAF, AGGREGATE, LATE, TEXT, NOTE = range(6)
+
+class ScrubRule:
+    def __init__(self, kind, tags=[], fn=None, message=None):
+        self.kind = kind
+        self.tags = tags
+        self.fn = fn
+        self.message = message
+        self.exact = not [tag for tag in tags if tag.endswith('*')]
+        self.step = 0           #order of the rule's message.  set by _scrubRules()
+
+    def applies(self, tag):
+        #rule applies to elements w/ tag?
+        for t in self.tags:
+            if t == tag or t.endswith('*') and tag.startswith(t[:-1]): return True
+        return False
+
+def _scrub(ofx, rules):
+    #scrub ofx w/ rules.  returns the scrubbed statement
+    ofx, msgs = _applyRules(ofx, rules)
+    for step, msg in msgs:
+        _local.step = step
+        scrubPrint(msg)
+    return ofx
+
+def _ciPattern(s):
+    #case-insensitive regex pattern for string s (faster to search than re.IGNORECASE)
+    return ''.join(['[%s%s]' % (c.upper(), c.lower()) if c.isalpha() else re.escape(c) for c in s])
+
+def _applyRules(ofx, rules):
+    #apply rules to ofx in one pass.  returns [new ofx, messages], where messages = [step, message] list
+    aggRules = {}           #AGGREGATE rules by tag
+    textRules = []
+    tags = []
+    for rule in rules:
+        if rule.kind == AGGREGATE:
+            for tag in rule.tags: aggRules.setdefault(tag, []).append(rule)
+        elif rule.kind == TEXT:
+            textRules.append(rule)
+        for tag in rule.tags:
+            tag = tag.rstrip('*')
+            if tag not in tags: tags.append(tag)
+    
+    #all tags the rules apply to, in a single regex.  groups:
+    #   1 = '/' for an end tag, 2+3 = tag, 4 = attributes, 5 = '>' (missing for an incomplete tag), 6 = value
+    p = re.compile(r'<(/?)(' + '|'.join([_ciPattern(tag) for tag in tags]) + r')([A-Za-z0-9_.]*)([^<>]*)(>?)([^<]*)')
+    
+    elementRules = {}       #tag: [START/LEAF/LATE rules, AGGREGATE rules], built as the tags are found
+    fired = set()
+    out = []                #pieces of the new statement (only where it changed)
+    pos = 0                 #end of the last piece in ofx
+    agg = None              #open aggregate: [tag, index of its first piece in out, LATE rules inside it]
+    
+    def closeAgg(agg, pos, end):
+        #the open aggregate agg ends at end.  applies its AGGREGATE rules, then the LATE rules deferred 
+        #inside it, to the complete aggregate text.  returns the new end of the last piece in ofx
+        text = ''.join(out[agg[1]:]) + ofx[pos:end]
+        changed = len(out) > agg[1]
+        del out[agg[1]:]
+        late = sorted(agg[2], key=rules.index) if agg[2] else []
+        for rule in aggRules[agg[0]] + late:
+            new = rule.fn(text)
+            if new is not None:
+                text = new
+                changed = True
+                fired.add(rule)
+        if not changed: return pos
+        out.append(text)
+        return end
+    
+    for m in p.finditer(ofx) if tags else []:
+        close, name, rest, attrs, gt, text = m.groups()
+        if not gt: continue     #not a tag, or one that spans lines
+        tag = (name + rest).upper()
+        trs = elementRules.get(tag)
+        if trs is None:
+            trs = elementRules[tag] = [[r for r in rules if r.kind in (START, LEAF, LATE) and r.applies(tag)],
+                                       aggRules.get(tag)]
+        rs, aggs = trs
+        if not rs and not aggs: continue
+        start, end = m.span()
+        raw = ofx[start:end-len(text)]
+        exact = not attrs
+        
+        if aggs:
+            if not exact: continue
+            if close:
+                if agg is not None and tag == agg[0]:
+                    pos = closeAgg(agg, pos, end-len(text))
+                    agg = None
+                continue        #otherwise, a stray end tag
+            if agg is not None: pos = closeAgg(agg, pos, start)     #no end tag
+            out.append(ofx[pos:start])
+            pos = start
+            agg = [tag, len(out), []]
+            for rule in rs:
+                if rule.kind == START:
+                    new = rule.fn(raw)
+                    if new is not None:
+                        out.append(new)
+                        pos = start + len(raw)
+                        fired.add(rule)
+            continue
+        
+        if close: continue
+        changed = False
+        for rule in rs:
+            if rule.exact and not exact: continue
+            if rule.kind == LATE:
+                if agg is not None:
+                    if rule not in agg[2]: agg[2].append(rule)
+                    continue
+                new = rule.fn(raw + text)
+                if new is not None:
+                    raw, text = new, ''
+                    changed = True
+                    fired.add(rule)
+                break
+            if rule.kind == START:
+                new = rule.fn(raw)
+                if new is not None:
+                    raw = new
+                    changed = True
+                    fired.add(rule)
+            else:
+                new = rule.fn(raw, text)
+                if new is not None:
+                    text = new
+                    changed = True
+                    fired.add(rule)
+        if changed:
+            out.append(ofx[pos:start])
+            out.append(raw + text)
+            pos = end
+    
+    if agg is not None: pos = closeAgg(agg, pos, len(ofx))      #no end tag
+    out.append(ofx[pos:])
+    ofx = ''.join(out)
+    for rule in textRules:
+        new = rule.fn(ofx)
+        if new is not None:
+            ofx = new
+            fired.add(rule)
+    
+    msgs = []
+    for rule in rules:
+        if rule.message and (rule.kind == NOTE or rule in fired): msgs.append([rule.step, rule.message])
+    return [ofx, msgs]
 
 #-----------------------------------------------------------------------------
 # OFX.DISCOVERCARD.COM
@@ -139,160 +670,126 @@ def scrub(filename, site):
 # NOTE:  There was brief period in late 2017 where Discover Bank changed their fitid format, but soon
 #        reverted to the same as described above.
 
-_sD_knownvals = []  #global to keep track of Discover FITID values between regex.sub() calls
+_discoverCheckRe = re.compile(r'(<TRNTYPE>DEBIT)([^\s]+)(<NAME>Check[ ]+)([0-9]+)',re.IGNORECASE)
+
+class _DiscoverFITIDs:
+    #unique fitid values for a Discover statement
+    #each fitid gets the first serial# (0 to 9998) that makes it unique.  next[base] skips the serial#s already
+    #tried for a base fitid, so it isn't searched from 0 each time.  these never become free again, and the
+    #set still catches a value that another base also produced (e.g., 12+34 = 123+4)
+    def __init__(self, accType):
+        self.accType = accType
+        self.known = set()      #fitids assigned
+        self.next = {}          #base fitid: first serial# that may be free
+
+    def unique(self, fitid):
+        #return the new fitid value
+        fitid_b = fitid                     #base fitid before annotating
+    
+        #strip the serial value for credit card transactions
+        if self.accType=='CCSTMT': 
+            bx = len(fitid) - 5
+            fitid_b = fitid[:bx]
+    
+        #find a unique serial#, from 0 to 9999 (9998 is reused when they're all taken)
+        seq = self.next.get(fitid_b, 0)
+        while seq < 9999 and fitid_b + str(seq) in self.known:
+            seq = seq+1
+        fitid = fitid_b + str(min(seq, 9998))
+        
+        self.known.add(fitid)
+        self.next[fitid_b] = min(seq+1, 9999)
+        return fitid
 
-def _scrubDiscover(ofx, accType):
+def _scrubDiscover_r2(r, accType):
+    #regex subsitution function: insert checknum field for BANK statements
+    trntype = r.group(1)
+    rest = r.group(2)
+    name = r.group(3).strip(' ')
+    checknum = r.group(4)
+    return '<TRNTYPE>CHECK' + rest + '<CHECKNUM>' + checknum + name
 
+def _discoverRules(site):
+    accType = FieldVal(site, 'CAPS')[1]
+    fitids = _DiscoverFITIDs(accType)     #for one statement
     if accType=='CCSTMT': 
-        scrubPrint("Scrubber: Processing Discover Card statement.")
+        rules = [ScrubRule(NOTE, message="Scrubber: Processing Discover Card statement.")]
     else:
-        scrubPrint("Scrubber: Processing Discover Bank statement.")
-
-    ofx_final = ''      #new ofx message
-    _sD_knownvals = []  #reset our global set of known vals (just in case)
+        rules = [ScrubRule(NOTE, message="Scrubber: Processing Discover Bank statement.")]
 
     # dev: insert a line break after each transaction for readability.
-    # also helps block multi-transaction matching in below regexes via ^\s option
-    p = re.compile(r'(<STMTTRN>)',re.IGNORECASE)
-    ofx = p.sub(r'\n<STMTTRN>', ofx)
+    rules.append(ScrubRule(START, ['STMTTRN'], lambda raw: '\n<STMTTRN>'))
+    
+    #replace the fitid value (up to the next <tag> or white space)
+    def fitid(raw, text):
+        if not text or text[0].isspace(): return None
+        value = text.split(None, 1)[0]
+        return fitids.unique(value) + text[len(value):]
+    rules.append(ScrubRule(LEAF, ['FITID'], fitid))
     
-    #regex p captures everything from <FITID> up to the next <tag>, but excludes the next "<".
-    #p produces 2 results:  r.group(1) = <FITID> field, r.group(2)=value
-    #the ^<\s prevents matching on the next < or newline
-    p = re.compile(r'(<FITID>)([^<\s]+)',re.IGNORECASE)
-
-    #call substitution (inline lamda, takes regex result = r as tuple)
-    ofx_final = p.sub(lambda r: _scrubDiscover_r1(r, accType), ofx)
-   
     if accType=='BASTMT':
-        #regex p captures everything from <TRNTYPE>DEBIT up to the next "<" aftert the <NAME>Check tag and field.
+        #_discoverCheckRe captures everything from <TRNTYPE>DEBIT up to the next "<" aftert the <NAME>Check tag and field.
         # Discover Bank codes checks as
         # <STMTTRN><TRNTYPE>DEBIT<...><NAME>Check ###########</STMTTRN>
-        # p produces 4 results:
+        # 4 groups:
         #   r.group(1) = <TRNTYPE>DEBIT,
         #   r.group(2) = stuff up to next "<NAME>Check "
         #   r.group(3) = "<NAME>Check ", including the trailing spaces (at least 1)
         #   r.group(4) is the check number (1 or more digits)
         # Rearranged, the result should produce a entry that will import the check number in Money
         # <STMTTRN><TRNTYPE>CHECK<...><CHECKNUM>############<NAME>Check</STMTTRN>
-        ofx = ofx_final
-        p = re.compile(r'(<TRNTYPE>DEBIT)([^\s]+)(<NAME>Check[ ]+)([0-9]+)',re.IGNORECASE)
-        ofx_final = p.sub(lambda r: _scrubDiscover_r2(r, accType), ofx)
-
-    return ofx_final
-
-def _scrubDiscover_r1(r, accType):
-    #regex subsitution function: change fitid value
-    global _sD_knownvals
-
-    fieldtag = r.group(1)
-    fitid = r.group(2).strip(' ')
-    fitid_b = fitid                     #base fitid before annotating
-    
-    #strip the serial value for credit card transactions
-    if accType=='CCSTMT': 
-        bx = len(fitid) - 5
-        fitid_b = fitid[:bx]
+        #applied to each transaction, so a check can't match past the end of its <STMTTRN>
+        def check(text):
+            new = _discoverCheckRe.sub(lambda r: _scrubDiscover_r2(r, accType), text)
+            return new if new <> text else None
+        rules.append(ScrubRule(AGGREGATE, ['STMTTRN'], check))
     
-    #find a unique serial#, from 0 to 9999
-    seq = 0   #default
-    while seq < 9999:
-        fitid = fitid_b + str(seq)
-        exists = (fitid in _sD_knownvals)
-        if exists:  #already used it... try another
-            seq=seq+1
-        else:
-            break   #unique value... write it out
-        
-    _sD_knownvals.append(fitid)         #remember the assigned value between calls
-    return fieldtag + fitid             #return the new string for regex.sub()
-
-def _scrubDiscover_r2(r, accType):
-    #regex subsitution function: insert checknum field for BANK statements
-    trntype = r.group(1)
-    rest = r.group(2)
-    name = r.group(3).strip(' ')
-    checknum = r.group(4)
-    return '<TRNTYPE>CHECK' + rest + '<CHECKNUM>' + checknum + name
+    return rules
 
 #--------------------------------    
-def _scrubTime(ofx):
-    #Replace NULL time stamps with noontime (12:00)
-
-    #regex p captures everything from <DT*> up to the next <tag>, but excludes the next "<".
-    #p produces 2 results:  group(1) = <DT*> field, group(2)=dateval
-    p = re.compile(r'(<DT.+?>)([^<\s]+)',re.IGNORECASE)
-    #call date correct function (inline lamda, takes regex result = r tuple)
-    
-    global stat
-    stat = False
-    ofx_final = p.sub(lambda r: _scrubTime_r1(r), ofx)
-    if stat: scrubPrint("Scrubber: Null time values updated.")
-    
-    return ofx_final
-
-def _scrubTime_r1(r):
+def _timeRules():
     # Replace zero and NULL time fields with a "NOON" timestamp (120000)
     # Force "date" to be the same as the date listed, regardless of time zone by setting time to NOON.
     # Applies when no time is given, and when time == MIDNIGHT (000000)
-    global stat
-    fieldtag = r.group(1)
-    DT = r.group(2).strip(' ')      #date+time
-    
-    # Full date/time format example:  20100730000000.000[-4:EDT]
-    if DT[8:] == '' or DT[8:14] == '000000':
-        #null time given.  Adjust to 120000 value (noon).
-        DT = DT[:8] + '120000'
-        stat = True
-        
-    return fieldtag + DT
+    def time(raw, text):
+        if len(raw) < 5 or not text or text[0].isspace(): return None
+        if len(text) >= 14 and text[:14].isdigit() and text[8:14] <> '000000': return None     #the usual case:  has a time
+        # Full date/time format example:  20100730000000.000[-4:EDT]
+        DT = text.split(None, 1)[0]
+        if DT[8:] == '' or DT[8:14] == '000000':
+            #null time given.  Adjust to 120000 value (noon).
+            return DT[:8] + '120000' + text[len(DT):]
+        return None
+    return [ScrubRule(LEAF, ['DT*'], time, "Scrubber: Null time values updated.")]
 
 #--------------------------------    
-def _scrubDTSTART(ofx):
+def _dtstartRules():
     # <DTSTART> field for an account statement must have a matching <DTEND> field
-    # If DTEND is missing, insert <DTEND>="now"
+    # If DTEND is missing, insert <DTEND>="now" after the DTSTART value
     # The assumption is made that only one statement exists in the OFX file (no multi-statement files!)
-    
-    ofx_final = ofx
-    now = datetime.now()
-    nowstr = now.strftime("%Y%m%d%H%M00")
-    
-    if ofx.find('<DTSTART>') >= 0 and ofx.find('<DTEND>') < 0:
-        #we have a dtstart, but no dtend... fix it.
-        scrubPrint("Scrubber: Fixing missing <DTEND> field")
-        
-        #regex p captures everything from <DTSTART> up to the next <tag> or white space into group(1)
-        p = re.compile(r'(<DTSTART>[^<\s]+)',re.IGNORECASE)
-        if Debug: print "DTSTART: findall()=", p.findall(ofx_final)
-        #replace group1 with (group1 + <DTEND> + datetime)
-        ofx_final = p.sub(r'\1<DTEND>'+nowstr, ofx_final)
-    
-    return ofx_final
-
-def _scrubShiftTime(ofx, h):
-    #Shift DTASOF time values by (float) h hours
-    #Added: 15-Feb-2011, rlc
-    
-    #regex p captures everything from <DTASOF> up to the next <tag> or white-space.
-    #p produces 2 results:  group(1) = <DTASOF> field, group(2)=dateval
-    p = re.compile(r'(<DTASOF>)([^<\s]+)',re.IGNORECASE | re.DOTALL)
-    
-    #call date correct function (inline lamda, takes regex result = r tuple)
-    if p.search(ofx): 
-        scrubPrint("Scrubber: Shifting DTASOF time values " + str(h) + " hours.")
-        ofx_final = p.sub(lambda r: _scrubShiftTime_r1(r,h), ofx)    
-
-    return ofx_final
-
-def _scrubShiftTime_r1(r,h):
-    #Shift time value by (float) h hours for regex search result r.
-    #Added: 15-Feb-2011, rlc
-    
-    fieldtag = r.group(1)       #date field tag (e.g., <DTASOF>)
-    DT = r.group(2).strip(' ')  #date+time
-
-    if Debug: print "fieldtag=", fieldtag, "| DT=" + DT
-    
+    nowstr = datetime.now().strftime("%Y%m%d%H%M00")
+    def dtstart(raw, text):
+        if not text or text[0].isspace(): return None
+        DT = text.split(None, 1)[0]
+        return DT + '<DTEND>' + nowstr + text[len(DT):]
+    return [ScrubRule(NOTE, message="Scrubber: Fixing missing <DTEND> field"), 
+            ScrubRule(LEAF, ['DTSTART'], dtstart)]
+
+class _TimeShift:
+    #shifts date/time values by (float) h hours.  the same values tend to repeat throughout a statement,
+    #so the results are saved (for one statement)
+    def __init__(self, h):
+        self.deltaT = timedelta(hours=h)
+        self.memo = {}
+
+    def shift(self, DT):
+        new = self.memo.get(DT)
+        if new is None:
+            new = self.memo[DT] = _shiftTime(DT, self.deltaT)
+        return new
+
+def _shiftTime(DT, deltaT):
+    #return date/time value DT shifted by timedelta deltaT
     # Full date/time format example:  20100730120000.000[-4:EDT]
     #separate into date/time + timezone
     tz = ""
@@ -309,14 +806,34 @@ def _scrubShiftTime_r1(r,h):
     if Debug: scrubPrint("New DT=" + DT + "| tz=" + tz)
     
     #shift the time
-    tval = datetime.strptime(DT,"%Y%m%d%H%M%S")  #convert str to datetime
-    deltaT = timedelta(hours=h)    
-    tval += deltaT                                        #add hours
-    DT = tval.strftime("%Y%m%d%H%M%S") + tz               #convert new datetime to str
-        
-    return fieldtag + DT
-
-def _scrubINVsign(ofx):
+    tval = _parseTime(DT) + deltaT                      #add hours
+    if tval.year < 1900:
+        return tval.strftime("%Y%m%d%H%M%S") + tz       #strftime() error (as before)
+    return '%04d%02d%02d%02d%02d%02d' % (tval.year, tval.month, tval.day, 
+                                         tval.hour, tval.minute, tval.second) + tz
+
+def _parseTime(DT):
+    #convert DT (YYYYMMDDHHMMSS) to a datetime
+    #fixed-width fields for a 14 digit value w/ fields in range.  anything else is left to strptime(), which
+    #accepts some values w/ 1 digit fields, and raises the same errors
+    if len(DT) == 14 and DT.isdigit():
+        f = [int(DT[:4]), int(DT[4:6]), int(DT[6:8]), int(DT[8:10]), int(DT[10:12]), int(DT[12:])]
+        if 1 <= f[1] <= 12 and 1 <= f[2] <= 31 and f[3] <= 23 and f[4] <= 59 and f[5] <= 61:
+            return datetime(*f)
+    return datetime.strptime(DT,"%Y%m%d%H%M%S")
+
+def _shiftTimeRules(h):
+    #Shift DTASOF time values by (float) h hours
+    #Added: 15-Feb-2011, rlc
+    shift = _TimeShift(h)
+    def rule(raw, text):
+        if not text or text[0].isspace(): return None
+        DT = text.split(None, 1)[0]
+        if Debug: print "fieldtag=", raw, "| DT=" + DT
+        return shift.shift(DT) + text[len(DT):]
+    return [ScrubRule(LEAF, ['DTASOF'], rule, "Scrubber: Shifting DTASOF time values " + str(h) + " hours.")]
+
+def _invSignRules():
     #Fix malformed parameters in Investment buy/sell sections, if they exist
     #Issue  first noticed with Fidelity netbenefits 401k accounts:  rlc*2013
     
@@ -327,119 +844,80 @@ def _scrubINVsign(ofx):
     #SELL transactions:
     #   UNITS must be negative
     #   TOTAL must be positive
-    
-    global stat
-    stat = False
-    p = re.compile(r'(<INVBUY>|<INVSELL>)(.+?<UNITS>)(.+?)(<.+?<TOTAL>)([^<\r\n]+)', re.IGNORECASE)
-    ofx_final=p.sub(lambda r: _scrubINVsign_r1(r), ofx)
-    if stat:
-        scrubPrint("Scrubber: Invalid investment sign (pos/neg) found.  Corrected.")
-    
-    return ofx_final
-    
-def _scrubINVsign_r1(r):
-    
-    global stat
-    type=""
-    if "INVBUY"  in r.group(1): type = "INVBUY"
-    if "INVSELL" in r.group(1): type = "INVSELL"
-    qty = r.group(3)
-    total=r.group(5)
-	
-    qty_v=float2(qty)
-    total_v=float2(total)
-    
-    if (type=="INVBUY" and qty_v<0) or (type=="INVSELL" and qty_v>0):
-        stat=True
-        qty=str(-1*qty_v)
-
-    if (type=="INVBUY" and total_v>0) or (type=="INVSELL" and total_v<0):
-        stat=True
-        total=str(-1*total_v)
-    
-    return r.group(1) + r.group(2) + qty + r.group(4) + total
-
-def _scrubREINVESTsign(ofx):
+    return [ScrubRule(AGGREGATE, ['INVBUY', 'INVSELL'], _invSign,
+                      "Scrubber: Invalid investment sign (pos/neg) found.  Corrected.")]
+
+def _invSign(text):
+    #fix the signs for an <INVBUY> or <INVSELL> aggregate
+    return _fixSigns(text, text[:8].upper() == '<INVBUY>')
+
+def _fixSigns(text, buy):
+    #fix the UNITS and TOTAL signs in an INVBUY, INVSELL or REINVEST aggregate (text)
+    #buy = UNITS must be positive and TOTAL negative.  otherwise, the reverse
+    #returns the new text, or None if the signs are ok
+    #only single-line transactions are fixed (from the start tag to the UNITS and TOTAL values), the same as
+    #the original regexes, which never matched across line breaks
+    edits = []
+    found = []
+    last = 0
+    for tag, value, start, end, vstart, vend in ofxdoc.leaves(text, ['UNITS', 'TOTAL']):
+        if tag in found: continue       #first one only
+        found.append(tag)
+        last = max(last, vend)
+        v = float2(value)
+        if tag == 'UNITS' and (v<0 if buy else v>0) or tag == 'TOTAL' and (v>0 if buy else v<0):
+            edits.append((vstart, vend, str(-1*v)))
+    if not edits or '\n' in text[:last] or '\r' in text[:last]: return None
+    return ofxdoc.splice(text, edits)
+
+def _reinvestSignRules():
     #Fix malformed parameters in REINVEST transactions, if they exist
     #Issue  first noticed with Fidelity netbenefits 401k accounts:  cgn*2016
     
     #REINVEST transactions:
     #   UNITS must be positive
     #   TOTAL must be negative
-
-    global stat
-    stat=False
-    p = re.compile(r'(<REINVEST>)(.+?<TOTAL>)(.+?)(<.+?<UNITS>)([^<\r\n]+)', re.IGNORECASE)
-    ofx_final=p.sub(lambda r: _scrubREINVESTsign_r1(r), ofx)
-    if stat:
-        scrubPrint("  +Scrubber: Invalid reinvestment sign (pos/neg) found.  Corrected.")
-    
-    return ofx_final
-    
-def _scrubREINVESTsign_r1(r):
-    global stat
-    qty = r.group(5)
-    total=r.group(3)
-	
-    qty_v=float2(qty)
-    total_v=float2(total)
-    
-    if (qty_v<0):
-        stat=True
-        qty=str(-1*qty_v)
-
-    if (total_v>0):
-        stat=True
-        total=str(-1*total_v)
-    
-    return r.group(1) + r.group(2) + total + r.group(4) + qty
-    
-def _scrubGeneral(ofx):    
-    # General scrub routine for general updates  
-    
-    #1. Remove tag/value pairs that Money doesn't support
-    #define unsupported tags that we've had trouble with
-    uTags = []    
-    uTags.append('CORRECTACTION')
-    uTags.append('CORRECTFITID')
-    
-    for tag in uTags:
-        p = re.compile(r'<'+tag+'>[^<]+',re.IGNORECASE) 
-        if p.search(ofx):
-            ofx = p.sub('',ofx)
-            scrubPrint("Scrubber: <"+tag+"> tags removed.  Not supported by Money.")
-    
-    #2. Replace ampersands '&' that aren't part of a valid escape code (i.e., is NOT like &amp;, &#012; etc)
+    return [ScrubRule(AGGREGATE, ['REINVEST'], _reinvestSign, 
+                      "Scrubber: Invalid reinvestment sign (pos/neg) found.  Corrected.")]
+
+def _reinvestSign(text):
+    #skip transactions already changed to <INCOME> (T. Rowe Price)
+    if text[:10].upper() <> '<REINVEST>': return None
+    return _fixSigns(text, True)
+
+#tag/value pairs that Money doesn't support (that we've had trouble with)
+_unsupportedTags = ['CORRECTACTION', 'CORRECTFITID']
+
+def _unsupportedRules(tag):
+    #remove <tag>value pairs
+    #LATE, so that elements in a removed $0.00 transaction aren't counted
+    p = re.compile(r'<'+tag+'>[^<]+',re.IGNORECASE) 
+    def unsupported(text):
+        new = p.sub('', text)
+        return new if new <> text else None
+    return [ScrubRule(LATE, [tag], unsupported, "Scrubber: <"+tag+"> tags removed.  Not supported by Money.")]
+
+_ampersandRe = re.compile(r'&(?!#?\w+;)')
+
+def _ampersandRules():
+    #Replace ampersands '&' that aren't part of a valid escape code (i.e., is NOT like &amp;, &#012; etc)
     #   literally:  replace '&' chars with '&amp;' when the next chars are not
     #               a '#' or valid alphanumerics followed by a ;
-    p = re.compile(r'&(?!#?\w+;)')
-    if p.search(ofx):
-        scrubPrint("Scrubber: Replace invalid '&' chars with '&amp;'")
-        ofx = p.sub('&amp;',ofx)
-    
-    return ofx
-
-def _scrubRemoveZeroTrans(ofx):
-    #Remove transactions with a $0.00 value
+    def ampersand(text):
+        if '&' not in text or not _ampersandRe.search(text): return None
+        return _ampersandRe.sub('&amp;', text)
+    return [ScrubRule(TEXT, [], ampersand, "Scrubber: Replace invalid '&' chars with '&amp;'")]
 
-    #regex p captures transaction records
-    #p produces 3 results:  group(1) = trans header, group(2)=Amount, group(3)=trans suffix
+#regex captures a transaction record:  group(1) = trans header, group(2)=Amount, group(3)=trans suffix
+_zeroTransRe = re.compile(r'(<STMTTRN>.*?<TRNAMT>)(.+?)(<.*?</STMTTRN>)', flags=re.DOTALL | re.IGNORECASE)
 
-    global stat
-    stat=False
-    p = re.compile(r'(<STMTTRN>.*?<TRNAMT>)(.+?)(<.*?</STMTTRN>)', 
-                   flags=re.DOTALL | re.IGNORECASE)
-
-    ofx = p.sub(lambda r: _scrubRemoveZeroTrans_r1(r), ofx)    
-    if stat: scrubPrint('Zero amount ($0.00) transactions removed.')
-    return ofx
-    
-def _scrubRemoveZeroTrans_r1(r):
-    # return null transaction when amount=0
-    global stat
-    amount = float2(r.group(2))
-    if amount==0: stat=True
-    return None if amount==0 else r.group(1)+r.group(2)+r.group(3) 
+def _removeZeroRules():
+    #Remove transactions with a $0.00 value
+    def removeZero(text):
+        r = _zeroTransRe.search(text)
+        if r is None or float2(r.group(2)) <> 0: return None
+        return text[:r.start()] + text[r.end():]
+    return [ScrubRule(AGGREGATE, ['STMTTRN'], removeZero, 'Zero amount ($0.00) transactions removed.')]
  
 
 #-----------------------------------------------------------------------------
@@ -478,72 +956,78 @@ def _scrubRemoveZeroTrans_r1(r):
 #           Delete <UNITPRICE>#.##
 #           Change </REINVEST> to </INCOME>
 
-def _scrubTRowePrice(ofx):
-    global stat
-    ofx_final = ''      #new ofx message
-    stat = False
-    if Debug: print('Function _scrubTRowePrice(OFX) called')
-
-    #Process all <REINVEST>...</REINVEST> transactions
-    #Use non-greedy quantifier .+? to avoid matching across transactions.
-    p = re.compile(r'<REINVEST>.+?</REINVEST>',re.IGNORECASE)
-    #re.sub() command operates on every non-overlapping occurence of pattern when passed a function for replacement
-    ofx_final = p.sub(lambda r: _scrubTRowePrice_r1(r), ofx)
-
-    if stat: scrubPrint("Scrubber: T Rowe Price dividends/capital gains paid out.")
-
-    return ofx_final
+def _trowePricePaid(ReinvTrans):
+    #if <UNITS>0.0 then convert transaction ReinvTrans from <REINVEST> to <INCOME>
+    #returns the paid out transaction, or None if ReinvTrans isn't one (or can't be parsed)
 
-def _scrubTRowePrice_r1(r):
-    #regex subsitution function: if <UNITS>0.0 then convert transaction from <REINVEST> to <INCOME>
-
-    global stat
+    if '<UNITS>0.0<' not in ReinvTrans.upper(): return None
     
-    #Copy the reinvested transaction for manipulation
-    ReinvTrans = r.group(0)
-    #Create variable for the paid out transaction
-    PaidTrans = ''
-
-    # If units are 0.0 then scrub the ofx transaction
-    if '<UNITS>0.0<' in ReinvTrans.upper():
-        #Flag that at least one transaction is scrubbed
-        stat = True
-
-        #Use regex to parse the REINVEST transaction with following format
-        #<REINVEST>...<MEMO>erroneous memo</INVTRAN>...<INCOMETYPE>DIV or CGSHORT or CGLONG<TOTAL>-#.##<SUBACCTSEC>CASH<UNITS>0.0<UNITPRICE>33.33</REINVEST>
-        #into these 10 groups:
-        #   m.group(1) = <REINVEST>
-        #   m.group(2) = ...<MEMO>
-        #   m.group(3) = erroneous memo
-        #   m.group(4) = </INVTRAN>...<INCOMETYPE>
-        #   m.group(5) = type of income (eg DIV, CGSHORT, CGLONG)
-        #   m.group(6) = <TOTAL>-#.##
-        #   m.group(7) = <SUBACCTSEC>CASH
-        #   m.group(8) = <UNITS>#.###
-        #   m.group(9) = <UNITPRICE>#.##
-        #   m.group(10) = </REINVEST>
-        p = re.compile(r'(<REINVEST>)(<.+?<MEMO>)(.+?[^<]*)(</INVTRAN>.+?<INCOMETYPE>)(.+?[^<]*)(<TOTAL>.+?[^<]*)(<SUBACCTSEC>.+?[^<]*)(<UNITS>.+?[^<]*)(<UNITPRICE>.+?[^<]*)(</REINVEST>)',re.IGNORECASE)
-        m = p.match(ReinvTrans)
-
-        gr01 = '<INCOME>'   #Change from <REINVEST>
-        gr02 = m.group(2)
-        gr04 = m.group(4)
-        gr05 = m.group(5)
-        if     gr05 == 'DIV'     : gr03 = 'DIVIDEND PAID'
-        elif   gr05 == 'CGSHORT' : gr03 = 'SHORT TERM CAP GAIN PAID'
-        elif   gr05 == 'CGLONG'  : gr03 = 'LONG TERM CAPITAL GAIN PAID'
-        else : gr03 = m.group(3)    #Leave as reported
-        gr06 = m.group(6).replace('-','')
-        gr07 = m.group(7) + '<SUBACCTFUND>CASH'
-        #No need to capture m.group(8) since it is deleted
-        #No need to capture m.group(9) since it is deleted
-        gr10 = '</INCOME>'
-        PaidTrans = gr01+gr02+gr03+gr04+gr05+gr06+gr07+gr10
+    #Use regex to parse the REINVEST transaction with following format
+    #<REINVEST>...<MEMO>erroneous memo</INVTRAN>...<INCOMETYPE>DIV or CGSHORT or CGLONG<TOTAL>-#.##<SUBACCTSEC>CASH<UNITS>0.0<UNITPRICE>33.33</REINVEST>
+    #into these 10 groups:
+    #   m.group(1) = <REINVEST>
+    #   m.group(2) = ...<MEMO>
+    #   m.group(3) = erroneous memo
+    #   m.group(4) = </INVTRAN>...<INCOMETYPE>
+    #   m.group(5) = type of income (eg DIV, CGSHORT, CGLONG)
+    #   m.group(6) = <TOTAL>-#.##
+    #   m.group(7) = <SUBACCTSEC>CASH
+    #   m.group(8) = <UNITS>#.###
+    #   m.group(9) = <UNITPRICE>#.##
+    #   m.group(10) = </REINVEST>
+    m = _trowePriceTransRe.match(ReinvTrans)
+    if m is None: return None
+
+    gr01 = '<INCOME>'   #Change from <REINVEST>
+    gr02 = m.group(2)
+    gr04 = m.group(4)
+    gr05 = m.group(5)
+    if     gr05 == 'DIV'     : gr03 = 'DIVIDEND PAID'
+    elif   gr05 == 'CGSHORT' : gr03 = 'SHORT TERM CAP GAIN PAID'
+    elif   gr05 == 'CGLONG'  : gr03 = 'LONG TERM CAPITAL GAIN PAID'
+    else : gr03 = m.group(3)    #Leave as reported
+    gr06 = m.group(6).replace('-','')
+    gr07 = m.group(7) + '<SUBACCTFUND>CASH'
+    #No need to capture m.group(8) since it is deleted
+    #No need to capture m.group(9) since it is deleted
+    gr10 = '</INCOME>'
+    PaidTrans = gr01+gr02+gr03+gr04+gr05+gr06+gr07+gr10
 
     if Debug: print('Reinv Trans: '+ReinvTrans)
     if Debug: print('Paid  Trans: '+PaidTrans)
 
-    return PaidTrans             #return the new string for regex.sub()
+    return PaidTrans
+
+_trowePriceRe = re.compile(r'<REINVEST>.+?</REINVEST>',re.IGNORECASE)
+_trowePriceTransRe = re.compile(r'(<REINVEST>)(<.+?<MEMO>)(.+?[^<]*)(</INVTRAN>.+?<INCOMETYPE>)(.+?[^<]*)(<TOTAL>.+?[^<]*)(<SUBACCTSEC>.+?[^<]*)(<UNITS>.+?[^<]*)(<UNITPRICE>.+?[^<]*)(</REINVEST>)',re.IGNORECASE)
+
+def _trowePriceRules(site):
+    #T. Rowe Price statements:  applied to each <REINVEST> aggregate
+    def reinvest(text):
+        r = _trowePriceRe.search(text)
+        if r is None: return None
+        new = _trowePricePaid(r.group(0))
+        if new is None: return None
+        return text[:r.start()] + new + text[r.end():]
+    return [ScrubRule(AGGREGATE, ['REINVEST'], reinvest, 
+                      "Scrubber: T Rowe Price dividends/capital gains paid out.")]
     
 # end t.rowe.price div reinvest scrubber
 #-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# site-specific scrub table, by server domain.  a site's server host (e.g., OFX.DISCOVERCARD.COM) 
+# or any parent domain (DISCOVERCARD.COM) selects the site's rules:  fn(site) returns a list of ScrubRules
+_siteRuleTable = {
+    'DISCOVERCARD.COM': _discoverRules,     #Discover Card and Bank
+    'TROWEPRICE.COM':   _trowePriceRules
+    }
+
+def _siteRules(site):
+    #return the site-specific rules function for site, or None
+    host = FieldVal(site, 'HOST') or site_cfg.urlHost(FieldVal(site, 'url'))
+    labels = host.split('.')
+    for i in range(len(labels)-1):
+        fn = _siteRuleTable.get('.'.join(labels[i:]))
+        if fn: return fn
+    return None
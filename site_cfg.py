@@ -41,11 +41,51 @@
 #   -remove enableYahooScrape option
 # 06Dec2017*rlc
 #   -add GoogleURL as sites.dat option
+# 18Oct2026*rlc
+#   -add downloadWorkers and maxSiteConnections options (concurrent account downloads)
+#   -add batch option for site entries
+#   -add incremental and incrementalOverlap options
+#   -add compress option for site entries
+#   -add getSiteCfg(), a shared site_cfg instance that's reloaded only when sites.dat changes (mtime or size)
+#   -read sites.dat once per load (was read separately for sites, stocks and funds)
+#   -save the parsed configuration to sites.cache, keyed by a hash of sites.dat.  later loads use the cache 
+#    until sites.dat (or the cache format/default appid) changes
+#   -compile ticker regex patterns once
+#   -add HOST (url host name, upper case) to site entries
+#   -add siteNames (sorted) and fid, bankid, brokerid and host indexes for site lookups (empty w/o a sites.dat)
+#   -add combineMaxBytes and combineMaxTrans options (split combined ofx files)
+#   -add scrubWorkers option (scrubber.ScrubPool)
 
-import os, glob, re, random
+import os, glob, re, random, threading, md5, cPickle, urllib2
 from rlib1 import *
 from control2 import *
 
+CACHE_VERSION = 4                   #increment when the parsed format (site_cfg attributes) changes
+
+#ticker line options.  see parseTicker()
+_tickerRe = re.compile("(.+?) ")         #ticker symbol is first option
+_multRe   = re.compile(" M:(.+?) ")      #multiplier option
+_symbolRe = re.compile(" S:(.+?) ")      #symbol to pass to Money (optional)
+
+_siteCfg = None                     #shared instance.  see getSiteCfg()
+_siteCfgLock = threading.Lock()
+
+def urlHost(url):
+    #host name for url, in upper case and w/o a port number.  'https://ofx.test.com:443/a/b' -> 'OFX.TEST.COM'
+    host = urllib2.splithost(urllib2.splittype(url)[1])[0] or ''
+    return host.split(':')[0].upper()
+
+def getSiteCfg():
+    #return the shared site_cfg instance, loading it on first use.  
+    #sites.dat is re-read (in place, so existing references see the changes) if it has changed since it was loaded
+    global _siteCfg
+    with _siteCfgLock:
+        if _siteCfg is None:
+            _siteCfg = site_cfg()
+        elif _siteCfg.changed():
+            _siteCfg.__init__()
+    return _siteCfg
+
 class site_cfg:
     """read-in site and ticker data from sites.dat and define the data structures used by ofx.py"""
     
@@ -88,6 +128,7 @@ class site_cfg:
         self.datfile= 'sites.dat'
         self.bakfile= 'sites.bak'
         self.tmplfile = 'sites.template'
+        self.cachefile = 'sites.cache'
         self.savetickersfirst = False
         self.savequotehistory = False
         self.showquotehtm = False
@@ -102,6 +143,15 @@ class site_cfg:
         self.enableGoogleFinance = True
         self.skipZeroTransactions = False
         self.skipFailedLogon = True
+        self.downloadWorkers = 1
+        self.maxSiteConnections = 1
+        self.scrubWorkers = 1
+        self.incremental = False
+        self.incrementalOverlap = 3
+        self.combineMaxBytes = 0
+        self.combineMaxTrans = 0
+        self.stamp = None           #[mtime, size] of datfile when loaded
+        self.build_index()          #empty, unless sites.dat is loaded
     
         if glob.glob(self.datfile) == []:
             if glob.glob(self.bakfile) <> []:
@@ -115,10 +165,19 @@ class site_cfg:
             self.load_cfg()
         
     def load_cfg(self):
-        #read in sites.dat
-        self.load_sites()
-        self.load_stocks()
-        self.load_funds()
+        #read in sites.dat, or the parsed copy in cachefile if it's current
+        self.stamp = self._stamp()
+        f = open(self.datfile, 'r')
+        content = f.read()
+        f.close()
+        
+        key = md5.md5('|'.join([content, str(CACHE_VERSION), DefaultAppID, DefaultAppVer])).digest()
+        if self.load_cache(key): return
+        
+        lines = content.splitlines(True)
+        self.load_sites(lines)
+        self.load_stocks(lines)
+        self.load_funds(lines)
         
         #sanity check: alternate Yahoo URL should only contain site address
         YAHOOURL = self.YahooURL.upper()
@@ -127,12 +186,66 @@ class site_cfg:
             self.YahooURL = self.YahooURL[:i]
             print " * YahooURL truncated to", self.YahooURL, "\n"
         
-    def load_sites(self):
-        f = open(self.datfile, 'r')
+        self.save_cache(key)
+        
+    def _cached(self):
+        #attributes loaded from sites.dat (everything but the file names and stamp)
+        return dict([k, v] for k, v in self.__dict__.items() 
+                    if k not in ['datfile', 'bakfile', 'tmplfile', 'cachefile', 'stamp'])
+    
+    def load_cache(self, key):
+        #load the parsed configuration from cachefile if it was saved for key.  returns True if loaded
+        try:
+            f = open(self.cachefile, 'rb')
+            try:
+                if cPickle.load(f) <> key: return False
+                self.__dict__.update(cPickle.load(f))
+            finally:
+                f.close()
+        except Exception:
+            #missing, stale format, or damaged... parse sites.dat instead
+            return False
+        return True
+    
+    def save_cache(self, key):
+        try:
+            f = open(self.cachefile, 'wb')
+            cPickle.dump(key, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(self._cached(), f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+        except (IOError, OSError):
+            pass        #read-only folder, etc.  not fatal
+        
+    def build_index(self):
+        #sorted site names, and site lookup tables by FID, BANKID, BROKERID and url HOST.
+        #fid/bankid/brokerid map to the first (alphabetical) site w/ that value.  host maps to a list of sites
+        self.siteNames = sorted(self.sites)
+        self.fidIndex = {}
+        self.bankidIndex = {}
+        self.brokeridIndex = {}
+        self.hostIndex = {}
+        for name in self.siteNames:
+            site = self.sites[name]
+            for index, field in [[self.fidIndex, 'FID'], [self.bankidIndex, 'BANKID'], [self.brokeridIndex, 'BROKERID']]:
+                if site[field] and site[field] not in index: index[site[field]] = name
+            self.hostIndex.setdefault(site['HOST'], []).append(name)
+        
+    def _stamp(self):
+        try:
+            st = os.stat(self.datfile)
+            return [st.st_mtime, st.st_size]
+        except OSError:
+            return None
+    
+    def changed(self):
+        #has sites.dat changed (or been created) since it was loaded?
+        return self._stamp() <> self.stamp
+        
+    def load_sites(self, lines):
         parsing = False
 
         #find each <site> entry and read-in the parameters
-        for line in f:
+        for line in lines:
             line  = self.clean_line(line)    #remove comments, spaces, tabs, newlines, etc
             lineU = line.upper()
 
@@ -151,6 +264,8 @@ class site_cfg:
                 mininterval = 0
                 timeOffset = 0.0
                 delay = 0.0
+                batch = False
+                compress = False
                 
             if '<SITE>' in lineU:
                 parsing = True
@@ -170,7 +285,10 @@ class site_cfg:
                              'APPVER': appver,
                         'MININTERVAL': mininterval,
                          'TIMEOFFSET': timeOffset,
-                              'DELAY': delay}
+                              'DELAY': delay,
+                              'BATCH': batch,
+                           'COMPRESS': compress,
+                               'HOST': urlHost(url)}
                         }
                     self.sites.update(X)
                 
@@ -193,6 +311,8 @@ class site_cfg:
                     elif field == 'MININTERVAL': mininterval = int(value)
                     elif field == 'TIMEOFFSET': timeOffset = float(value)
                     elif field == 'DELAY': delay = float(value)
+                    elif field == 'BATCH': batch = (value[:1].upper() == 'Y')
+                    elif field == 'COMPRESS': compress = (value[:1].upper() == 'Y')
                 
                 else:
                     #look for individual parameters while we're NOT parsing site info
@@ -249,21 +369,41 @@ class site_cfg:
 
                     if field == 'SKIPFAILEDLOGON':
                         self.skipFailedLogon = (value[:1].upper() == 'Y')  
+
+                    if field == 'DOWNLOADWORKERS':
+                        self.downloadWorkers = max(1, int2(value))
+
+                    if field == 'MAXSITECONNECTIONS':
+                        self.maxSiteConnections = max(1, int2(value))
+
+                    if field == 'SCRUBWORKERS':
+                        self.scrubWorkers = max(0, int2(value))
+
+                    if field == 'INCREMENTAL':
+                        self.incremental = (value[:1].upper() == 'Y')
+
+                    if field == 'INCREMENTALOVERLAP':
+                        self.incrementalOverlap = max(0, int2(value))
+
+                    if field == 'COMBINEMAXBYTES':
+                        self.combineMaxBytes = max(0, int2(value))
+
+                    if field == 'COMBINEMAXTRANS':
+                        self.combineMaxTrans = max(0, int2(value))
                     
            #end_for line
         
-        f.close()
-        
         if self.askquotehtm: self.showquotehtm = False  #can't have both.  Asking overrides "always"
         
+        self.build_index()
+        
         return
         
-    def load_stocks(self):
-        f = open(self.datfile, 'r')
+    def load_stocks(self, lines):
         parsing = False
 
         #find each stock entry and read-in the parameters
-        for line in f:
+        for line in lines:
             line = line.upper()
             line = self.clean_line(line)
             
@@ -279,15 +419,13 @@ class site_cfg:
                     self.stocks.append(entry)
         #end_for    
         
-        f.close()
         return
         
-    def load_funds(self):
-        f = open(self.datfile, 'r')
+    def load_funds(self, lines):
         parsing = False
 
         #find each stock entry and read-in the parameters
-        for line in f:
+        for line in lines:
             line = line.upper()
             line = self.clean_line(line)
             
@@ -303,17 +441,13 @@ class site_cfg:
                     self.funds.append(entry)
         #end_for    
         
-        f.close()
         return
     
     def parseTicker(self, line):
-        t = re.compile("(.+?) ")         #ticker symbol is first option
-        m = re.compile(" M:(.+?) ")      #multiplier option
-        s = re.compile(" S:(.+?) ")      #symbol to pass to Money (optional)
         line += " "                      #pad a space onto the end for re.search
-        tr = t.search(line)
-        mr = m.search(line)
-        sr = s.search(line)
+        tr = _tickerRe.search(line)
+        mr = _multRe.search(line)
+        sr = _symbolRe.search(line)
         if tr: ticker=tr.group(1) 
         else: ticker = "err"
         if mr: multiplier=float2(mr.group(1)) 